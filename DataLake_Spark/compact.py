@@ -0,0 +1,136 @@
+"""
+Compaction of the parquet files of the data lake
+
+Each folder of a table (each partition for the partitioned tables) that holds more files than needed for its size
+is rewritten into files of about the target size (TARGET_FILE_MB in dl.cfg):
+1. the files of the folder are read and written again in <folder>/_compacting (ignored by the readers)
+2. the new files are moved into the folder, then the old files are deleted
+
+WARNING: do not run the compaction while etl.py writes the same tables
+"""
+import os
+import math
+import argparse
+from collections import defaultdict
+
+from etl import create_spark_session, output_path, target_file_mb, songs_layout
+
+
+TABLES = ['songs', 'artists', 'users', 'time', 'songplays']
+
+# columns the rows of a clustered table are hashed and sorted on (same layout as etl.write_table)
+CLUSTER_COLS = {'songs': ['artist_id']} if songs_layout == 'bucketed' else {}
+
+
+def get_filesystem(spark, path):
+    """
+    This function return the Hadoop filesystem (local, HDFS or S3) and the Hadoop path of a location
+
+    Argument:
+    - spark : spark session
+    - path : location
+    """
+    hadoop_path = spark._jvm.org.apache.hadoop.fs.Path(path)
+    return hadoop_path.getFileSystem(spark._jsc.hadoopConfiguration()), hadoop_path
+
+
+def list_folders(spark, table_path):
+    """
+    This function list the parquet files of a table grouped by folder, with their size in bytes
+
+    Argument:
+    - spark : spark session
+    - table_path : location of the table
+    """
+    fs, root = get_filesystem(spark, table_path)
+
+    folders = defaultdict(list)
+    files = fs.listFiles(root, True)
+    while files.hasNext():
+        status = files.next()
+        path = status.getPath()
+        if path.getName().endswith('.parquet') and '/_' not in path.toString()[len(root.toString()):]:
+            folders[path.getParent().toString()].append((path.toString(), status.getLen()))
+
+    return folders
+
+
+def compact_folder(spark, folder, files, target_mb, dry_run=False, cluster_cols=None):
+    """
+    This function rewrite the files of a folder into files of about target_mb.
+    Returns the number of files removed.
+
+    Argument:
+    - spark : spark session
+    - folder : location of the folder
+    - files : list of (path, size) of the parquet files of the folder
+    - target_mb : target size of the files in MB
+    - dry_run : True to only print what would be done
+    - cluster_cols : columns the rows are clustered and sorted on (clustered tables keep their layout)
+    """
+    size = sum(file_size for path, file_size in files)
+    num_files = max(1, math.ceil(size / (target_mb * 1024 * 1024)))
+    if len(files) <= num_files:
+        return 0
+
+    print('    ----> {}: {} files ({:.1f} MB) -> {} files'.format(folder, len(files), size / 1024 / 1024, num_files))
+    if dry_run:
+        return len(files) - num_files
+
+    # write the new files next to the old ones (folders starting with _ are ignored by the readers)
+    fs, folder_path = get_filesystem(spark, folder)
+    tmp = folder + '/_compacting'
+    df = spark.read.parquet(*[path for path, file_size in files])
+    if cluster_cols:
+        df = df.repartition(num_files, *cluster_cols).sortWithinPartitions(*cluster_cols)
+    else:
+        df = df.repartition(num_files)
+    df.write.mode('overwrite').parquet(tmp)
+
+    # move the new files into the folder, then delete the old files
+    tmp_fs, tmp_path = get_filesystem(spark, tmp)
+    for status in tmp_fs.listStatus(tmp_path):
+        if status.getPath().getName().endswith('.parquet'):
+            fs.rename(status.getPath(), spark._jvm.org.apache.hadoop.fs.Path(folder_path, status.getPath().getName()))
+    for path, file_size in files:
+        fs.delete(spark._jvm.org.apache.hadoop.fs.Path(path), False)
+    fs.delete(tmp_path, True)
+
+    return len(files) - num_files
+
+
+def compact_table(spark, table_path, target_mb, dry_run=False, cluster_cols=None):
+    """
+    This function compact every folder of a table
+
+    Argument:
+    - spark : spark session
+    - table_path : location of the table
+    - target_mb : target size of the files in MB
+    - dry_run : True to only print what would be done
+    - cluster_cols : columns the rows are clustered and sorted on (clustered tables keep their layout)
+    """
+    folders = list_folders(spark, table_path)
+    removed = sum(compact_folder(spark, folder, files, target_mb, dry_run, cluster_cols) for folder, files in sorted(folders.items()))
+
+    print('    ----> {}: {} folders, {} files {}\n'.format(table_path, len(folders), removed,
+                                                            'to remove' if dry_run else 'removed'))
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge the small parquet files of the data lake tables')
+    parser.add_argument('--tables', default=','.join(TABLES), help='tables to compact (comma separated)')
+    parser.add_argument('--target-file-mb', type=int, default=target_file_mb, help='target size of the files (TARGET_FILE_MB in dl.cfg)')
+    parser.add_argument('--dry-run', action='store_true', help='only print the folders that would be compacted')
+    args = parser.parse_args()
+
+    spark = create_spark_session()
+
+    for table in args.tables.split(','):
+        compact_table(spark, os.path.join(output_path, table, table + '.parquet'), args.target_file_mb, args.dry_run,
+                      CLUSTER_COLS.get(table))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
 import configparser
 from datetime import datetime
 import os
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import udf, col
+import json
+import math
+import random
+import shutil
+import argparse
+from functools import reduce
+from pyspark import StorageLevel
+from pyspark.sql import SparkSession, Window
+from pyspark.sql.functions import col, lit, broadcast, row_number, max as max_
 from pyspark.sql.functions import year, month, dayofmonth, dayofweek, hour, weekofyear, date_format
 from pyspark.sql.functions import monotonically_increasing_id
-from pyspark.sql.types import TimestampType
+from pyspark.sql.types import StructType, StructField, StringType, DoubleType, LongType, NullType, TimestampType
 
 
 config = configparser.ConfigParser()
@@ -17,6 +24,62 @@ os.environ['AWS_SECRET_ACCESS_KEY']  = config['AWS']['AWS_SECRET_ACCESS_KEY']
 input_path   = config['PATH']['INPUT_PATH']
 output_path  = config['PATH']['OUTPUT_PATH']
 
+# persistence of the frames reused by several tables: none, memory_and_disk or checkpoint (local Parquet copy)
+persist_mode     = config.get('SPARK', 'PERSIST', fallback='memory_and_disk')
+checkpoint_path  = config.get('SPARK', 'CHECKPOINT_PATH', fallback='/tmp/sparkify_checkpoint')
+
+# incremental mode: list of the input files already processed
+state_file       = config.get('SPARK', 'STATE_FILE', fallback='etl_state.json')
+
+# layout of the output: target size of the parquet files, maximum number of rows per file (0 = no limit)
+# and layout of the songs table (partitioned: one folder per year and artist, bucketed: files clustered by artist_id)
+target_file_mb        = config.getint('SPARK', 'TARGET_FILE_MB', fallback=128)
+max_records_per_file  = config.getint('SPARK', 'MAX_RECORDS_PER_FILE', fallback=0)
+songs_layout          = config.get('SPARK', 'SONGS_LAYOUT', fallback='partitioned')
+
+PERSIST_MODES = ['none', 'memory_and_disk', 'checkpoint']
+
+
+# Schemas of the JSON files: no inference pass over the files and the same types at every run.
+# Malformed lines are kept in _corrupt_record (PERMISSIVE mode) and filtered out.
+CORRUPT_RECORD = '_corrupt_record'
+
+SONG_SCHEMA = StructType([
+    StructField('artist_id', StringType()),
+    StructField('artist_latitude', DoubleType()),
+    StructField('artist_location', StringType()),
+    StructField('artist_longitude', DoubleType()),
+    StructField('artist_name', StringType()),
+    StructField('duration', DoubleType()),
+    StructField('num_songs', LongType()),
+    StructField('song_id', StringType()),
+    StructField('title', StringType()),
+    StructField('year', LongType()),
+    StructField(CORRUPT_RECORD, StringType()),
+])
+
+LOG_SCHEMA = StructType([
+    StructField('artist', StringType()),
+    StructField('auth', StringType()),
+    StructField('firstName', StringType()),
+    StructField('gender', StringType()),
+    StructField('itemInSession', LongType()),
+    StructField('lastName', StringType()),
+    StructField('length', DoubleType()),
+    StructField('level', StringType()),
+    StructField('location', StringType()),
+    StructField('method', StringType()),
+    StructField('page', StringType()),
+    StructField('registration', DoubleType()),
+    StructField('sessionId', LongType()),
+    StructField('song', StringType()),
+    StructField('status', LongType()),
+    StructField('ts', LongType()),
+    StructField('userAgent', StringType()),
+    StructField('userId', StringType()),
+    StructField(CORRUPT_RECORD, StringType()),
+])
+
 
 def create_spark_session():
     """
@@ -33,28 +96,300 @@ def create_spark_session():
     return spark
 
 
-def process_song_data(spark, input_data, output_data):
+def read_json(spark, path, schema):
+    """
+    This function read JSON files with a predefined schema (no inference) and drop the malformed lines.
+    
+    Argument:
+    - spark : spark session
+    - path : location of the JSON files (glob pattern or list of files)
+    - schema : StructType of the files (with the _corrupt_record column)
+    """
+    df = spark.read \
+              .schema(schema) \
+              .option('mode', 'PERMISSIVE') \
+              .option('columnNameOfCorruptRecord', CORRUPT_RECORD) \
+              .json(path)
+    
+    return df.filter(col(CORRUPT_RECORD).isNull()).drop(CORRUPT_RECORD)
+
+
+def persist_frame(spark, df, name, persist, checkpoint_data):
+    """
+    This function keep a frame that is used by several tables so the JSON files are not read and parsed again
+    for each write.
+    - memory_and_disk : the frame is cached by the executors (spilled to disk when the memory is full)
+    - checkpoint : the frame is written once as Parquet in checkpoint_data and read back (shorter lineage)
+    - none : nothing is kept
+    
+    Argument:
+    - spark : spark session
+    - df : frame to keep
+    - name : name of the frame (folder of the checkpoint)
+    - persist : persistence mode (see PERSIST_MODES)
+    - checkpoint_data : location of the checkpoints
+    """
+    if persist == 'memory_and_disk':
+        return df.persist(StorageLevel.MEMORY_AND_DISK)
+    
+    if persist == 'checkpoint':
+        path = os.path.join(checkpoint_data, name)
+        df.write.mode('overwrite').parquet(path)
+        return spark.read.parquet(path)
+    
+    return df
+
+
+def path_exists(spark, path):
+    """
+    This function check if a path exists (local, HDFS or S3)
+    
+    Argument:
+    - spark : spark session
+    - path : path to check
+    """
+    hadoop_path = spark._jvm.org.apache.hadoop.fs.Path(path)
+    return hadoop_path.getFileSystem(spark._jsc.hadoopConfiguration()).exists(hadoop_path)
+
+
+def load_state(state_data):
+    """
+    This function read the list of the input files already processed (incremental mode)
+    
+    Argument:
+    - state_data : path to the checkpoint file (JSON)
+    """
+    if not os.path.exists(state_data):
+        return {'song_data': [], 'log_data': []}
+    
+    with open(state_data) as f:
+        return json.load(f)
+
+
+def save_state(state_data, state):
+    """
+    This function save the list of the input files already processed (incremental mode).
+    The file is replaced atomically so an interrupted run never leaves a partial list.
+    
+    Argument:
+    - state_data : path to the checkpoint file (JSON)
+    - state : dictionary with the files processed for song_data and log_data
+    """
+    with open(state_data + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(state_data + '.tmp', state_data)
+
+
+def get_new_files(spark, path, schema, processed):
+    """
+    This function list the input files that were not processed yet (the files are listed, not read)
+    
+    Argument:
+    - spark : spark session
+    - path : location of the JSON files (glob pattern)
+    - schema : StructType of the files
+    - processed : list of the files already processed
+    """
+    files = spark.read.schema(schema).json(path).inputFiles()
+    return sorted(set(files) - set(processed))
+
+
+def merge_with_existing(spark, df, path, keys, partition_cols=None):
+    """
+    This function merge new rows with the rows already written in a table (incremental mode).
+    - partitioned table: only the partitions touched by the new rows are read, they are then replaced
+      with a dynamic partition overwrite (the other partitions are not rewritten)
+    - table without partition: the whole table is read and replaced
+    The rows are deduplicated on keys (the new row wins). The result is checkpointed because the files read
+    here are deleted by the write.
+    
+    Argument:
+    - spark : spark session
+    - df : new rows
+    - path : location of the table
+    - keys : columns identifying a row
+    - partition_cols : partition columns of the table
+    """
+    if not path_exists(spark, path):
+        return df
+    
+    existing = spark.read.parquet(path)
+    if partition_cols:
+        touched = broadcast(df.select(partition_cols).distinct())
+        condition = reduce(lambda a, b: a & b, [existing[c].eqNullSafe(touched[c]) for c in partition_cols])
+        existing = existing.join(touched, condition, 'left_semi')
+    
+    merged = df.withColumn('_new', lit(1)).unionByName(existing.withColumn('_new', lit(0)))
+    window = Window.partitionBy(*keys).orderBy(col('_new').desc())
+    merged = merged.withColumn('_rank', row_number().over(window)) \
+                   .filter(col('_rank') == 1) \
+                   .drop('_rank', '_new')
+    
+    return merged.checkpoint(eager=True)
+
+
+def estimate_num_files(spark, df, target_mb):
+    """
+    This function estimate the number of files needed to write a frame with files of about target_mb,
+    from the size estimated by the Spark optimizer (capped by spark.sql.shuffle.partitions)
+    
+    Argument:
+    - spark : spark session
+    - df : frame to write
+    - target_mb : target size of the files in MB
+    """
+    size = int(df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes().toString())
+    max_files = int(spark.conf.get('spark.sql.shuffle.partitions'))
+    
+    return max(1, min(math.ceil(size / (target_mb * 1024 * 1024)), max_files))
+
+
+def write_table(spark, df, path, partition_cols=None, keys=None, incremental=False, cluster_cols=None,
+                target_mb=target_file_mb, max_records=max_records_per_file):
+    """
+    This function write a table to parquet files, merged with the rows already written in incremental mode.
+    The rows are repartitioned right before the write so the files have about the target size:
+    - partitioned table: the rows of a partition go to the same task (one file per partition folder)
+    - clustered table: the rows are hashed on cluster_cols and sorted in each file (like buckets),
+      the readers skip the files and row groups that do not contain the value they look for
+    
+    Argument:
+    - spark : spark session
+    - df : rows of the table
+    - path : location of the table
+    - partition_cols : partition columns of the table (one folder per value)
+    - keys : columns identifying a row (incremental mode)
+    - incremental : True to merge the rows with the existing table (see merge_with_existing)
+    - cluster_cols : columns used to cluster and sort the rows of a table without partitions
+    - target_mb : target size of the files in MB
+    - max_records : maximum number of rows per file, splits the large partitions (0 = no limit)
+    """
+    if incremental:
+        df = merge_with_existing(spark, df, path, keys, partition_cols)
+    
+    num_files = estimate_num_files(spark, df, target_mb)
+    if partition_cols:
+        df = df.repartition(num_files, *partition_cols)
+    elif cluster_cols:
+        df = df.repartition(num_files, *cluster_cols).sortWithinPartitions(*cluster_cols)
+    else:
+        df = df.repartition(num_files)
+    
+    writer = df.write.mode("overwrite")
+    if max_records:
+        writer = writer.option("maxRecordsPerFile", max_records)
+    if partition_cols:
+        writer = writer.partitionBy(*partition_cols)
+    writer.parquet(path)
+
+
+def read_song_lookup(spark, output_data):
+    """
+    This function build the lookup (title, artist_name) -> (song_id, artist_id) from the songs and artists
+    tables already written (incremental mode: the new logs can refer to songs loaded by a previous run)
+    
+    Argument:
+    - spark : spark session
+    - output_data : location of the tables
+    """
+    songs_path = os.path.join(output_data, 'songs', 'songs.parquet')
+    artists_path = os.path.join(output_data, 'artists', 'artists.parquet')
+    if not path_exists(spark, songs_path) or not path_exists(spark, artists_path):
+        return spark.createDataFrame([], 'title string, artist_name string, song_id string, artist_id string')
+    
+    songs = spark.read.parquet(songs_path).select(['title', 'artist_id', 'song_id'])
+    artists = spark.read.parquet(artists_path).select(['artist_id', col('name').alias('artist_name')])
+    
+    return songs.join(artists, 'artist_id') \
+                .select(['title', 'artist_name', 'song_id', 'artist_id']) \
+                .dropna(subset=['title', 'artist_name']) \
+                .dropDuplicates(['title', 'artist_name'])
+
+
+def validate_input(spark, path, schema, fraction=0.01, seed=42):
+    """
+    This function check a sample of the JSON files against the predefined schema:
+    the schema inferred from the sample is compared to the expected one and the malformed lines are counted.
+    Returns the list of problems found.
+    
+    Argument:
+    - spark : spark session
+    - path : location of the JSON files (glob pattern)
+    - schema : expected StructType of the files
+    - fraction : fraction of the files checked
+    - seed : seed of the sampling
+    """
+    # list the files without reading them
+    files = spark.read.schema(schema).json(path).inputFiles()
+    rng = random.Random(seed)
+    sample = [f for f in files if rng.random() < fraction] or files[:1]
+    if not sample:
+        return ['no file found in {}'.format(path)]
+
+    print('    ----> Validating {} of {} files in {}'.format(len(sample), len(files), path))
+
+    expected = {field.name: field.dataType for field in schema.fields if field.name != CORRUPT_RECORD}
+    inferred = {field.name: field.dataType for field in spark.read.json(sample).schema.fields
+                if field.name != CORRUPT_RECORD}
+
+    problems = []
+    for name, data_type in inferred.items():
+        if name not in expected:
+            problems.append('unexpected column {} ({})'.format(name, data_type.simpleString()))
+        elif data_type != expected[name] and not isinstance(data_type, NullType) \
+                and not (isinstance(data_type, LongType) and isinstance(expected[name], DoubleType)):
+            # integers are valid doubles and columns that are always null have no type
+            problems.append('column {} is {} instead of {}'.format(name, data_type.simpleString(),
+                                                                    expected[name].simpleString()))
+    for name in expected:
+        if name not in inferred:
+            problems.append('missing column {}'.format(name))
+
+    # malformed lines (the frame is cached: Spark does not allow queries on the corrupt record column only)
+    df = spark.read.schema(schema).option('columnNameOfCorruptRecord', CORRUPT_RECORD).json(sample).cache()
+    corrupt = df.filter(col(CORRUPT_RECORD).isNotNull()).count()
+    df.unpersist()
+    if corrupt:
+        problems.append('{} malformed lines'.format(corrupt))
+
+    for problem in problems:
+        print('        - {}'.format(problem))
+    print('    ----> {} problem(s) found\n'.format(len(problems)))
+
+    return problems
+
+
+def process_song_data(spark, input_data, output_data, persist='none', checkpoint_data=None, song_files=None, incremental=False):
     """
     This function take the songs data from S3, transform them with spark and save them in S3.
     Based on the songs file we create 2 dimension tables:
     - Songs table
     - Artist table
     
+    It returns the lookup (title, artist_name) -> (song_id, artist_id) used to create the fact table.
+    
     Argument:
     - spark : spark session
     - input_data : location of the raw data (here S3)
     - output_data : location to save the data (here S3)
+    - persist : persistence mode of the parsed frames (see persist_frame)
+    - checkpoint_data : location of the checkpoints (persist = checkpoint)
+    - song_files : list of the song files to read (all the files of song_data if not given)
+    - incremental : True to merge the new songs and artists with the tables already written
     """
     print('\n\n    ----> Reading SONG data from S3\n\n')
     
     # get filepath to song data file
-    song_data = os.path.join(input_data, 'song_data/*/*/*/*.json')
+    song_data = song_files or os.path.join(input_data, 'song_data/*/*/*/*.json')
     
-    # read song data file
-    df = spark.read.json(song_data)
+    # read song data file (kept for the songs, artists and lookup)
+    df = persist_frame(spark, read_json(spark, song_data, SONG_SCHEMA), 'song_data', persist, checkpoint_data)
     
-    # Create a temporary view to use later (will be used to create fact table)
-    df.createOrReplaceTempView('songs')
+    # Create a compact lookup (title, artist_name) -> (song_id, artist_id) to use later (will be used to create fact table)
+    song_lookup = df.select(['title', 'artist_name', 'song_id', 'artist_id']) \
+                    .dropna(subset=['title', 'artist_name']) \
+                    .dropDuplicates(['title', 'artist_name'])
+    song_lookup = persist_frame(spark, song_lookup, 'song_lookup', persist, checkpoint_data)
     
     """
     CREATE TABLE DIM 1. SONGS
@@ -66,7 +401,13 @@ def process_song_data(spark, input_data, output_data):
                     .dropDuplicates(["song_id"])
     
     # write songs table to parquet files partitioned by year and artist
-    songs_table.write.partitionBy("year", "artist_id").mode("overwrite").parquet(os.path.join(output_data, 'songs', 'songs.parquet'))
+    # (bucketed layout: files clustered and sorted by artist, no folder per artist)
+    if songs_layout == 'bucketed':
+        write_table(spark, songs_table, os.path.join(output_data, 'songs', 'songs.parquet'),
+                    keys=["song_id"], incremental=incremental, cluster_cols=["artist_id"])
+    else:
+        write_table(spark, songs_table, os.path.join(output_data, 'songs', 'songs.parquet'),
+                    partition_cols=["year", "artist_id"], keys=["song_id"], incremental=incremental)
 
 
     print('    ----> SONGS Table Created\n\n')
@@ -86,13 +427,21 @@ def process_song_data(spark, input_data, output_data):
                       .dropDuplicates(["artist_id"])
     
     # write artists table to parquet files
-    artists_table.write.mode("overwrite").parquet(os.path.join(output_data, 'artists', 'artists.parquet'))
+    write_table(spark, artists_table, os.path.join(output_data, 'artists', 'artists.parquet'),
+                keys=["artist_id"], incremental=incremental)
        
     print('    ----> ARTISTS Table Created\n\n')
+    
+    # the song data is not needed anymore: the cached lookup is computed first (it is lazy),
+    # otherwise the songplays join would read and parse song_data again
+    if persist == 'memory_and_disk':
+        song_lookup.count()
+    df.unpersist()
+    
+    return song_lookup
 
 
-
-def process_log_data(spark, input_data, output_data):
+def process_log_data(spark, input_data, output_data, song_lookup, persist='none', checkpoint_data=None, log_files=None, incremental=False):
     """
     This function take the logs from S3, transform them with spark and save them in S3.
     Based on the logs file we create 2 dimension tables:
@@ -105,21 +454,36 @@ def process_log_data(spark, input_data, output_data):
     - spark : spark session
     - input_data : location of the raw data (here S3)
     - output_data : location to save the data (here S3)
+    - song_lookup : lookup (title, artist_name) -> (song_id, artist_id) returned by process_song_data
+    - persist : persistence mode of the parsed frames (see persist_frame)
+    - checkpoint_data : location of the checkpoints (persist = checkpoint)
+    - log_files : list of the log files to read (all the files of log_data if not given)
+    - incremental : True to merge the new rows with the tables already written
     """
 
     print('\n\n    ----> Reading LOG data from S3\n\n')
     
     # get filepath to log data file
-    log_data = os.path.join(input_data, 'log_data/*.json')
+    log_data = log_files or os.path.join(input_data, 'log_data/*.json')
 
     # read log data file
-    df = spark.read.json(log_data)
+    df = read_json(spark, log_data, LOG_SCHEMA)
     
     # filter by actions for song plays
-    df = df.filter(df.page == "Next Song")
+    df = df.filter(df.page == "NextSong")
     
-    # Create a unique ID for songplay
-    df = df.withColumn("songplay_id", monotonically_increasing_id())
+    # Create a unique ID for songplay (in incremental mode, after the ids already written)
+    songplay_id = monotonically_increasing_id()
+    songplays_path = os.path.join(output_data, 'songplays', 'songplays.parquet')
+    if incremental and path_exists(spark, songplays_path):
+        last_id = spark.read.parquet(songplays_path).select(max_('songplay_id')).first()[0]
+        if last_id is not None:
+            songplay_id = songplay_id + last_id + 1
+    df = df.withColumn("songplay_id", songplay_id)
+    
+    # keep the parsed logs for the users, time and songplays (the ids are also the same in every table)
+    logs = persist_frame(spark, df, 'log_data', persist, checkpoint_data)
+    df = logs
     
     
     """
@@ -135,8 +499,9 @@ def process_log_data(spark, input_data, output_data):
                     .withColumnRenamed('lastName','last_name') \
                     .dropDuplicates(["user_id"])
     
-    # write users table to parquet files
-    users_table.write.mode("overwrite").parquet(os.path.join(output_data, 'users', 'users.parquet'))
+    # write users table to parquet files (in incremental mode the new level of a user replaces the old one)
+    write_table(spark, users_table, os.path.join(output_data, 'users', 'users.parquet'),
+                keys=["user_id"], incremental=incremental)
 
     print('    ----> USERS Table Created\n\n')
 
@@ -148,10 +513,8 @@ def process_log_data(spark, input_data, output_data):
     print('\n\n    ----> Creating TIME Table')
     
     # create timestamp column from original timestamp column (unix ms -> timestamp)
-    # using UDF (User Defined Function)
-    get_timestamp = udf(lambda x: from_unixtime(x), TimestampType())
-    
-    df = df.withColumn('start_time', get_timestamp(df.ts))
+    # native expression (no Python UDF): the rows never leave the JVM and the milliseconds are kept
+    df = df.withColumn('start_time', (col('ts') / 1000).cast(TimestampType()))
    
     # create the base time_table and remove any duplicate date or/and empty values
     time_table = df.select(['start_time']) \
@@ -169,11 +532,12 @@ def process_log_data(spark, input_data, output_data):
     print('    ----> TIME Table Created\n\n')
                           
     # write time table to parquet files partitioned by year and month
-    time_table.write.partitionBy("year", "month").mode("overwrite").parquet(os.path.join(output_data, 'time', 'time.parquet'))
+    write_table(spark, time_table, os.path.join(output_data, 'time', 'time.parquet'),
+                partition_cols=["year", "month"], keys=["start_time"], incremental=incremental)
     
-    # Create a temporary views to create fact table and time table
+    # Create temporary views to create fact table
     df.createOrReplaceTempView('logs')
-    time_table.createOrReplaceTempView('times')
+    song_lookup.createOrReplaceTempView('song_lookup')
                         
     """
     CREATE FACT TABLE: SONGPLAYS
@@ -182,28 +546,123 @@ def process_log_data(spark, input_data, output_data):
     
     print('\n\n    ----> Creating SONGPLAYS Table')
 
+    # the song lookup is small: it is broadcast to every executor and the logs are not shuffled for the join
+    # year and month are derived from start_time (no join with the time table) and the rows are not sorted
     songplays_table = spark.sql(
         """
-        SELECT logs.songplay_id, logs.start_time, logs.userId AS user_id, logs.level, songs.song_id, songs.artist_id,
-               logs.sessionId AS session_id, logs.location, logs.userAgent AS user_agent, times.year, times.month
+        SELECT /*+ BROADCAST(song_lookup) */
+               logs.songplay_id, logs.start_time, logs.userId AS user_id, logs.level,
+               song_lookup.song_id, song_lookup.artist_id, logs.sessionId AS session_id, logs.location,
+               logs.userAgent AS user_agent, year(logs.start_time) AS year, month(logs.start_time) AS month
         FROM logs
-        JOIN songs ON songs.artist_name=logs.artist AND songs.title=logs.song
-        JOIN times ON times.start_time=logs.start_time
-        ORDER BY start_time    
+        JOIN song_lookup ON song_lookup.artist_name=logs.artist AND song_lookup.title=logs.song
         """)
 
     # write songplays table to parquet files partitioned by year and month
-    songplays_table.write.partitionBy("year", "month").mode("overwrite").parquet(os.path.join(output_data, 'songplays', 'songplays.parquet'))
+    # (single shuffle right before the write: one task writes each partition)
+    write_table(spark, songplays_table, songplays_path, partition_cols=["year", "month"],
+                keys=["start_time", "user_id", "session_id"], incremental=incremental)
 
     print('    ----> SONGPLAYS Table Created\n\n')
+    
+    # release the persisted logs (df is a frame derived from them)
+    logs.unpersist()
+
+
+def run_etl(spark, input_data, output_data, persist='none', checkpoint_data=None):
+    """
+    This function run the whole job: the song data is read once and its lookup feeds the songplays
+    of the log data. The persisted frames are released at the end.
+    
+    Argument:
+    - spark : spark session
+    - input_data : location of the raw data (here S3)
+    - output_data : location to save the data (here S3)
+    - persist : persistence mode of the parsed frames (see persist_frame)
+    - checkpoint_data : location of the checkpoints (persist = checkpoint)
+    """
+    song_lookup = process_song_data(spark, input_data, output_data, persist, checkpoint_data)
+    process_log_data(spark, input_data, output_data, song_lookup, persist, checkpoint_data)
+    
+    song_lookup.unpersist()
+    spark.catalog.dropTempView('logs')
+    spark.catalog.dropTempView('song_lookup')
+    
+    # remove the local checkpoints
+    if persist == 'checkpoint' and '://' not in checkpoint_data:
+        shutil.rmtree(checkpoint_data, ignore_errors=True)
+
+
+def run_incremental_etl(spark, input_data, output_data, state_data, persist='none', checkpoint_data=None):
+    """
+    This function run the job on the input files that were not processed by a previous run only
+    (the processed files are listed in the checkpoint file state_data).
+    The new rows are merged with the tables already written: only the partitions of time, songplays and songs
+    that receive new rows are rewritten (dynamic partition overwrite), users and artists are deduplicated.
+    
+    Argument:
+    - spark : spark session
+    - input_data : location of the raw data (here S3)
+    - output_data : location to save the data (here S3)
+    - state_data : path to the checkpoint file (JSON)
+    - persist : persistence mode of the parsed frames (see persist_frame)
+    - checkpoint_data : location of the checkpoints (merges and persist = checkpoint)
+    """
+    spark.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic")
+    spark.sparkContext.setCheckpointDir(os.path.join(checkpoint_data, 'merge'))
+    
+    state = load_state(state_data)
+    
+    song_files = get_new_files(spark, os.path.join(input_data, 'song_data/*/*/*/*.json'), SONG_SCHEMA, state['song_data'])
+    log_files = get_new_files(spark, os.path.join(input_data, 'log_data/*.json'), LOG_SCHEMA, state['log_data'])
+    print('\n\n    ----> {} new song files, {} new log files\n\n'.format(len(song_files), len(log_files)))
+    
+    if song_files:
+        song_lookup = process_song_data(spark, input_data, output_data, persist, checkpoint_data,
+                                        song_files=song_files, incremental=True)
+        song_lookup.unpersist()
+        state['song_data'] = sorted(set(state['song_data']) | set(song_files))
+        save_state(state_data, state)
+    
+    if log_files:
+        # the new logs can refer to songs of a previous run: the lookup is built from the songs table
+        song_lookup = persist_frame(spark, read_song_lookup(spark, output_data), 'song_lookup', persist, checkpoint_data)
+        process_log_data(spark, input_data, output_data, song_lookup, persist, checkpoint_data,
+                         log_files=log_files, incremental=True)
+        song_lookup.unpersist()
+        spark.catalog.dropTempView('logs')
+        spark.catalog.dropTempView('song_lookup')
+        state['log_data'] = sorted(set(state['log_data']) | set(log_files))
+        save_state(state_data, state)
+    
+    # remove the local checkpoints
+    if '://' not in checkpoint_data:
+        shutil.rmtree(checkpoint_data, ignore_errors=True)
+
 
 def main():
+    parser = argparse.ArgumentParser(description='Build the Sparkify data lake from the song and log JSON files')
+    parser.add_argument('--validate', action='store_true', help='check a sample of the input files against the schemas and stop')
+    parser.add_argument('--sample-fraction', type=float, default=0.01, help='fraction of the files checked by --validate')
+    parser.add_argument('--persist', choices=PERSIST_MODES, default=persist_mode, help='persistence of the parsed frames (PERSIST in dl.cfg)')
+    parser.add_argument('--checkpoint-path', default=checkpoint_path, help='location of the checkpoints (CHECKPOINT_PATH in dl.cfg)')
+    parser.add_argument('--incremental', action='store_true', help='only process the input files that are not in the checkpoint file')
+    parser.add_argument('--state-file', default=state_file, help='checkpoint file of the incremental mode (STATE_FILE in dl.cfg)')
+    args = parser.parse_args()
+
     spark = create_spark_session()
     input_data = input_path
     output_data = output_path
     
-    process_song_data(spark, input_data, output_data)    
-    process_log_data(spark, input_data, output_data)
+    if args.validate:
+        problems = validate_input(spark, os.path.join(input_data, 'song_data/*/*/*/*.json'), SONG_SCHEMA, args.sample_fraction)
+        problems += validate_input(spark, os.path.join(input_data, 'log_data/*.json'), LOG_SCHEMA, args.sample_fraction)
+        raise SystemExit(1 if problems else 0)
+
+    if args.incremental:
+        run_incremental_etl(spark, input_data, output_data, args.state_file, args.persist, args.checkpoint_path)
+    else:
+        run_etl(spark, input_data, output_data, args.persist, args.checkpoint_path)
 
     
 if __name__ == "__main__":
@@ -0,0 +1,221 @@
+"""
+This file loads event_datafile_new.csv into the three tables of the project (sessions_library, users_library
+and songs_library) without going through the notebook:
+ - the CSV file is read once and each line is fanned out to the three tables
+ - the INSERT are prepared once (the CQL is not parsed again for each line)
+ - the requests are sent asynchronously with a bounded number of requests in flight (--concurrency)
+ - with --batch, the lines of a chunk are grouped by partition key and sent as UNLOGGED batches:
+   every batch only touches one partition so it is applied by a single replica set
+"""
+import csv
+import time
+import argparse
+from itertools import islice
+from collections import defaultdict
+from cassandra.cluster import Cluster
+from cassandra.query import BatchStatement, BatchType
+from cassandra.concurrent import execute_concurrent
+from cql_queries import *
+from columnar import get_format, read_columnar_events
+
+
+# Position of each column in event_datafile_new.csv
+ARTIST, FIRST_NAME, GENDER, ITEM_IN_SESSION, LAST_NAME, LENGTH, LEVEL, LOCATION, SESSION_ID, SONG, USER_ID = range(11)
+
+# table name, insert query, columns of the partition key, columns inserted (in the order of the query)
+TABLES = [
+    ('sessions_library', session_table_insert, (SESSION_ID,),
+     (SESSION_ID, ITEM_IN_SESSION, ARTIST, SONG, LENGTH)),
+    ('users_library', user_table_insert, (USER_ID, SESSION_ID),
+     (USER_ID, SESSION_ID, ITEM_IN_SESSION, ARTIST, SONG, FIRST_NAME, LAST_NAME)),
+    ('songs_library', song_table_insert, (SONG,),
+     (SONG, USER_ID, FIRST_NAME, LAST_NAME)),
+]
+
+
+def read_events(filepath):
+
+    """
+    This function read the file of events line by line with the values converted to the types of the tables.
+    A columnar file (.parquet or .arrow, see columnar.py) is already typed: nothing is parsed.
+
+    Arguments:
+    - filepath = path to event_datafile_new.csv or to its columnar copy
+    """
+    if get_format(filepath) is not None:
+        yield from read_columnar_events(filepath)
+        return
+
+    with open(filepath, encoding='utf8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)  # header
+        for line in reader:
+            yield (line[ARTIST], line[FIRST_NAME], line[GENDER], int(line[ITEM_IN_SESSION]), line[LAST_NAME],
+                   float(line[LENGTH]), line[LEVEL], line[LOCATION], int(line[SESSION_ID]), line[SONG],
+                   int(line[USER_ID]))
+
+
+def connect(hosts, keyspace='sparkify_database', drop=False):
+
+    """
+    This function connect to the cluster, create the keyspace and the tables if needed and return the session
+
+    Arguments:
+    - hosts = list of contact points of the cluster
+    - keyspace = name of the keyspace
+    - drop = True to drop the tables before creating them
+    """
+    cluster = Cluster(hosts)
+    session = cluster.connect()
+
+    session.execute(keyspace_create.replace('sparkify_database', keyspace))
+    session.set_keyspace(keyspace)
+
+    if drop:
+        for query in drop_table_queries:
+            session.execute(query)
+    for query in create_table_queries:
+        session.execute(query)
+
+    return cluster, session
+
+
+def prepare_tables(session):
+
+    """
+    This function prepare the INSERT of every table once
+
+    Arguments:
+    - session = Session to the cluster
+    """
+    return [(name, session.prepare(query), key, columns) for name, query, key, columns in TABLES]
+
+
+def get_statements(tables, events):
+
+    """
+    This function fan out each event to the INSERT of the three tables (one statement per table and event)
+
+    Arguments:
+    - tables = list of prepared tables (see prepare_tables)
+    - events = iterable of events (see read_events)
+    """
+    for event in events:
+        for name, statement, key, columns in tables:
+            yield statement, tuple(event[i] for i in columns)
+
+
+def get_batches(tables, events, chunk_rows=5000, max_batch_size=50):
+
+    """
+    This function group the events by partition key into UNLOGGED batches.
+    Events are grouped chunk by chunk so the whole file is never held in memory.
+
+    Arguments:
+    - tables = list of prepared tables (see prepare_tables)
+    - events = iterable of events (see read_events)
+    - chunk_rows = number of events grouped together
+    - max_batch_size = maximum number of statements in a batch
+    """
+    events = iter(events)
+    while True:
+        chunk = list(islice(events, chunk_rows))
+        if not chunk:
+            return
+
+        for name, statement, key, columns in tables:
+            # group the rows of the chunk by partition
+            partitions = defaultdict(list)
+            for event in chunk:
+                partitions[tuple(event[i] for i in key)].append(tuple(event[i] for i in columns))
+
+            for rows in partitions.values():
+                for start in range(0, len(rows), max_batch_size):
+                    batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+                    for params in rows[start:start + max_batch_size]:
+                        batch.add(statement, params)
+                    yield batch, None
+
+
+def count_events(events, counter):
+
+    """
+    This function count the events read from the file while they are consumed by the loader
+
+    Arguments:
+    - events = iterable of events
+    - counter = dictionary where the number of events is stored (key 'rows')
+    """
+    for event in events:
+        counter['rows'] += 1
+        yield event
+
+
+def load_events(session, filepath, concurrency=100, batch=False, chunk_rows=5000, max_batch_size=50):
+
+    """
+    This function load the CSV file of events into the three tables and print the throughput
+
+    Arguments:
+    - session = Session to the cluster
+    - filepath = path to event_datafile_new.csv (or to its .parquet/.arrow copy)
+    - concurrency = maximum number of requests in flight
+    - batch = True to send UNLOGGED batches grouped by partition key instead of single INSERT
+    - chunk_rows = number of events grouped together in batch mode
+    - max_batch_size = maximum number of statements in a batch
+    """
+    tables = prepare_tables(session)
+
+    counter = {'rows': 0}
+    events = count_events(read_events(filepath), counter)
+    if batch:
+        requests = get_batches(tables, events, chunk_rows, max_batch_size)
+    else:
+        requests = get_statements(tables, events)
+
+    start = time.perf_counter()
+
+    # the statements are generated lazily: at most `concurrency` requests are in flight
+    errors = []
+    num_requests = 0
+    for success, result in execute_concurrent(session, requests, concurrency=concurrency,
+                                              raise_on_first_error=False, results_generator=True):
+        num_requests += 1
+        if not success:
+            errors.append(result)
+
+    seconds = time.perf_counter() - start
+    rows = counter['rows']
+
+    print('{} rows loaded into {} tables in {:.2f}s ({} requests, {:.0f} rows/sec, {:.0f} writes/sec)'.format(
+          rows, len(tables), seconds, num_requests, rows / seconds if seconds else 0,
+          rows * len(tables) / seconds if seconds else 0))
+
+    if errors:
+        print('{} requests failed, first error: {}'.format(len(errors), errors[0]))
+
+    return rows, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load event_datafile_new.csv into the Cassandra tables')
+    parser.add_argument('--file', default='event_datafile_new.csv', help='CSV file of events (or its .parquet/.arrow copy)')
+    parser.add_argument('--hosts', default='127.0.0.1', help='contact points of the cluster (comma separated)')
+    parser.add_argument('--keyspace', default='sparkify_database', help='keyspace of the tables')
+    parser.add_argument('--drop', action='store_true', help='drop the tables before loading')
+    parser.add_argument('--concurrency', type=int, default=100, help='maximum number of requests in flight')
+    parser.add_argument('--batch', action='store_true', help='send UNLOGGED batches grouped by partition key')
+    parser.add_argument('--chunk-rows', type=int, default=5000, help='number of events grouped together in batch mode')
+    parser.add_argument('--max-batch-size', type=int, default=50, help='maximum number of statements in a batch')
+    args = parser.parse_args()
+
+    cluster, session = connect(args.hosts.split(','), args.keyspace, args.drop)
+
+    try:
+        load_events(session, args.file, args.concurrency, args.batch, args.chunk_rows, args.max_batch_size)
+    finally:
+        cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
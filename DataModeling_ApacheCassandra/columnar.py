@@ -0,0 +1,222 @@
+"""
+This file writes and reads the typed columnar copy of event_datafile_new.csv (Parquet or Arrow IPC)
+ - the numbers (itemInSession, length, sessionId, userId) are stored with their type: the loaders do not
+   parse strings anymore
+ - the columns with many repeated values (artist, song, location, ...) are dictionary-encoded
+ - the Arrow IPC file (.arrow) can be memory-mapped and read without copy, the Parquet file (.parquet) is the smallest
+"""
+import os
+import csv
+import argparse
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+EVENT_SCHEMA = pa.schema([
+    ('artist', pa.dictionary(pa.int32(), pa.string())),
+    ('firstName', pa.dictionary(pa.int32(), pa.string())),
+    ('gender', pa.dictionary(pa.int32(), pa.string())),
+    ('itemInSession', pa.int32()),
+    ('lastName', pa.dictionary(pa.int32(), pa.string())),
+    ('length', pa.float64()),
+    ('level', pa.dictionary(pa.int32(), pa.string())),
+    ('location', pa.dictionary(pa.int32(), pa.string())),
+    ('sessionId', pa.int32()),
+    ('song', pa.dictionary(pa.int32(), pa.string())),
+    ('userId', pa.int32()),
+])
+
+COLUMNAR_FORMATS = {'.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+
+
+def get_format(filepath):
+
+    """
+    This function find the columnar format of a file from its extension (None if it is not a columnar file)
+
+    Arguments:
+    - filepath = path to the file
+    """
+    return COLUMNAR_FORMATS.get(os.path.splitext(filepath)[1].lower())
+
+
+class ColumnarWriter:
+
+    """
+    Write the rows of event_datafile_new.csv (tuples of strings) to a Parquet or Arrow IPC file, chunk by chunk.
+    For the Arrow IPC file, the dictionaries keep growing from one chunk to the next (a value keeps its code),
+    so the file only stores the new values of each chunk (dictionary deltas).
+    For Parquet, each chunk is a row group with its own dictionaries.
+    """
+
+    def __init__(self, output, chunk_rows=65536):
+        self.output = output
+        self.format = get_format(output)
+        if self.format is None:
+            raise ValueError('Unknown columnar format for {} (use .parquet or .arrow)'.format(output))
+
+        self.chunk_rows = chunk_rows
+        self.columns = [[] for field in EVENT_SCHEMA]
+        self.dictionaries = {i: {} for i, field in enumerate(EVENT_SCHEMA) if pa.types.is_dictionary(field.type)}
+        self.num_rows = 0
+
+        if self.format == 'parquet':
+            self.writer = pq.ParquetWriter(output, EVENT_SCHEMA, compression='zstd')
+        else:
+            self.sink = pa.OSFile(output, 'wb')
+            self.writer = pa.ipc.new_file(self.sink, EVENT_SCHEMA,
+                                          options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+
+
+    def write(self, row):
+
+        """
+        Add a row to the current chunk
+
+        Arguments:
+        - row = tuple with the 11 values of a row of event_datafile_new.csv
+        """
+        for values, value in zip(self.columns, row):
+            values.append(value)
+
+        if len(self.columns[0]) >= self.chunk_rows:
+            self.flush()
+
+
+    def flush(self):
+
+        """
+        Convert the current chunk to typed arrays and write it
+        """
+        if not self.columns[0]:
+            return
+
+        arrays = []
+        for i, (field, values) in enumerate(zip(EVENT_SCHEMA, self.columns)):
+            if i in self.dictionaries and self.format == 'parquet':
+                # Parquet stores a dictionary per row group: only keep the values of the chunk
+                arrays.append(pa.array(values, pa.string()).dictionary_encode())
+            elif i in self.dictionaries:
+                dictionary = self.dictionaries[i]
+                codes = [dictionary.setdefault(value, len(dictionary)) for value in values]
+                arrays.append(pa.DictionaryArray.from_arrays(pa.array(codes, pa.int32()),
+                                                             pa.array(list(dictionary), pa.string())))
+            elif pa.types.is_integer(field.type):
+                arrays.append(pa.array([int(value) for value in values], field.type))
+            else:
+                arrays.append(pa.array([float(value) for value in values], field.type))
+
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=EVENT_SCHEMA))
+
+        self.num_rows += len(self.columns[0])
+        self.columns = [[] for field in EVENT_SCHEMA]
+
+
+    def close(self):
+
+        """
+        Write the last chunk and close the file
+        """
+        self.flush()
+        self.writer.close()
+        if self.format == 'arrow':
+            self.sink.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def tee_rows(rows, writer):
+
+    """
+    This function pass the rows through while writing them to a columnar file
+
+    Arguments:
+    - rows = iterable of rows of event_datafile_new.csv
+    - writer = ColumnarWriter
+    """
+    for row in rows:
+        writer.write(row)
+        yield row
+
+
+def csv_to_columnar(csv_path, output, chunk_rows=65536):
+
+    """
+    This function convert event_datafile_new.csv to a columnar file and return the number of rows
+
+    Arguments:
+    - csv_path = path to event_datafile_new.csv
+    - output = path to the columnar file (.parquet or .arrow)
+    - chunk_rows = number of rows converted at once
+    """
+    with open(csv_path, 'r', encoding='utf8', newline='') as f, ColumnarWriter(output, chunk_rows) as writer:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            writer.write(row)
+
+    return writer.num_rows
+
+
+def read_table(filepath):
+
+    """
+    This function read a columnar file into an Arrow table. The Arrow IPC file is memory-mapped (no copy).
+    Use read_table(filepath).to_pandas() to explore the data with pandas.
+
+    Arguments:
+    - filepath = path to the columnar file (.parquet or .arrow)
+    """
+    if get_format(filepath) == 'parquet':
+        return pq.read_table(filepath, memory_map=True)
+
+    return pa.ipc.open_file(pa.memory_map(filepath, 'r')).read_all()
+
+
+def iter_batches(filepath):
+
+    """
+    This function read a columnar file batch by batch
+
+    Arguments:
+    - filepath = path to the columnar file (.parquet or .arrow)
+    """
+    if get_format(filepath) == 'parquet':
+        yield from pq.ParquetFile(filepath, memory_map=True).iter_batches()
+    else:
+        reader = pa.ipc.open_file(pa.memory_map(filepath, 'r'))
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+def read_columnar_events(filepath):
+
+    """
+    This function read the rows of a columnar file as typed tuples (same order as event_datafile_new.csv)
+
+    Arguments:
+    - filepath = path to the columnar file (.parquet or .arrow)
+    """
+    for batch in iter_batches(filepath):
+        yield from zip(*[column.to_pylist() for column in batch.columns])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert event_datafile_new.csv to a columnar file')
+    parser.add_argument('--input', default='event_datafile_new.csv', help='CSV file to convert')
+    parser.add_argument('--output', default='event_datafile_new.parquet', help='columnar file (.parquet or .arrow)')
+    args = parser.parse_args()
+
+    num_rows = csv_to_columnar(args.input, args.output)
+    print('{} rows written to {} ({} bytes, {} bytes for the CSV file)'.format(
+          num_rows, args.output, os.path.getsize(args.output), os.path.getsize(args.input)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+This file builds event_datafile_new.csv from the CSV files of event_data (Part I of Final_Project)
+ - the rows are streamed from the input files straight to the output file: only one row is held in memory
+   at a time, whatever the size of the history
+ - rows without artist (not a song play) are dropped and the 11 columns of the tables are projected on the fly
+ - with --workers, the input files are sharded across processes; each process writes a part file
+   and the parts are concatenated in order into the output file
+ - with --columnar, a typed columnar copy (Parquet or Arrow IPC, see columnar.py) is written as well
+"""
+import os
+import csv
+import glob
+import shutil
+import argparse
+from multiprocessing import Pool
+from columnar import ColumnarWriter, tee_rows, csv_to_columnar
+
+
+# Columns of event_datafile_new.csv and their position in the files of event_data
+EVENT_COLUMNS = ['artist', 'firstName', 'gender', 'itemInSession', 'lastName', 'length',
+                 'level', 'location', 'sessionId', 'song', 'userId']
+SOURCE_INDEXES = (0, 2, 3, 4, 5, 6, 7, 8, 12, 13, 16)
+
+csv.register_dialect('myDialect', quoting=csv.QUOTE_ALL, skipinitialspace=True)
+
+
+def get_files(filepath):
+
+    """
+    This function list all the CSV files in a directory and its subdirectories
+
+    Arguments:
+    - filepath = path to the directory of event_data
+    """
+    all_files = []
+    for root, dirs, files in os.walk(filepath):
+        all_files.extend(glob.glob(os.path.join(root, '*.csv')))
+
+    return sorted(all_files)
+
+
+def read_rows(file_path_list):
+
+    """
+    This function read the rows of every CSV file one by one (header excluded)
+
+    Arguments:
+    - file_path_list = list of paths to the CSV files of event_data
+    """
+    for filepath in file_path_list:
+        with open(filepath, 'r', encoding='utf8', newline='') as csvfile:
+            csvreader = csv.reader(csvfile)
+            next(csvreader, None)
+            for line in csvreader:
+                yield line
+
+
+def project_rows(rows, counter=None):
+
+    """
+    This function drop the rows without artist and keep the 11 columns of event_datafile_new.csv
+
+    Arguments:
+    - rows = iterable of rows of event_data
+    - counter = optional dictionary where the number of rows read is stored (key 'read')
+    """
+    for row in rows:
+        if counter is not None:
+            counter['read'] += 1
+        if row[0] == '':
+            continue
+        yield tuple(row[i] for i in SOURCE_INDEXES)
+
+
+def write_rows(rows, output, header=True):
+
+    """
+    This function write the rows to a CSV file (all the values are quoted) and return the number of rows written
+
+    Arguments:
+    - rows = iterable of projected rows
+    - output = path to the CSV file to write
+    - header = True to write the names of the columns first
+    """
+    num_rows = 0
+    with open(output, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f, dialect='myDialect')
+        if header:
+            writer.writerow(EVENT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            num_rows += 1
+
+    return num_rows
+
+
+def consolidate_event_files(file_path_list, output='event_datafile_new.csv', header=True, columnar_output=None):
+
+    """
+    This function stream the rows of the files of event_data into a single CSV file
+    Returns the number of rows read and the number of rows written
+
+    Arguments:
+    - file_path_list = list of paths to the CSV files of event_data
+    - output = path to the CSV file to write
+    - header = True to write the names of the columns first
+    - columnar_output = optional path to a columnar file (.parquet or .arrow) written in the same pass
+    """
+    counter = {'read': 0}
+    rows = project_rows(read_rows(file_path_list), counter)
+
+    if columnar_output is None:
+        num_written = write_rows(rows, output, header)
+    else:
+        with ColumnarWriter(columnar_output) as writer:
+            num_written = write_rows(tee_rows(rows, writer), output, header)
+
+    return counter['read'], num_written
+
+
+def consolidate_shard(task):
+
+    """
+    This function consolidate a shard of the input files into a part file (run by the worker processes)
+
+    Arguments:
+    - task = tuple (list of paths to CSV files, path to the part file)
+    """
+    file_path_list, output = task
+    return consolidate_event_files(file_path_list, output, header=False)
+
+
+def consolidate_event_files_parallel(file_path_list, output='event_datafile_new.csv', workers=4, columnar_output=None):
+
+    """
+    This function shard the input files across processes and merge the part files in order into the output file,
+    so the rows are written in the same order as consolidate_event_files
+    Returns the number of rows read and the number of rows written
+
+    Arguments:
+    - file_path_list = list of paths to the CSV files of event_data
+    - output = path to the CSV file to write
+    - workers = number of processes
+    - columnar_output = optional path to a columnar file (.parquet or .arrow) converted from the output file
+    """
+    # contiguous shards keep the order of the files
+    shard_size = -(-len(file_path_list) // workers) if file_path_list else 1
+    shards = [file_path_list[i:i + shard_size] for i in range(0, len(file_path_list), shard_size)]
+    tasks = [(shard, '{}.part-{}'.format(output, num)) for num, shard in enumerate(shards)]
+
+    with Pool(workers) as pool:
+        counts = pool.map(consolidate_shard, tasks)
+
+    # merge the parts after the header
+    with open(output, 'w', encoding='utf8', newline='') as f:
+        csv.writer(f, dialect='myDialect').writerow(EVENT_COLUMNS)
+        for shard, part in tasks:
+            with open(part, 'r', encoding='utf8', newline='') as p:
+                shutil.copyfileobj(p, f)
+            os.remove(part)
+
+    if columnar_output is not None:
+        csv_to_columnar(output, columnar_output)
+
+    return sum(read for read, written in counts), sum(written for read, written in counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Consolidate the CSV files of event_data into event_datafile_new.csv')
+    parser.add_argument('--input', default='event_data', help='directory of the CSV files of event_data')
+    parser.add_argument('--output', default='event_datafile_new.csv', help='CSV file to write')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes (1 = no parallelism)')
+    parser.add_argument('--columnar', help='also write a columnar file (.parquet or .arrow)')
+    args = parser.parse_args()
+
+    file_path_list = get_files(args.input)
+    print('{} files found in {}'.format(len(file_path_list), args.input))
+
+    if args.workers > 1 and len(file_path_list) > 1:
+        num_read, num_written = consolidate_event_files_parallel(file_path_list, args.output, args.workers,
+                                                                 args.columnar)
+    else:
+        num_read, num_written = consolidate_event_files(file_path_list, args.output, columnar_output=args.columnar)
+
+    print('{} rows read, {} rows written to {}'.format(num_read, num_written, args.output))
+
+
+if __name__ == "__main__":
+    main()
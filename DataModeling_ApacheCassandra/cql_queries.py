@@ -0,0 +1,74 @@
+# KEYSPACE
+
+keyspace_create = ("""CREATE KEYSPACE IF NOT EXISTS sparkify_database
+                      WITH REPLICATION =
+                      { 'class' : 'SimpleStrategy', 'replication_factor' : 1 }""")
+
+# DROP TABLES
+
+session_table_drop = "DROP TABLE IF EXISTS sessions_library"
+user_table_drop = "DROP TABLE IF EXISTS users_library"
+song_table_drop = "DROP TABLE IF EXISTS songs_library"
+
+# CREATE TABLES
+
+# Query 1: artist, song title and song's length heard during a sessionId and itemInSession
+session_table_create = ("""CREATE TABLE IF NOT EXISTS sessions_library (
+                                        sessionId       int,
+                                        itemInSession   int,
+                                        artist_name     text,
+                                        song_title      text,
+                                        song_length     float,
+
+                                        PRIMARY KEY (sessionId, itemInSession))""")
+
+# Query 2: artist, song (sorted by itemInSession) and user name for a userId and sessionId
+user_table_create = ("""CREATE TABLE IF NOT EXISTS users_library (
+                                        userId          int,
+                                        sessionId       int,
+                                        itemInSession   int,
+                                        artist_name     text,
+                                        song_title      text,
+                                        user_firstName  text,
+                                        user_lastName   text,
+
+                                        PRIMARY KEY ((userId, sessionId), itemInSession))""")
+
+# Query 3: every user name who listened to a song
+song_table_create = ("""CREATE TABLE IF NOT EXISTS songs_library (
+                                        song_title      text,
+                                        userId          int,
+                                        user_firstName  text,
+                                        user_lastName   text,
+
+                                        PRIMARY KEY (song_title, userId))""")
+
+# INSERT RECORDS (prepared statements)
+
+session_table_insert = ("""INSERT INTO sessions_library (sessionId, itemInSession, artist_name, song_title, song_length)
+                           VALUES (?, ?, ?, ?, ?)""")
+
+user_table_insert = ("""INSERT INTO users_library (userId, sessionId, itemInSession, artist_name, song_title, user_firstName, user_lastName)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)""")
+
+song_table_insert = ("""INSERT INTO songs_library (song_title, userId, user_firstName, user_lastName)
+                        VALUES (?, ?, ?, ?)""")
+
+# QUERIES
+
+session_select = ("""SELECT artist_name, song_title, song_length
+                     FROM sessions_library
+                     WHERE sessionId = ? AND itemInSession = ?""")
+
+user_select = ("""SELECT artist_name, song_title, itemInSession, user_firstName, user_lastName
+                  FROM users_library
+                  WHERE userId = ? AND sessionId = ?""")
+
+song_select = ("""SELECT user_firstName, user_lastName
+                  FROM songs_library
+                  WHERE song_title = ?""")
+
+# QUERY LISTS
+
+create_table_queries = [session_table_create, user_table_create, song_table_create]
+drop_table_queries = [session_table_drop, user_table_drop, song_table_drop]
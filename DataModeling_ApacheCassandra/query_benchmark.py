@@ -0,0 +1,233 @@
+"""
+Benchmark of the query path of the data model (the three point queries of the project)
+
+1. Sample the keys of the queries from the events (event_datafile_new.csv or its columnar copy): a key is picked
+   as often as it appears in the file, so popular sessions and songs are queried more often
+2. Replay a mix of the three queries against the cluster with a bounded number of requests in flight (--concurrency)
+3. Report the latency (p50, p95, p99, max) and the throughput of each table
+4. Save the results as JSON in benchmark_results/ so data model changes can be compared on numbers
+"""
+import os
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+from collections import defaultdict
+
+from cql_queries import session_select, user_select, song_select
+from cassandra_loader import connect, load_events, read_events, SESSION_ID, ITEM_IN_SESSION, USER_ID, SONG
+
+
+# table, query, columns of the events used as parameters of the query
+QUERIES = [
+    ('sessions_library', session_select, (SESSION_ID, ITEM_IN_SESSION)),
+    ('users_library', user_select, (USER_ID, SESSION_ID)),
+    ('songs_library', song_select, (SONG,)),
+]
+
+
+def sample_keys(filepath):
+
+    """
+    This function read the events and return the parameters of each query for every event
+
+    Arguments:
+    - filepath = path to event_datafile_new.csv (or to its .parquet/.arrow copy)
+    """
+    keys = defaultdict(list)
+    for event in read_events(filepath):
+        for table, query, columns in QUERIES:
+            keys[table].append(tuple(event[i] for i in columns))
+
+    return keys
+
+
+def parse_mix(mix):
+
+    """
+    This function read the weight of each table from a string like "sessions_library=1,users_library=1,songs_library=1"
+
+    Arguments:
+    - mix = weights of the tables (the tables not listed are not queried)
+    """
+    weights = {}
+    for item in mix.split(','):
+        table, weight = item.split('=')
+        weights[table.strip()] = float(weight)
+
+    unknown = set(weights) - set(table for table, query, columns in QUERIES)
+    if unknown:
+        raise ValueError('Unknown tables in the mix: {}'.format(', '.join(sorted(unknown))))
+
+    return weights
+
+
+def build_workload(rng, keys, weights, num_queries):
+
+    """
+    This function draw the list of queries to run: the table of each query is drawn with the weights of the mix
+    and its parameters are drawn from the keys of the events
+
+    Arguments:
+    - rng = random generator
+    - keys = parameters of the queries by table (see sample_keys)
+    - weights = weight of each table (see parse_mix)
+    - num_queries = number of queries
+    """
+    tables = [table for table in weights if weights[table] > 0]
+    drawn = rng.choices(tables, weights=[weights[table] for table in tables], k=num_queries)
+
+    return [(table, rng.choice(keys[table])) for table in drawn]
+
+
+def run_workload(session, statements, workload, concurrency):
+
+    """
+    This function run the queries asynchronously with at most `concurrency` requests in flight
+    and return the latencies (in seconds) and the number of errors by table, and the elapsed time
+
+    Arguments:
+    - session = Session to the cluster
+    - statements = prepared statement of each table
+    - workload = list of (table, parameters) (see build_workload)
+    - concurrency = maximum number of requests in flight
+    """
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    in_flight = threading.Semaphore(concurrency)
+
+    def on_success(rows, table, start):
+        latencies[table].append(time.perf_counter() - start)
+        in_flight.release()
+
+    def on_error(exc, table, start):
+        errors[table] += 1
+        in_flight.release()
+
+    start_all = time.perf_counter()
+    for table, params in workload:
+        in_flight.acquire()
+        start = time.perf_counter()
+        future = session.execute_async(statements[table], params)
+        future.add_callbacks(callback=on_success, callback_args=(table, start),
+                             errback=on_error, errback_args=(table, start))
+
+    # wait for the last requests
+    for i in range(concurrency):
+        in_flight.acquire()
+    elapsed = time.perf_counter() - start_all
+
+    return latencies, errors, elapsed
+
+
+def percentile(values, q):
+
+    """
+    This function return the q-th percentile of a sorted list of values (nearest rank)
+
+    Arguments:
+    - values = sorted list of values
+    - q = percentile between 0 and 100
+    """
+    if not values:
+        return None
+
+    rank = max(math.ceil(q / 100 * len(values)) - 1, 0)
+    return values[rank]
+
+
+def summarize(latencies, errors, elapsed):
+
+    """
+    This function compute the latency percentiles (in ms) and the throughput (queries/sec) of each table
+
+    Arguments:
+    - latencies = latencies in seconds by table
+    - errors = number of errors by table
+    - elapsed = duration of the run in seconds
+    """
+    summary = {}
+    for table in sorted(set(latencies) | set(errors)):
+        values = sorted(latencies[table])
+        summary[table] = {'queries': len(values),
+                          'errors': errors[table],
+                          'queries_per_second': len(values) / elapsed if elapsed else None}
+        for name, q in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100)):
+            value = percentile(values, q)
+            summary[table][name + '_ms'] = value * 1000 if value is not None else None
+
+    return summary
+
+
+def git_revision():
+
+    """
+    Return the current git commit, saved with the results to compare runs
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+
+    """
+    Sample the keys, run the workload, print and save the results
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the three queries of the Cassandra data model')
+    parser.add_argument('--file', default='event_datafile_new.csv', help='events used to sample the keys (CSV, .parquet or .arrow)')
+    parser.add_argument('--hosts', default='127.0.0.1', help='contact points of the cluster (comma separated)')
+    parser.add_argument('--keyspace', default='sparkify_database', help='keyspace of the tables')
+    parser.add_argument('--load', action='store_true', help='load the events into the tables before the benchmark')
+    parser.add_argument('--mix', default='sessions_library=1,users_library=1,songs_library=1', help='weight of each table')
+    parser.add_argument('--queries', type=int, default=30000, help='number of queries')
+    parser.add_argument('--warmup', type=int, default=1000, help='number of queries run before the measure')
+    parser.add_argument('--concurrency', type=int, default=32, help='maximum number of requests in flight')
+    parser.add_argument('--seed', type=int, default=42, help='seed of the random generator')
+    parser.add_argument('--output', default='benchmark_results', help='folder where the results are saved')
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    keys = sample_keys(args.file)
+    rng = random.Random(args.seed)
+
+    cluster, session = connect(args.hosts.split(','), args.keyspace)
+    try:
+        if args.load:
+            load_events(session, args.file)
+
+        statements = {table: session.prepare(query) for table, query, columns in QUERIES}
+
+        # warm up the connections and the caches of the cluster
+        run_workload(session, statements, build_workload(rng, keys, weights, args.warmup), args.concurrency)
+
+        print('Running {} queries with {} requests in flight'.format(args.queries, args.concurrency))
+        latencies, errors, elapsed = run_workload(session, statements,
+                                                  build_workload(rng, keys, weights, args.queries), args.concurrency)
+    finally:
+        cluster.shutdown()
+
+    results = {'date': datetime.now().isoformat(timespec='seconds'),
+               'revision': git_revision(),
+               'options': {key: value for key, value in vars(args).items() if key != 'output'},
+               'elapsed_seconds': elapsed,
+               'queries_per_second': sum(len(values) for values in latencies.values()) / elapsed if elapsed else None,
+               'tables': summarize(latencies, errors, elapsed)}
+
+    # save results
+    os.makedirs(args.output, exist_ok=True)
+    output_file = os.path.join(args.output, 'query_benchmark_{}.json'.format(datetime.now().strftime('%Y%m%d_%H%M%S')))
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print('\n\n-----> Benchmark results (saved in {})'.format(output_file))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Benchmark of etl.py against synthetic Sparkify data
+
+1. Generate song_data and log_data JSON files with the same schema as the files in data/ (any number of songs and events)
+2. Drop and create the tables, then run process_data end to end on the generated files (same options as etl.py)
+3. Report rows/sec, the time spent in each stage (parse, transform, lookup, insert) and the peak memory (RSS)
+4. Save the results as JSON in benchmark_results/ so runs can be compared over time
+
+WARNING: the tables of the database configured in db.cfg are dropped and created again
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import string
+import argparse
+import resource
+import tempfile
+import subprocess
+from functools import partial
+from datetime import datetime, timedelta
+
+import etl
+from db import get_dsn, connect
+from create_tables import drop_tables, create_tables
+from song_lookup import SongLookup
+
+
+FIRST_NAMES = ['Walter', 'Kaylee', 'Jayden', 'Stefany', 'Marina', 'Makinley', 'Kevin', 'Kynnedi', 'Chloe', 'Aleena']
+LAST_NAMES = ['Frye', 'Summers', 'Fox', 'White', 'Sutton', 'Jones', 'Arellano', 'Sanchez', 'Cuevas', 'Kirby']
+LOCATIONS = ['San Francisco-Oakland-Hayward, CA', 'Phoenix-Mesa-Scottsdale, AZ', 'Chicago-Naperville-Elgin, IL-IN-WI',
+             'Atlanta-Sandy Springs-Roswell, GA', 'New York-Newark-Jersey City, NY-NJ-PA']
+USER_AGENTS = ['"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.153 Safari/537.36"',
+               '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36"',
+               'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0']
+OTHER_PAGES = ['Home', 'Logout', 'Settings', 'Help', 'About']
+
+
+def random_id(rng, prefix):
+
+    """
+    Return a random id like the ids of the sample files (ex: SOMZWCG12A8C13C480)
+    """
+    return prefix + ''.join(rng.choice(string.ascii_uppercase + string.digits) for i in range(16))
+
+
+def generate_songs(rng, song_dir, num_songs):
+
+    """
+    This function write num_songs JSON files about song_data (one song per file, as in data/song_data)
+    Returns the list of songs as tuples (title, artist_name, duration) used to generate the songplays
+
+    Arguments:
+    - rng = random generator
+    - song_dir = folder where the song files are written
+    - num_songs = number of songs
+    """
+    artists = [(random_id(rng, 'AR'), 'Artist {}'.format(i), rng.choice(LOCATIONS + [''])) for i in range(max(1, num_songs // 3))]
+
+    songs = []
+    for i in range(num_songs):
+        artist_id, artist_name, artist_location = rng.choice(artists)
+        track_id = random_id(rng, 'TR')
+        song = {'num_songs': 1, 'artist_id': artist_id, 'artist_latitude': None, 'artist_longitude': None,
+                'artist_location': artist_location, 'artist_name': artist_name, 'song_id': random_id(rng, 'SO'),
+                'title': 'Song {}'.format(i), 'duration': round(rng.uniform(60, 600), 5), 'year': rng.choice([0, 1990, 2005])}
+
+        folder = os.path.join(song_dir, track_id[2], track_id[3], track_id[4])
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, track_id + '.json'), 'w') as f:
+            json.dump(song, f)
+
+        songs.append((song['title'], song['artist_name'], song['duration']))
+
+    return songs
+
+
+def generate_logs(rng, log_dir, songs, num_events, num_days, num_users):
+
+    """
+    This function write JSON files about log_data (one file per day, as in data/log_data)
+    About 80% of the events are NextSong events, and 90% of the songplays are songs of song_data
+
+    Arguments:
+    - rng = random generator
+    - log_dir = folder where the log files are written
+    - songs = songs returned by generate_songs
+    - num_events = total number of events
+    - num_days = number of days (files)
+    - num_users = number of users
+    """
+    users = [(str(i + 1), rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), rng.choice('MF'), rng.choice(LOCATIONS),
+              rng.choice(USER_AGENTS)) for i in range(num_users)]
+    start = datetime(2018, 11, 1)
+    events_per_day = max(1, num_events // num_days)
+
+    written = 0
+    for day in range(num_days):
+        date = start + timedelta(days=day)
+        folder = os.path.join(log_dir, str(date.year), '{:02d}'.format(date.month))
+        os.makedirs(folder, exist_ok=True)
+
+        count = events_per_day if day < num_days - 1 else num_events - written
+        ts = int(date.timestamp() * 1000)
+
+        with open(os.path.join(folder, '{}-events.json'.format(date.strftime('%Y-%m-%d'))), 'w') as f:
+            for i in range(count):
+                ts += rng.randint(1, 86400000 // max(1, events_per_day))
+                user_id, first_name, last_name, gender, location, user_agent = rng.choice(users)
+                event = {'artist': None, 'auth': 'Logged In', 'firstName': first_name, 'gender': gender, 'itemInSession': i % 100,
+                         'lastName': last_name, 'length': None, 'level': rng.choice(['free', 'paid']), 'location': location,
+                         'method': 'GET', 'page': rng.choice(OTHER_PAGES), 'registration': 1540919166796.0,
+                         'sessionId': int(user_id) * 1000 + day, 'song': None, 'status': 200, 'ts': ts,
+                         'userAgent': user_agent, 'userId': user_id}
+
+                if rng.random() < 0.8:
+                    title, artist_name, duration = rng.choice(songs) if rng.random() < 0.9 else ('Unknown', 'Unknown', 100.0)
+                    event.update({'artist': artist_name, 'song': title, 'length': duration, 'page': 'NextSong', 'method': 'PUT'})
+
+                f.write(json.dumps(event) + '\n')
+
+        written += count
+
+
+def count_rows(cur):
+
+    """
+    Return the number of rows of each table after the load
+    """
+    rows = {}
+    for table in ['songs', 'artists', 'users', 'time', 'songplays']:
+        cur.execute('SELECT COUNT(*) FROM {}'.format(table))
+        rows[table] = cur.fetchone()[0]
+
+    return rows
+
+
+def peak_rss_mb():
+
+    """
+    Return the peak memory (RSS) of this process and of its worker processes, in MB
+    """
+    factor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {'main': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / factor,
+            'workers': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / factor}
+
+
+def git_revision():
+
+    """
+    Return the current git commit, saved with the results to compare runs
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args, data_dir):
+
+    """
+    This function load the generated files with etl.py and return the results of the benchmark
+
+    Arguments:
+    - args = options of the benchmark (same as etl.py for the load)
+    - data_dir = folder with song_data and log_data
+    """
+    song_dir = os.path.join(data_dir, 'song_data')
+    log_dir = os.path.join(data_dir, 'log_data')
+
+    # empty tables
+    conn = connect(args.config)
+    cur = conn.cursor()
+    drop_tables(cur, conn)
+    create_tables(cur, conn)
+
+    batch_size = args.batch_size if args.bulk else None
+    if args.bulk:
+        song_func, log_func = etl.process_song_files, etl.process_log_files
+    else:
+        song_func, log_func = etl.process_song_file, etl.process_log_file
+    log_func = partial(log_func, chunksize=args.chunksize)
+
+    etl.stage_times.clear()
+    timings = {}
+
+    # load song_data then log_data
+    start = time.perf_counter()
+    if args.workers > 1:
+        dsn = get_dsn(args.config, bulk=args.bulk)
+        failures = etl.process_data_parallel(dsn, song_dir, song_func, args.workers, batch_size=batch_size)
+        timings['song_data'] = time.perf_counter() - start
+
+        failures += etl.process_data_parallel(dsn, log_dir, log_func, args.workers, batch_size=batch_size, with_lookup=True)
+        timings['log_data'] = time.perf_counter() - start - timings['song_data']
+
+    else:
+        conn.close()
+        conn = connect(args.config, bulk=args.bulk)
+        cur = conn.cursor()
+
+        lookup = SongLookup()
+        time_cache = etl.TimeCache()
+        commit_policy = etl.CommitPolicy(args.commit_files, args.commit_rows, args.commit_seconds)
+
+        failures = etl.process_data(cur, conn, song_dir, partial(song_func, lookup=lookup),
+                                    batch_size=batch_size, commit_policy=commit_policy, lookup=lookup)
+        timings['song_data'] = time.perf_counter() - start
+
+        failures += etl.process_data(cur, conn, log_dir, partial(log_func, lookup=lookup, time_cache=time_cache),
+                                     batch_size=batch_size, time_cache=time_cache, commit_policy=commit_policy)
+        timings['log_data'] = time.perf_counter() - start - timings['song_data']
+
+    elapsed = time.perf_counter() - start
+
+    rows = count_rows(cur)
+    conn.close()
+
+    return {'date': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'options': {key: value for key, value in vars(args).items() if key not in ('output', 'data_dir', 'keep_data')},
+            'elapsed_seconds': elapsed,
+            'timings_seconds': timings,
+            'stage_seconds': dict(etl.stage_times),
+            'rows': rows,
+            'rows_per_second': {'songs': rows['songs'] / timings['song_data'] if timings['song_data'] else None,
+                                'songplays': rows['songplays'] / timings['log_data'] if timings['log_data'] else None},
+            'failures': len(failures),
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def main():
+
+    """
+    Generate the data, run the benchmark, print and save the results
+    """
+    parser = argparse.ArgumentParser(description='Benchmark etl.py on synthetic Sparkify data')
+    parser.add_argument('--songs', type=int, default=10000, help='number of song files to generate')
+    parser.add_argument('--events', type=int, default=100000, help='number of log events to generate')
+    parser.add_argument('--days', type=int, default=30, help='number of log files (one per day)')
+    parser.add_argument('--users', type=int, default=100, help='number of users')
+    parser.add_argument('--seed', type=int, default=42, help='seed of the random generator')
+    parser.add_argument('--data-dir', default=None, help='folder for the generated data (reused if it exists, temporary folder if not given)')
+    parser.add_argument('--keep-data', action='store_true', help='do not delete the temporary folder at the end')
+    parser.add_argument('--output', default='benchmark_results', help='folder where the results are saved')
+    parser.add_argument('--config', default='db.cfg', help='configuration file with the connection settings')
+
+    # same options as etl.py
+    parser.add_argument('--bulk', action='store_true', help='load files by batches with COPY instead of row by row')
+    parser.add_argument('--batch-size', type=int, default=1000, help='number of files per batch in bulk mode')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes loading files in parallel')
+    parser.add_argument('--chunksize', type=int, default=None, help='number of events per chunk when streaming log files')
+    parser.add_argument('--commit-files', type=int, default=None,
+                        help='commit every N files (or batches in bulk mode), after every file if no limit is given')
+    parser.add_argument('--commit-rows', type=int, default=None, help='commit every N rows')
+    parser.add_argument('--commit-seconds', type=float, default=None, help='commit every N seconds')
+    args = parser.parse_args()
+
+    # generate the data (once if --data-dir is reused)
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='sparkify_benchmark_')
+    if not os.path.exists(os.path.join(data_dir, 'song_data')):
+        print('Generating {} songs and {} events in {}'.format(args.songs, args.events, data_dir))
+        rng = random.Random(args.seed)
+        songs = generate_songs(rng, os.path.join(data_dir, 'song_data'), args.songs)
+        generate_logs(rng, os.path.join(data_dir, 'log_data'), songs, args.events, args.days, args.users)
+
+    try:
+        results = run_benchmark(args, data_dir)
+    finally:
+        if args.data_dir is None and not args.keep_data:
+            shutil.rmtree(data_dir)
+
+    # save results
+    os.makedirs(args.output, exist_ok=True)
+    output_file = os.path.join(args.output, 'benchmark_{}.json'.format(datetime.now().strftime('%Y%m%d_%H%M%S')))
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print('\n\n-----> Benchmark results (saved in {})'.format(output_file))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
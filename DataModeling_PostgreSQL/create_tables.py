@@ -1,4 +1,5 @@
 import psycopg2
+from db import connect
 from sql_queries import create_table_queries, drop_table_queries
 
 
@@ -9,7 +10,7 @@ def create_database():
     """
     
     # connect to default database
-    conn = psycopg2.connect("host=localhost dbname=postgres user=postgres password=pasha_enjoin_flint")
+    conn = connect()
     conn.set_session(autocommit=True)
     cur = conn.cursor()
     
@@ -21,7 +22,7 @@ def create_database():
     conn.close()    
     
     # connect to sparkify database
-    conn = psycopg2.connect("host=localhost dbname=postgres user=postgres password=pasha_enjoin_flint")
+    conn = connect()
     cur = conn.cursor()
     
     return cur, conn
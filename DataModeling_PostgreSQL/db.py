@@ -0,0 +1,66 @@
+"""
+This file manages the connections to the database for create_tables.py and etl.py
+ - The connection settings are read from db.cfg ([POSTGRES]) and each of them can be overridden
+   by an environment variable SPARKIFY_<KEY> (ex: SPARKIFY_DB_PASSWORD), or the whole DSN by SPARKIFY_DSN
+ - The session settings ([SESSION]) are sent with every connection: statement timeout and,
+   for bulk loads, synchronous_commit (commits do not wait for the WAL flush; a crash can lose the last
+   commits but never corrupts the data, and the lost files are loaded again by the next run)
+ - There is no connection pool: with --workers, each worker process of etl.py opens one connection at start
+   and reuses it for all its files (a pool of connections cannot be shared between processes)
+"""
+import os
+import configparser
+import psycopg2
+from psycopg2.extensions import make_dsn
+
+
+def load_config(config_file='db.cfg'):
+
+    """
+    Read the configuration file of the database
+
+    Arguments:
+    - config_file = path to the configuration file
+    """
+    config = configparser.ConfigParser()
+    config.read(config_file)
+
+    return config
+
+
+def get_dsn(config_file='db.cfg', bulk=False):
+
+    """
+    This function build the connection string to the database, including the session settings
+
+    Arguments:
+    - config_file = path to the configuration file
+    - bulk = True to use the session settings for bulk loads
+    """
+    config = load_config(config_file)
+
+    dsn = os.environ.get('SPARKIFY_DSN')
+    if dsn is None:
+        settings = {key: os.environ.get('SPARKIFY_' + key.upper(), value) for key, value in config['POSTGRES'].items()}
+        dsn = "host={host} dbname={db_name} user={db_user} password={db_password} port={db_port}".format(**settings)
+
+    # session settings sent at connection time (libpq "options")
+    session = config['SESSION'] if config.has_section('SESSION') else {}
+    options = ['-c statement_timeout={}'.format(session.get('STATEMENT_TIMEOUT', '0'))]
+    if bulk:
+        options.append('-c synchronous_commit={}'.format(session.get('BULK_SYNCHRONOUS_COMMIT', 'off')))
+
+    return make_dsn(dsn, options=' '.join(options))
+
+
+def connect(config_file='db.cfg', bulk=False):
+
+    """
+    Open a single connection to the database
+
+    Arguments:
+    - config_file = path to the configuration file
+    - bulk = True to use the session settings for bulk loads
+    """
+    return psycopg2.connect(get_dsn(config_file, bulk))
+
@@ -1,11 +1,159 @@
 import os
+import io
 import glob
+import time
+import shutil
+import hashlib
+import argparse
 import psycopg2
+import numpy as np
 import pandas as pd
+from functools import partial
+from collections import defaultdict
+from contextlib import contextmanager
+from psycopg2.extras import execute_values
+from multiprocessing import Pool
 from sql_queries import *
+from song_lookup import SongLookup
+from db import get_dsn
 
 
-def process_song_file(cur, filepath):
+# time spent in each stage of the load in seconds (parse, transform, lookup, insert), reported by benchmark.py
+stage_times = defaultdict(float)
+
+
+@contextmanager
+def timed(stage):
+
+    """
+    Add the time spent in the block to stage_times[stage]
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_times[stage] += time.perf_counter() - start
+
+
+class TimeCache:
+
+    """
+    Process-local cache of the timestamps (unix ms) already loaded in the table 'time', kept as a sorted numpy array.
+    New timestamps are pending until the transaction that inserts them is committed, so a rolled back batch
+    does not leave timestamps in the cache that are not in the database.
+    """
+
+    def __init__(self):
+        self.loaded = np.array([], dtype='int64')
+        self.pending = np.array([], dtype='int64')
+
+
+    def filter_new(self, ts):
+
+        """
+        Return the timestamps of ts (sorted unique array) that are not loaded yet and add them to the pending timestamps
+        """
+        ts = ts[~np.isin(ts, self.loaded, assume_unique=True)]
+        ts = ts[~np.isin(ts, self.pending, assume_unique=True)]
+        self.pending = np.union1d(self.pending, ts)
+
+        return ts
+
+
+    def commit(self):
+        self.loaded = np.union1d(self.loaded, self.pending)
+        self.pending = np.array([], dtype='int64')
+
+
+    def rollback(self):
+        self.pending = np.array([], dtype='int64')
+
+
+def build_time_df(ts, time_cache=None):
+
+    """
+    This function create the rows of the table 'time' for a Series of unix timestamps (ms)
+    The timestamps are deduplicated within the batch and against the cache of timestamps already loaded,
+    and all the date parts are computed at once as integer arrays.
+
+    Arguments:
+    - ts = Series with the timestamps of log_data (column 'ts')
+    - time_cache = TimeCache of the timestamps already loaded (optional)
+    """
+    with timed('transform'):
+        ts = np.unique(ts.dropna().to_numpy(dtype='int64'))
+        if time_cache is not None:
+            ts = time_cache.filter_new(ts)
+
+        t = pd.DatetimeIndex(ts.astype('datetime64[ms]'))
+
+        return pd.DataFrame({'start_time': t,
+                             'hour': t.hour.to_numpy(dtype='int64'),
+                             'day': t.day.to_numpy(dtype='int64'),
+                             'week': t.isocalendar().week.to_numpy(dtype='int64'),
+                             'month': t.month.to_numpy(dtype='int64'),
+                             'year': t.year.to_numpy(dtype='int64'),
+                             'weekday': t.weekday.to_numpy(dtype='int64')})
+
+
+# columns of log_data used to load the tables
+LOG_COLUMNS = ['ts', 'userId', 'firstName', 'lastName', 'gender', 'level', 'song', 'artist', 'length',
+               'sessionId', 'location', 'userAgent']
+
+
+def parse_log_lines(lines):
+
+    """
+    This function parse lines of log_data (newline-delimited JSON) into a DataFrame
+    with only the NextSong events and the columns in LOG_COLUMNS
+
+    Arguments:
+    - lines = list of raw lines (bytes) of log_data
+    """
+    with timed('parse'):
+        df = pd.read_json(io.BytesIO(b''.join(lines)), lines=True)
+
+        # filter by NextSong action
+        df = df.loc[df['page']=='NextSong']
+
+        return df[LOG_COLUMNS]
+
+
+def read_log_files(filepaths, chunksize=None):
+
+    """
+    This function read JSON files about log_data and yield DataFrames of NextSong events.
+    The files are streamed line by line: lines that cannot be a NextSong event are dropped before being parsed,
+    and a DataFrame is yielded every chunksize events, so memory depends on chunksize instead of the size of the files.
+
+    Arguments:
+    - filepaths = list of paths to the log_data
+    - chunksize = number of events per DataFrame (None to yield a single DataFrame)
+    """
+    lines = []
+    for filepath in filepaths:
+        with open(filepath, 'rb') as f:
+            for line in f:
+
+                # the page is checked again after parsing, this only skips the other actions cheaply
+                if b'NextSong' not in line:
+                    continue
+
+                lines.append(line if line.endswith(b'\n') else line + b'\n')
+
+                if chunksize is not None and len(lines) >= chunksize:
+                    df = parse_log_lines(lines)
+                    lines = []
+                    if len(df) > 0:
+                        yield df
+
+    if lines:
+        df = parse_log_lines(lines)
+        if len(df) > 0:
+            yield df
+
+
+def process_song_file(cur, filepath, lookup=None):
     
     """ 
     This function open a single JSON file (filepath) about song_data and load it in a DataFrame
@@ -14,21 +162,115 @@ def process_song_file(cur, filepath):
     Arguments:
     - cur = cursor to the database
     - filepath = path to a JSON file on song_data
+    - lookup = SongLookup index to update with the new song (optional)
+
+    Returns the number of songs processed
     """
     
     # open song file
-    df = pd.read_json(filepath, lines=True)
+    with timed('parse'):
+        df = pd.read_json(filepath, lines=True)
 
     # insert song record
-    song_data = list(df[['song_id', 'title', 'artist_id', 'year', 'duration']].values[0])
-    cur.execute(song_table_insert, song_data)
+    with timed('insert'):
+        song_data = list(df[['song_id', 'title', 'artist_id', 'year', 'duration']].values[0])
+        cur.execute(song_table_insert, song_data)
     
     # insert artist record
-    artist_data = list(df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']].values[0])
-    cur.execute(artist_table_insert, artist_data)
+    with timed('insert'):
+        artist_data = list(df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']].values[0])
+        cur.execute(artist_table_insert, artist_data)
+
+    # make the new song available to the songplays lookup
+    if lookup is not None:
+        lookup.add(df)
+
+    return len(df)
+
+
+USER_COLUMNS = ['userId', 'firstName', 'lastName', 'gender', 'level']
+
+
+def upsert_users(cur, df):
+
+    """
+    This function upsert the users of a DataFrame of NextSong events into the table 'users'.
+    Each user is upserted once with its latest level, in the order of user_id: the workers loading files
+    in parallel lock the rows of 'users' in the same order and cannot deadlock on them.
+
+    Arguments:
+    - cur = Cursor to the database
+    - df = DataFrame of NextSong events with the columns 'ts' and USER_COLUMNS
+    """
+    with timed('transform'):
+        user_df = df.sort_values('ts', kind='stable').drop_duplicates('userId', keep='last')
+        user_df = user_df.sort_values('userId')[USER_COLUMNS]
+
+    with timed('insert'):
+        for row in user_df.itertuples(index=False):
+            cur.execute(user_table_insert, list(row))
+
+
+def insert_log_data(cur, df, lookup=None, time_cache=None, insert_users=True):
+
+    """ 
+    This function add a DataFrame of NextSong events row by row into two dimension tables named 'users' and 'time'
+    as well as in the fact table 'songplays' based on sql_queries.py
+    
+    Arguments:
+    - cur = Cursor to the database
+    - df = DataFrame of NextSong events (see read_log_files)
+    - lookup = SongLookup index used to find songid and artistid (optional, song_select is run for each row otherwise)
+    - time_cache = TimeCache of the timestamps already loaded in the table 'time' (optional)
+    - insert_users = False if the caller upserts the users itself (see upsert_users)
+    """
+    # convert timestamp column to datetime (once, reused for the songplays)
+    df = df.assign(start_time=pd.to_datetime(df['ts'], unit='ms'))
+    
+    # insert time data records (only the timestamps not loaded yet)
+    time_df = build_time_df(df['ts'], time_cache)
+
+    with timed('insert'):
+        for row in time_df.astype(object).itertuples(index=False):
+            cur.execute(time_table_insert, list(row))
+
+    # insert user records (once per user, in the order of user_id)
+    if insert_users:
+        upsert_users(cur, df)
+
+    # get songid and artistid of the whole file at once from the in-memory lookup
+    if lookup is not None:
+        with timed('lookup'):
+            song_ids, artist_ids = lookup.resolve(df)
+
+    # insert songplay records
+    for index, row in enumerate(df.itertuples()):
+        
+        if lookup is not None:
+            songid, artistid = song_ids[index], artist_ids[index]
+            songid, artistid = (None, None) if pd.isna(songid) else (songid, artistid)
+
+        # get songid and artistid from song and artist tables
+        else:
+            with timed('lookup'):
+                cur.execute(song_select, (row.song, row.artist, row.length))
+                results = cur.fetchone()
+        
+            if results:
+                songid, artistid = results
+            else:
+                songid, artistid = None, None
+
+        # insert songplay record
+        songplay_data = [str(row.start_time), row.userId, row.level, songid, artistid, row.sessionId, row.location, row.userAgent]
+        
+        with timed('insert'):
+            cur.execute(songplay_table_insert, songplay_data)
+
+    return len(df)
 
 
-def process_log_file(cur, filepath):
+def process_log_file(cur, filepath, lookup=None, time_cache=None, chunksize=None):
 
     """ 
     This function open a single JSON file (filepath) about log_data and load it in a DataFrame
@@ -37,50 +279,393 @@ def process_log_file(cur, filepath):
     Arguments:
     - cur = Cursor to the database
     - filepath = path to the log_data
+    - lookup = SongLookup index used to find songid and artistid (optional, song_select is run for each row otherwise)
+    - time_cache = TimeCache of the timestamps already loaded in the table 'time' (optional)
+    - chunksize = if given, the file is streamed by DataFrames of chunksize NextSong events
+
+    Returns the number of songplays processed
+    """
+    # open log file and insert each chunk of NextSong events
+    # (the users of all the chunks are upserted together at the end, once per user and in the order of user_id)
+    rows = 0
+    users = []
+    for df in read_log_files([filepath], chunksize):
+        rows += insert_log_data(cur, df, lookup, time_cache, insert_users=False)
+        users.append(df[['ts'] + USER_COLUMNS])
+
+    if users:
+        upsert_users(cur, pd.concat(users, ignore_index=True))
+
+    return rows
+
+
+def copy_to_staging(cur, df, staging_table, staging_table_create):
+
+    """
+    This function stream a DataFrame into a temporary staging table with a single COPY ... FROM STDIN
+    The staging table is created if needed and emptied before the copy. The columns of the DataFrame
+    must have the same names as the columns of the staging table.
+
+    Arguments:
+    - cur = Cursor to the database
+    - df = DataFrame to copy
+    - staging_table = name of the temporary staging table
+    - staging_table_create = query used to create the staging table (see sql_queries.py)
+    """
+    with timed('insert'):
+        cur.execute(staging_table_create)
+        cur.execute(staging_table_truncate.format(staging_table))
+
+        # write the batch as CSV in memory (empty values are loaded as NULL)
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+
+        cur.copy_expert(staging_table_copy.format(staging_table, ', '.join(df.columns)), buffer)
+
+
+def read_song_files(filepaths):
+
+    """
+    This function read a batch of JSON files about song_data in a single DataFrame
+    The raw content of the files (one song per file) is concatenated and parsed at once by the JSON parser of pandas,
+    instead of building one DataFrame per file
+
+    Arguments:
+    - filepaths = list of paths to JSON files on song_data
+    """
+    with timed('parse'):
+        records = []
+        for filepath in filepaths:
+            with open(filepath, 'rb') as f:
+                record = f.read().strip()
+            if record:
+                records.append(record)
+
+        return pd.read_json(io.BytesIO(b'\n'.join(records)), lines=True)
+
+
+def transform_song_data(df):
+
+    """
+    This function split a DataFrame of song_data into the batches loaded in the tables 'songs' and 'artists'
+    Returns (song_df, artist_df) with the columns of the tables
+
+    Arguments:
+    - df = DataFrame of song_data (see read_song_files)
+    """
+    with timed('transform'):
+        song_df = df[['song_id', 'title', 'artist_id', 'year', 'duration']]
+
+        artist_df = df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']]
+        artist_df.columns = ['artist_id', 'name', 'location', 'latitude', 'longitude']
+        artist_df = artist_df.drop_duplicates('artist_id')
+
+        return song_df, artist_df
+
+
+def process_song_files(cur, filepaths, lookup=None):
+
+    """
+    Bulk version of process_song_file: open a batch of JSON files about song_data in a single DataFrame
+    The whole batch is copied into staging tables and then added to the dimension tables 'songs' and 'artists'
+    with one set-based INSERT ... SELECT per table (based on queries from sql_queries.py)
+
+    Arguments:
+    - cur = cursor to the database
+    - filepaths = list of paths to JSON files on song_data
+    - lookup = SongLookup index to update with the new songs (optional)
+
+    Returns the number of songs processed
     """
-    # open log file
-    df = pd.read_json(filepath, lines=True)
 
-    # filter by NextSong action
-    df = df.loc[df['page']=='NextSong']
+    # open song files
+    df = read_song_files(filepaths)
+    song_df, artist_df = transform_song_data(df)
+
+    # insert song records
+    copy_to_staging(cur, song_df, 'songs_staging', song_staging_create)
+    with timed('insert'):
+        cur.execute(song_table_merge)
+
+    # insert artist records
+    copy_to_staging(cur, artist_df, 'artists_staging', artist_staging_create)
+    with timed('insert'):
+        cur.execute(artist_table_merge)
+
+    # make the new songs available to the songplays lookup
+    if lookup is not None:
+        lookup.add(df)
+
+    return len(df)
+
+
+def copy_log_data(cur, df, lookup, time_cache=None):
+
+    """
+    Bulk version of insert_log_data: a DataFrame of NextSong events is copied into staging tables and then added
+    to the tables 'time', 'users' and 'songplays' with one set-based INSERT ... SELECT per table (based on queries from sql_queries.py)
+
+    Arguments:
+    - cur = Cursor to the database
+    - df = DataFrame of NextSong events (see read_log_files)
+    - lookup = SongLookup index used to find songid and artistid
+    - time_cache = TimeCache of the timestamps already loaded in the table 'time' (optional)
+    """
 
     # convert timestamp column to datetime
     t = pd.to_datetime(df['ts'], unit='ms')
-    
-    # insert time data records
-    time_data = (t, t.dt.hour, t.dt.day, t.dt.isocalendar().week, t.dt.month, t.dt.year, t.dt.weekday)
-    column_labels = ("start_time", "hour", "day", "week", "month", "year", "weekday")
-    time_df = pd.DataFrame({column: data for column,data in zip (column_labels, time_data)}).dropna()
 
-    for i, row in time_df.iterrows():
-        cur.execute(time_table_insert, list(row))
+    # insert time data records (only the timestamps not loaded yet)
+    time_df = build_time_df(df['ts'], time_cache)
+
+    if len(time_df) > 0:
+        copy_to_staging(cur, time_df, 'time_staging', time_staging_create)
+        with timed('insert'):
+            cur.execute(time_table_merge)
 
-    # load user table
-    user_df = df[['userId', 'firstName', 'lastName', 'gender', 'level']]
+    # insert user records (only the latest level of each user is kept, as the upsert would do row by row)
+    with timed('transform'):
+        user_df = df.sort_values('ts')[['userId', 'firstName', 'lastName', 'gender', 'level']]
+        user_df = user_df.drop_duplicates('userId', keep='last')
+        user_df.columns = ['user_id', 'first_name', 'last_name', 'gender', 'level']
 
-    # insert user records
-    for i, row in user_df.iterrows():
-        cur.execute(user_table_insert, row)
+    copy_to_staging(cur, user_df, 'users_staging', user_staging_create)
+    with timed('insert'):
+        cur.execute(user_table_merge)
+
+    # get songid and artistid of the whole batch at once from the in-memory lookup
+    with timed('lookup'):
+        song_ids, artist_ids = lookup.resolve(df)
 
     # insert songplay records
-    for index, row in df.iterrows():
-        
-        # get songid and artistid from song and artist tables
-        cur.execute(song_select, (row.song, row.artist, row.length))
-        results = cur.fetchone()
-        
-        if results:
-            songid, artistid = results
+    with timed('transform'):
+        songplay_df = pd.DataFrame({'start_time': t, 'user_id': df['userId'], 'level': df['level'],
+                                    'song_id': song_ids, 'artist_id': artist_ids,
+                                    'session_id': df['sessionId'], 'location': df['location'], 'user_agent': df['userAgent']})
+
+    copy_to_staging(cur, songplay_df, 'songplays_staging', songplay_staging_create)
+    with timed('insert'):
+        cur.execute(songplay_table_merge)
+
+    return len(df)
+
+
+def process_log_files(cur, filepaths, lookup=None, time_cache=None, chunksize=None):
+
+    """
+    Bulk version of process_log_file: open a batch of JSON files about log_data in a single DataFrame
+    The whole batch is copied into staging tables and then added to the tables 'time', 'users' and 'songplays'
+    with one set-based INSERT ... SELECT per table (based on queries from sql_queries.py)
+
+    Arguments:
+    - cur = Cursor to the database
+    - filepaths = list of paths to the log_data
+    - lookup = SongLookup index used to find songid and artistid (built from the database if not given)
+    - time_cache = TimeCache of the timestamps already loaded in the table 'time' (optional)
+    - chunksize = if given, the files are streamed and loaded by DataFrames of chunksize NextSong events
+
+    Returns the number of songplays processed
+    """
+    if lookup is None:
+        lookup = SongLookup.from_database(cur)
+
+    # open log files and load each chunk of NextSong events
+    rows = 0
+    for df in read_log_files(filepaths, chunksize):
+        rows += copy_log_data(cur, df, lookup, time_cache)
+
+    return rows
+
+
+def get_files(filepath):
+
+    """
+    This function iterate trought a folder to create a list of string where each string is a path to a JSON file.
+
+    Arguments:
+    - filepath = path to the folder with the data that need to be processed
+    """
+    all_files = []
+    for root, dirs, files in os.walk(filepath):
+        files = glob.glob(os.path.join(root,'*.json'))
+        for f in files :
+            all_files.append(os.path.abspath(f))
+
+    return all_files
+
+
+def get_units(all_files, batch_size=None):
+
+    """
+    This function split the list of files into the units of work given to the processing functions:
+    a single file, or a list of up to batch_size files in bulk mode.
+
+    Arguments:
+    - all_files = list of paths to JSON files
+    - batch_size = number of files per batch (bulk mode) or None to process the files one by one
+    """
+    if batch_size is None:
+        return all_files
+
+    return [all_files[i:i + batch_size] for i in range(0, len(all_files), batch_size)]
+
+
+def unit_files(unit):
+
+    """
+    Return the list of files in a unit of work (a single file or a batch of files)
+    """
+    return unit if isinstance(unit, list) else [unit]
+
+
+def hash_file(filepath):
+
+    """
+    Return the MD5 hash of the content of a file (read by blocks of 1MB)
+    """
+    content_hash = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            content_hash.update(block)
+
+    return content_hash.hexdigest()
+
+
+def get_signatures(filepaths):
+
+    """
+    This function return the signature (path, size, mtime, content hash) of each file, as stored in the manifest
+
+    Arguments:
+    - filepaths = list of paths to JSON files
+    """
+    signatures = []
+    for filepath in filepaths:
+        stat = os.stat(filepath)
+        signatures.append((filepath, stat.st_size, stat.st_mtime, hash_file(filepath)))
+
+    return signatures
+
+
+def escape_like(prefix):
+
+    """
+    This function escape the wildcards of a LIKE pattern (the '_' of the file names would match any character)
+
+    Arguments:
+    - prefix = text to match literally (used with ESCAPE '\\')
+    """
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def filter_new_files(cur, filepath, all_files):
+
+    """
+    This function compare the files with the manifest of processed files (table etl_manifest)
+    and return only the files that are new or changed since they were loaded.
+    A file with the same size and mtime as in the manifest is not read again; if only the mtime changed,
+    its content hash is compared and the manifest is updated when the content is the same.
+
+    Arguments:
+    - cur = Cursor to the database
+    - filepath = path to the folder with the data that need to be processed
+    - all_files = list of paths to JSON files in this folder
+    """
+    cur.execute(manifest_table_create)
+    cur.execute(manifest_select, (escape_like(os.path.join(os.path.abspath(filepath), '')) + '%',))
+    manifest = {row[0]: row[1:] for row in cur.fetchall()}
+
+    new_files = []
+    touched = []
+    for datafile in all_files:
+        known = manifest.get(datafile)
+
+        # file never loaded
+        if known is None:
+            new_files.append(datafile)
+            continue
+
+        # same size and mtime: file did not change
+        stat = os.stat(datafile)
+        size, mtime, content_hash = known
+        if stat.st_size == size and stat.st_mtime == mtime:
+            continue
+
+        # mtime changed but not the content: only the manifest is updated
+        signature = get_signatures([datafile])[0]
+        if signature[3] == content_hash:
+            touched.append(signature)
         else:
-            songid, artistid = None, None
+            new_files.append(datafile)
+
+    if touched:
+        execute_values(cur, manifest_upsert, touched)
+
+    return new_files
+
+
+def record_files(cur, signatures):
+
+    """
+    This function add (or update) the signature of the processed files in the manifest (table etl_manifest)
+    It is run in the same transaction as the load of the files so a file is never recorded without its data
+
+    Arguments:
+    - cur = Cursor to the database
+    - signatures = list of tuples (path, size, mtime, content hash) returned by get_signatures
+    """
+    execute_values(cur, manifest_upsert, signatures)
+
+
+class CommitPolicy:
+
+    """
+    Decide when process_data commits the files loaded since the last commit:
+    after max_files files, max_rows rows or max_seconds seconds, whichever comes first.
+    Without any limit, the policy commits after every file.
+    """
+
+    def __init__(self, max_files=None, max_rows=None, max_seconds=None):
+        if max_files is None and max_rows is None and max_seconds is None:
+            max_files = 1
+        self.max_files = max_files
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+
+
+    def should_commit(self, files, rows, seconds):
+
+        """
+        Arguments:
+        - files = number of files loaded since the last commit
+        - rows = number of rows loaded since the last commit
+        - seconds = time elapsed since the last commit
+        """
+        return ((self.max_files is not None and files >= self.max_files)
+                or (self.max_rows is not None and rows >= self.max_rows)
+                or (self.max_seconds is not None and seconds >= self.max_seconds))
 
-        # insert songplay record
-        songplay_data = [str(pd.to_datetime(row['ts'], unit='ms')), row.userId, row.level, songid, artistid, row.sessionId, row.location, row.userAgent]
-        
-        cur.execute(songplay_table_insert, songplay_data)
 
+def quarantine_files(failures, quarantine_dir):
 
-def process_data(cur, conn, filepath, func):
+    """
+    This function move the files that could not be loaded into a quarantine folder
+    (same relative path as in the data folder) so they are not processed again until they are fixed
+
+    Arguments:
+    - failures = list of tuples (file or batch of files, error)
+    - quarantine_dir = path to the quarantine folder
+    """
+    for unit, error in failures:
+        for datafile in unit_files(unit):
+            destination = os.path.join(quarantine_dir, os.path.relpath(datafile))
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.move(datafile, destination)
+
+
+def process_data(cur, conn, filepath, func, batch_size=None, incremental=False, time_cache=None, commit_policy=None,
+                 lookup=None):
     
     """
     This function iterate trought a folder to create a list of string where each string is a path to a JSON file.
@@ -91,46 +676,314 @@ def process_data(cur, conn, filepath, func):
     - conn = Connection to the database
     - filepath = path to the folder with the data that need to be processed
     - func = python-function used to insert data into the appropriated table
+    - batch_size = if given, func receives lists of up to batch_size files (bulk mode) instead of a single file
+    - incremental = if True, only the files that are new or changed since the last run are processed
+    - time_cache = TimeCache used by func, its new timestamps are accepted after each commit (optional)
+    - commit_policy = CommitPolicy deciding when to commit (after every file if not given)
+    - lookup = SongLookup updated by func, its new songs are kept only if their file is not rolled back (optional)
+
+    Each file (or batch of files) is loaded inside a savepoint: if it fails, only this file is rolled back
+    and the other files of the transaction are kept.
+
+    Returns the list of failures as tuples (file or batch of files, error)
     """
+    if commit_policy is None:
+        commit_policy = CommitPolicy()
+
     # get all files matching extension from directory
-    all_files = []
-    for root, dirs, files in os.walk(filepath):
-        files = glob.glob(os.path.join(root,'*.json'))
-        for f in files :
-            all_files.append(os.path.abspath(f))
+    all_files = get_files(filepath)
 
     # get total number of files found
     num_files = len(all_files)
     print('{} files found in {}'.format(num_files, filepath))
 
-    # iterate over files and process
-    for i, datafile in enumerate(all_files, 1):
-        func(cur, datafile)
+    # incremental mode: skip the files already in the manifest
+    if incremental:
+        all_files = filter_new_files(cur, filepath, all_files)
         conn.commit()
-        print('{}/{} files processed.'.format(i, num_files))
+
+        num_files = len(all_files)
+        print('{} new or changed files to process'.format(num_files))
+
+    # iterate over files (or batches of files in bulk mode) and process
+    failures = []
+    processed = 0
+    pending_files, pending_rows, last_commit = 0, 0, time.time()
+
+    for unit in get_units(all_files, batch_size):
+        processed += len(unit_files(unit))
+        cur.execute("SAVEPOINT unit")
+        if lookup is not None:
+            lookup.savepoint()
+
+        try:
+            if incremental:
+                signatures = get_signatures(unit_files(unit))
+
+            rows = func(cur, unit) or 0
+
+            if incremental:
+                record_files(cur, signatures)
+            cur.execute("RELEASE SAVEPOINT unit")
+            if lookup is not None:
+                lookup.release()
+
+        # only this file is rolled back (the timestamps pending in the cache are dropped, they will be sent again,
+        # and its songs are removed from the lookup so no songplay points to them)
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT unit")
+            if time_cache is not None:
+                time_cache.rollback()
+            if lookup is not None:
+                lookup.rollback()
+
+            error = '{}: {}'.format(type(e).__name__, e)
+            failures.append((unit, error))
+            print('{}/{} files processed. FAILED: {}'.format(processed, num_files, error))
+            continue
+
+        # commit according to the policy
+        pending_files += len(unit_files(unit))
+        pending_rows += rows
+        if commit_policy.should_commit(pending_files, pending_rows, time.time() - last_commit):
+            conn.commit()
+            if time_cache is not None:
+                time_cache.commit()
+            pending_files, pending_rows, last_commit = 0, 0, time.time()
+
+        print('{}/{} files processed.'.format(processed, num_files))
+
+    # commit the last files
+    conn.commit()
+    if time_cache is not None:
+        time_cache.commit()
+
+    return failures
+
+
+# connection, song lookup and time cache of each worker process (see process_data_parallel)
+worker_conn = None
+worker_cur = None
+worker_lookup = None
+worker_time_cache = None
+
+
+def init_worker(dsn, with_lookup):
+
+    """
+    This function is run once when a worker process starts: it opens the connection used by the worker
+    for all its files and, if needed, builds the worker's own song lookup and time cache.
+
+    Arguments:
+    - dsn = connection string to the database
+    - with_lookup = True to build a SongLookup and a TimeCache (needed to process log_data)
+    """
+    global worker_conn, worker_cur, worker_lookup, worker_time_cache
+
+    worker_conn = psycopg2.connect(dsn)
+    worker_cur = worker_conn.cursor()
+
+    if with_lookup:
+        worker_lookup = SongLookup.from_database(worker_cur)
+        worker_time_cache = TimeCache()
+
+
+def process_unit(task):
+
+    """
+    This function process one unit of work (a file or a batch of files) in a worker process and commit it
+    Errors are not raised: the transaction is rolled back and the error is returned to be reported at the end
+
+    Arguments:
+    - task = tuple (func, unit, incremental) with the processing function, the file(s) to process
+             and True to record the file(s) in the manifest
+
+    Returns (unit, error or None, time spent in each stage)
+    """
+    func, unit, incremental = task
+    stage_times.clear()
+    if worker_lookup is not None:
+        worker_lookup.savepoint()
+
+    try:
+        if incremental:
+            signatures = get_signatures(unit_files(unit))
+
+        if worker_time_cache is not None:
+            func(worker_cur, unit, lookup=worker_lookup, time_cache=worker_time_cache)
+        else:
+            func(worker_cur, unit, lookup=worker_lookup)
+
+        if incremental:
+            record_files(worker_cur, signatures)
+        worker_conn.commit()
+
+        if worker_time_cache is not None:
+            worker_time_cache.commit()
+        if worker_lookup is not None:
+            worker_lookup.release()
+        return unit, None, dict(stage_times)
+
+    except Exception as e:
+        worker_conn.rollback()
+
+        if worker_time_cache is not None:
+            worker_time_cache.rollback()
+        if worker_lookup is not None:
+            worker_lookup.rollback()
+        return unit, '{}: {}'.format(type(e).__name__, e), dict(stage_times)
+
+
+def process_data_parallel(dsn, filepath, func, workers, batch_size=None, with_lookup=False, incremental=False):
+
+    """
+    Parallel version of process_data: the files are processed by a pool of worker processes,
+    each one with its own connection to the database.
+    Progress is printed in the order of the files, and the failures are collected instead of stopping the load.
+
+    Arguments:
+    - dsn = connection string to the database
+    - filepath = path to the folder with the data that need to be processed
+    - func = python-function used to insert data into the appropriated table
+    - workers = number of worker processes
+    - batch_size = if given, func receives lists of up to batch_size files (bulk mode) instead of a single file
+    - with_lookup = True if func needs a SongLookup (log_data)
+    - incremental = if True, only the files that are new or changed since the last run are processed
+
+    Returns the list of failures as tuples (file or batch of files, error)
+    """
+    # get all files matching extension from directory
+    all_files = get_files(filepath)
+
+    # get total number of files found
+    num_files = len(all_files)
+    print('{} files found in {} ({} workers)'.format(num_files, filepath, workers))
+
+    # incremental mode: skip the files already in the manifest
+    if incremental:
+        conn = psycopg2.connect(dsn)
+        all_files = filter_new_files(conn.cursor(), filepath, all_files)
+        conn.commit()
+        conn.close()
+
+        num_files = len(all_files)
+        print('{} new or changed files to process'.format(num_files))
+
+    # dispatch files (or batches of files in bulk mode) to the workers, results come back in order
+    failures = []
+    processed = 0
+    tasks = ((func, unit, incremental) for unit in get_units(all_files, batch_size))
+
+    with Pool(processes=workers, initializer=init_worker, initargs=(dsn, with_lookup)) as pool:
+        for unit, error, times in pool.imap(process_unit, tasks):
+            processed += len(unit_files(unit))
+            for stage, seconds in times.items():
+                stage_times[stage] += seconds
+
+            if error is not None:
+                failures.append((unit, error))
+                print('{}/{} files processed. FAILED: {}'.format(processed, num_files, error))
+            else:
+                print('{}/{} files processed.'.format(processed, num_files))
+
+    return failures
+
+
+def report_failures(failures):
+
+    """
+    This function print a single report with all the files that could not be loaded
+
+    Arguments:
+    - failures = list of tuples (file or batch of files, error)
+    """
+    if not failures:
+        return
+
+    num_files = sum(len(unit_files(unit)) for unit, error in failures)
+    print('\n\n-----> {} files could not be loaded:'.format(num_files))
+
+    for unit, error in failures:
+        for datafile in unit_files(unit):
+            print('    {} ({})'.format(datafile, error))
 
 
 def main():
     
     """
     This is the Main Function of the script and will run above functions
-    It first connect to the database (here it's a local database name 'postgres')
+    It first connect to the database (connection settings in db.cfg, see db.py)
     
     It will iterate through the two data sources (song_data & log_data) to add the data into the appropriate table 
     
+    With the option --bulk, the files are loaded by batches through COPY and staging tables instead of row by row
+    With the option --workers N, the files are processed by N processes in parallel
+    With the option --incremental, only the files that are new or changed since the last run are processed
+    With the option --chunksize N, log files are streamed and loaded by chunks of N events
+    With the options --commit-files, --commit-rows and --commit-seconds, several files are committed together
+    With the option --quarantine DIR, the files that could not be loaded are moved to DIR
+    
     NOTE: it requires to have tables already created (this can be done with the file 'create_tables.py') 
     """
-    
-    conn = psycopg2.connect("host=localhost dbname=postgres user=postgres password=pasha_enjoin_flint")
-    cur = conn.cursor()
 
-    process_data(cur, conn, filepath='data/song_data', func=process_song_file)
-    process_data(cur, conn, filepath='data/log_data', func=process_log_file)
+    parser = argparse.ArgumentParser(description='Load song_data and log_data into the sparkify tables')
+    parser.add_argument('--bulk', action='store_true', help='load files by batches with COPY instead of row by row')
+    parser.add_argument('--batch-size', type=int, default=1000, help='number of files per batch in bulk mode')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes loading files in parallel')
+    parser.add_argument('--incremental', action='store_true', help='only process the files that are not in the manifest or changed')
+    parser.add_argument('--chunksize', type=int, default=None, help='number of events per chunk when streaming log files')
+    parser.add_argument('--config', default='db.cfg', help='configuration file with the connection settings')
+    parser.add_argument('--commit-files', type=int, default=None,
+                        help='commit every N files (or batches in bulk mode), after every file if no limit is given')
+    parser.add_argument('--commit-rows', type=int, default=None, help='commit every N rows')
+    parser.add_argument('--commit-seconds', type=float, default=None, help='commit every N seconds')
+    parser.add_argument('--quarantine', default=None, help='folder where the files that could not be loaded are moved')
+    args = parser.parse_args()
+
+    # bulk loads use the bulk session settings (synchronous_commit off)
+    dsn = get_dsn(args.config, bulk=args.bulk)
+
+    batch_size = args.batch_size if args.bulk else None
+    if args.bulk:
+        song_func, log_func = process_song_files, process_log_files
+    else:
+        song_func, log_func = process_song_file, process_log_file
+    log_func = partial(log_func, chunksize=args.chunksize)
+
+    # parallel mode: each worker process opens its own connection (and commits each file or batch of files)
+    if args.workers > 1:
+        failures = process_data_parallel(dsn, filepath='data/song_data', func=song_func, workers=args.workers,
+                                         batch_size=batch_size, incremental=args.incremental)
+        failures += process_data_parallel(dsn, filepath='data/log_data', func=log_func, workers=args.workers,
+                                          batch_size=batch_size, with_lookup=True, incremental=args.incremental)
+
+    else:
+        conn = psycopg2.connect(dsn)
+        cur = conn.cursor()
+
+        # songs already in the database + songs added while processing song_data are used to find the songplays
+        lookup = SongLookup.from_database(cur)
+        time_cache = TimeCache()
+        commit_policy = CommitPolicy(args.commit_files, args.commit_rows, args.commit_seconds)
+
+        failures = process_data(cur, conn, filepath='data/song_data', func=partial(song_func, lookup=lookup),
+                                batch_size=batch_size, incremental=args.incremental, commit_policy=commit_policy,
+                                lookup=lookup)
+        failures += process_data(cur, conn, filepath='data/log_data', func=partial(log_func, lookup=lookup, time_cache=time_cache),
+                                 batch_size=batch_size, incremental=args.incremental, time_cache=time_cache,
+                                 commit_policy=commit_policy)
+
+        conn.close()
+
+    report_failures(failures)
+    if failures:
+        if args.quarantine is not None:
+            quarantine_files(failures, args.quarantine)
+            print('-----> Failed files were moved to {}'.format(args.quarantine))
+        return
     
     print('\n\n-----> Data were successfully added to the database')
 
-    conn.close()
-
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
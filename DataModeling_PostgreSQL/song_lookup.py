@@ -0,0 +1,153 @@
+import sys
+import pandas as pd
+from sql_queries import song_lookup_select
+
+
+def hash_keys(titles, artist_names, durations):
+
+    """
+    This function compute the 64-bit key of each song based on its title, the name of its artist and its duration
+    The duration is rounded to 5 decimals as in the JSON files so a song and its songplays get the same key
+
+    Arguments:
+    - titles = Series with the title of the songs
+    - artist_names = Series with the name of the artists
+    - durations = Series with the duration of the songs (length in log_data)
+    """
+    keys = pd.DataFrame({'title': titles.astype(str).values,
+                         'artist_name': artist_names.astype(str).values,
+                         'duration': durations.astype(float).round(5).values})
+
+    return pd.util.hash_pandas_object(keys, index=False).values
+
+
+class SongLookup:
+
+    """
+    In-memory index used to find the song_id and artist_id of each songplay without running song_select.
+    Songs are indexed by the hash of (title, artist name, duration): the titles and names are not kept in memory,
+    only the 64-bit keys and the ids (artist ids are interned since an artist has many songs).
+
+    The index can be built once from the database (from_database) or from song files (from_song_files)
+    and is updated with add() as new songs are loaded.
+    Between savepoint() and release(), the songs added are staged: rollback() drops them, so the songs of a file
+    rolled back are never used to resolve songplays.
+    """
+
+    def __init__(self):
+        self.songs = pd.DataFrame({'song_id': pd.Series(dtype=object), 'artist_id': pd.Series(dtype=object)},
+                                  index=pd.Index([], dtype='uint64', name='key'))
+        self.pending = []
+        self.staged = None
+
+
+    @classmethod
+    def from_database(cls, cur):
+
+        """
+        Build the index from the songs and artists tables
+
+        Arguments:
+        - cur = Cursor to the database
+        """
+        cur.execute(song_lookup_select)
+        songs = pd.DataFrame(cur.fetchall(), columns=['song_id', 'title', 'artist_id', 'artist_name', 'duration'])
+
+        lookup = cls()
+        lookup.add(songs)
+
+        return lookup
+
+
+    @classmethod
+    def from_song_files(cls, filepaths):
+
+        """
+        Build the index from JSON files about song_data
+
+        Arguments:
+        - filepaths = list of paths to JSON files on song_data
+        """
+        lookup = cls()
+        for filepath in filepaths:
+            lookup.add(pd.read_json(filepath, lines=True))
+
+        return lookup
+
+
+    def add(self, songs):
+
+        """
+        Add songs to the index. The new songs are only merged into the index the next time it is used,
+        so adding songs file by file stays cheap.
+
+        Arguments:
+        - songs = DataFrame with the columns song_id, title, artist_id, artist_name and duration
+        """
+        if len(songs) == 0:
+            return
+
+        keys = hash_keys(songs['title'], songs['artist_name'], songs['duration'])
+        (self.pending if self.staged is None else self.staged).append(pd.DataFrame({'song_id': songs['song_id'].values,
+                                          'artist_id': [sys.intern(str(artist_id)) for artist_id in songs['artist_id']]},
+                                         index=pd.Index(keys, name='key')))
+
+
+    def savepoint(self):
+
+        """
+        Stage the songs added from now on until release() or rollback() (see process_data)
+        """
+        self.staged = []
+
+
+    def release(self):
+
+        """
+        Keep the songs staged since savepoint(): their rows were loaded
+        """
+        self.pending.extend(self.staged or [])
+        self.staged = None
+
+
+    def rollback(self):
+
+        """
+        Drop the songs staged since savepoint(): their rows were rolled back
+        """
+        self.staged = None
+
+
+    def flush(self):
+
+        """
+        Merge the songs added since the last lookup into the index (the first song found for a key is kept)
+        """
+        if not self.pending:
+            return
+
+        songs = pd.concat([self.songs] + self.pending)
+        self.songs = songs[~songs.index.duplicated(keep='first')]
+        self.pending = []
+
+
+    def resolve(self, df):
+
+        """
+        Find the song_id and artist_id of each songplay of a batch of log_data with a single vectorized lookup
+        Returns two arrays aligned with the rows of df (NaN when the song is not in the index)
+
+        Arguments:
+        - df = DataFrame of log_data with the columns song, artist and length
+        """
+        self.flush()
+
+        keys = hash_keys(df['song'], df['artist'], df['length'])
+        matches = self.songs.reindex(keys)
+
+        return matches['song_id'].values, matches['artist_id'].values
+
+
+    def __len__(self):
+        self.flush()
+        return len(self.songs)
@@ -5,6 +5,7 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+manifest_table_drop = "DROP TABLE IF EXISTS etl_manifest"
 
 # CREATE TABLES
 
@@ -17,7 +18,8 @@ songplay_table_create = ("""CREATE TABLE IF NOT EXISTS songplays (
                                 artist_id   text, 
                                 session_id  int,
                                 location    text,
-                                user_agent  text) """)
+                                user_agent  text,
+                                UNIQUE (start_time, user_id, session_id)) """)
 
 user_table_create = ("""CREATE TABLE IF NOT EXISTS users (
                                 user_id     int   PRIMARY KEY,
@@ -49,11 +51,20 @@ time_table_create = ("""CREATE TABLE IF NOT EXISTS time (
                                 year        int,
                                 weekday     int) """)
 
+# files already loaded by etl.py (used by the incremental mode to skip files that did not change)
+manifest_table_create = ("""CREATE TABLE IF NOT EXISTS etl_manifest (
+                                filepath      text       PRIMARY KEY,
+                                size          bigint     NOT NULL,
+                                mtime         float      NOT NULL,
+                                content_hash  text       NOT NULL,
+                                processed_at  timestamp  NOT NULL DEFAULT now()) """)
+
 # INSERT RECORDS
 
 songplay_table_insert = ("""INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, 
                                                    session_id, location, user_agent )
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s) """)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                            ON CONFLICT (start_time, user_id, session_id) DO NOTHING """)
 
 user_table_insert = ("""INSERT INTO users (user_id, first_name, last_name, gender, level) 
                         VALUES (%s, %s, %s, %s, %s)
@@ -61,7 +72,8 @@ user_table_insert = ("""INSERT INTO users (user_id, first_name, last_name, gende
                             DO UPDATE SET level = EXCLUDED.level""")
 
 song_table_insert = ("""INSERT INTO songs (song_id, title, artist_id, year, duration) 
-                        VALUES (%s, %s, %s, %s, %s) """)
+                        VALUES (%s, %s, %s, %s, %s) 
+                        ON CONFLICT (song_id) DO NOTHING """)
 
 artist_table_insert = ("""INSERT INTO artists (artist_id, name, location, latitude, longitude) 
                           VALUES (%s, %s, %s, %s, %s) 
@@ -71,16 +83,91 @@ time_table_insert = ("""INSERT INTO time (start_time, hour, day, week, month, ye
                         VALUES (%s, %s, %s, %s, %s, %s, %s) 
                         ON CONFLICT (start_time) DO NOTHING """)
 
+# BULK LOAD: TEMPORARY STAGING TABLES
+
+songplay_staging_create = ("""CREATE TEMP TABLE IF NOT EXISTS songplays_staging (
+                                start_time  timestamp,
+                                user_id     text,
+                                level       text,
+                                song_id     text,
+                                artist_id   text,
+                                session_id  int,
+                                location    text,
+                                user_agent  text) """)
+
+user_staging_create = ("""CREATE TEMP TABLE IF NOT EXISTS users_staging (LIKE users) """)
+
+song_staging_create = ("""CREATE TEMP TABLE IF NOT EXISTS songs_staging (LIKE songs) """)
+
+artist_staging_create = ("""CREATE TEMP TABLE IF NOT EXISTS artists_staging (LIKE artists) """)
+
+time_staging_create = ("""CREATE TEMP TABLE IF NOT EXISTS time_staging (LIKE time) """)
+
+staging_table_truncate = "TRUNCATE {}"
+
+staging_table_copy = "COPY {} ({}) FROM STDIN WITH CSV"
+
+# BULK LOAD: SET-BASED INSERTS FROM STAGING TABLES
+# (rows are inserted in key order so parallel loaders lock the same keys in the same order and do not deadlock)
+
+songplay_table_merge = ("""INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, 
+                                                  session_id, location, user_agent )
+                           SELECT start_time, user_id, level, song_id, artist_id, session_id, location, user_agent 
+                           FROM songplays_staging
+                           ON CONFLICT (start_time, user_id, session_id) DO NOTHING """)
+
+user_table_merge = ("""INSERT INTO users (user_id, first_name, last_name, gender, level) 
+                       SELECT user_id, first_name, last_name, gender, level 
+                       FROM users_staging
+                       ORDER BY user_id
+                       ON CONFLICT (user_id) 
+                           DO UPDATE SET level = EXCLUDED.level""")
+
+song_table_merge = ("""INSERT INTO songs (song_id, title, artist_id, year, duration) 
+                       SELECT song_id, title, artist_id, year, duration 
+                       FROM songs_staging
+                       ORDER BY song_id
+                       ON CONFLICT (song_id) DO NOTHING """)
+
+artist_table_merge = ("""INSERT INTO artists (artist_id, name, location, latitude, longitude) 
+                         SELECT artist_id, name, location, latitude, longitude 
+                         FROM artists_staging
+                         ORDER BY artist_id
+                         ON CONFLICT (artist_id) DO NOTHING """)
+
+time_table_merge = ("""INSERT INTO time (start_time, hour, day, week, month, year, weekday) 
+                       SELECT start_time, hour, day, week, month, year, weekday 
+                       FROM time_staging
+                       ORDER BY start_time
+                       ON CONFLICT (start_time) DO NOTHING """)
+
 # FIND SONGS
 song_select = ("""SELECT songs.song_id, artists.artist_id
                   FROM songs
                   INNER JOIN artists ON songs.artist_id = artists.artist_id  
                   WHERE title=%s AND name=%s AND duration=%s """)
 
+# all the songs with their artist, used to build the in-memory lookup of song_lookup.py
+song_lookup_select = ("""SELECT songs.song_id, songs.title, songs.artist_id, artists.name, songs.duration
+                         FROM songs
+                         INNER JOIN artists ON songs.artist_id = artists.artist_id """)
+
+# MANIFEST OF PROCESSED FILES
+
+manifest_select = ("""SELECT filepath, size, mtime, content_hash 
+                      FROM etl_manifest
+                      WHERE filepath LIKE %s ESCAPE '\\' """)
+
+manifest_upsert = ("""INSERT INTO etl_manifest (filepath, size, mtime, content_hash) 
+                      VALUES %s
+                      ON CONFLICT (filepath) 
+                          DO UPDATE SET size = EXCLUDED.size, mtime = EXCLUDED.mtime, 
+                                        content_hash = EXCLUDED.content_hash, processed_at = now() """)
+
 # QUERY LISTS
 
-create_table_queries = [songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
+create_table_queries = [songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, manifest_table_create]
+drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, manifest_table_drop]
 
 
 
@@ -0,0 +1,49 @@
+"""
+Tests of etl.py against the database of db.cfg (skipped if it cannot be reached).
+Every test runs in its own schema, dropped at the end.
+"""
+import os
+import glob
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+import etl
+from db import connect
+from sql_queries import create_table_queries
+
+
+SONG_FILE = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', 'song_data', '**', '*.json'), recursive=True))[0]
+
+
+@pytest.fixture
+def cur():
+    try:
+        conn = connect(os.path.join(os.path.dirname(__file__), 'db.cfg'))
+    except psycopg2.OperationalError as e:
+        pytest.skip('database not available: {}'.format(e))
+
+    cur = conn.cursor()
+    cur.execute('CREATE SCHEMA test_etl')
+    cur.execute('SET search_path TO test_etl')
+    for query in create_table_queries:
+        cur.execute(query)
+
+    yield cur
+
+    conn.rollback()
+    cur.execute('DROP SCHEMA IF EXISTS test_etl CASCADE')
+    conn.commit()
+    conn.close()
+
+
+def test_song_file_loaded_twice(cur):
+    # row mode: a changed song file processed again (--incremental) must not fail on the songs already loaded
+    etl.process_song_file(cur, SONG_FILE)
+    etl.process_song_file(cur, SONG_FILE)
+
+    cur.execute('SELECT COUNT(*) FROM songs')
+    assert cur.fetchone()[0] == 1
+    cur.execute('SELECT COUNT(*) FROM artists')
+    assert cur.fetchone()[0] == 1
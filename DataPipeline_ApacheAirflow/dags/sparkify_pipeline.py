@@ -1,9 +1,11 @@
 from datetime import datetime, timedelta
 import os
 from airflow import DAG
+from airflow.models import Variable
 from airflow.operators.dummy_operator import DummyOperator
 from airflow.operators import (StageToRedshiftOperator, LoadFactOperator,
-                                LoadDimensionOperator, DataQualityOperator, EmptyQualityOperator)
+                                LoadDimensionOperator, DataQualityOperator, EmptyQualityOperator,
+                                RecordLoadedKeysOperator)
 from helpers import SqlQueries
 
 
@@ -15,7 +17,8 @@ You can find every operator and steps used in the Sparkify pipeline
 #Creation of the Dag and its default settings
 default_args = {
     'owner': 'udacity',
-    'start_date': datetime(2019, 1, 12),
+    'start_date': datetime(2018, 11, 1),
+    'end_date': datetime(2018, 11, 30),
     'depends_on_past': False,
     'retries': 3,
     'retry_delay': timedelta(minutes=5),
@@ -26,9 +29,14 @@ default_args = {
 dag = DAG('sparkigy_pipeline',
           default_args=default_args,
           description='Load and transform data in Redshift with Airflow',
-          schedule_interval=None # Only when asked
+          schedule_interval='@daily', # Each run loads the logs of its day
+          max_active_runs=1 # The runs update the same list of loaded files
         )
 
+# Bucket where the COPY manifests and the list of loaded files are written (Airflow variable)
+# If empty, the whole s3_key is copied at each run
+manifest_bucket = Variable.get("manifest_bucket", default_var="")
+
 """
 Define all the operator and tasks used for this pipeline
 """
@@ -44,8 +52,10 @@ stage_events_to_redshift = StageToRedshiftOperator(
     aws_credentials_id="aws_credentials",
     target_table="staging_events",
     s3_bucket="udacity-dend",
-    s3_key="log_data",
-    json_sql="s3://udacity-dend/log_json_path.json"
+    s3_key="log_data/{{ execution_date.strftime('%Y/%m/%Y-%m-%d') }}", # Only the logs of the day of the run
+    json_sql="s3://udacity-dend/log_json_path.json",
+    manifest_bucket=manifest_bucket,
+    clear_table=True # The staging table only holds the logs of the run
 )
 
 
@@ -58,7 +68,9 @@ stage_songs_to_redshift = StageToRedshiftOperator(
     target_table="staging_songs",
     s3_bucket="udacity-dend",
     s3_key="song_data",
-    json_sql="auto"
+    json_sql="auto",
+    manifest_bucket=manifest_bucket,
+    clear_table=not manifest_bucket # With a manifest, only the new songs are added to the staging table
 )
 
 
@@ -79,7 +91,9 @@ load_user_dimension_table = LoadDimensionOperator(
     dag=dag,
     redshift_conn_id="redshift",
     dimension_table="users",
-    sql_querry=SqlQueries.user_table_insert
+    sql_querry=SqlQueries.user_table_insert,
+    mode="merge", # The staging table only holds the logs of the run
+    primary_key="userid"
 )
 
 
@@ -88,7 +102,8 @@ load_song_dimension_table = LoadDimensionOperator(
     dag=dag,
     redshift_conn_id="redshift",
     dimension_table="songs",
-    sql_querry=SqlQueries.song_table_insert
+    sql_querry=SqlQueries.song_table_insert,
+    mode="truncate-insert" # The staging table holds all the songs
 )
 
 load_artist_dimension_table = LoadDimensionOperator(
@@ -96,7 +111,8 @@ load_artist_dimension_table = LoadDimensionOperator(
     dag=dag,
     redshift_conn_id="redshift",
     dimension_table="artists",
-    sql_querry=SqlQueries.artist_table_insert
+    sql_querry=SqlQueries.artist_table_insert,
+    mode="truncate-insert" # The staging table holds all the songs
 )
 
 load_time_dimension_table = LoadDimensionOperator(
@@ -104,7 +120,9 @@ load_time_dimension_table = LoadDimensionOperator(
     dag=dag,
     redshift_conn_id="redshift",
     dimension_table="time",
-    sql_querry=SqlQueries.time_table_insert
+    sql_querry=SqlQueries.time_table_insert,
+    mode="merge",
+    primary_key="start_time"
 )
 
 
@@ -122,6 +140,15 @@ run_quality_empty = EmptyQualityOperator(
     tables=['artists', 'time', 'users', 'songs', 'songplays']
 )
 
+# Once the data passed the checks, mark the staged logs as loaded (the next runs do not copy them again)
+record_loaded_keys = RecordLoadedKeysOperator(
+    task_id='Record_loaded_keys',
+    dag=dag,
+    aws_credentials_id="aws_credentials",
+    manifest_bucket=manifest_bucket,
+    tables=["staging_events"] # The staging tables emptied at each run (clear_table)
+)
+
 # End of the dag
 end_operator = DummyOperator(task_id='Stop_execution',  dag=dag, trigger_rule='all_done')
 
@@ -143,5 +170,6 @@ load_songplays_table >> [load_user_dimension_table, load_song_dimension_table, l
 [load_user_dimension_table, load_song_dimension_table, load_artist_dimension_table, load_time_dimension_table]   >> run_quality_checks
 [load_user_dimension_table, load_song_dimension_table, load_artist_dimension_table, load_time_dimension_table]   >> run_quality_empty
 
-# Step 5: Close dags
-[run_quality_checks, run_quality_empty] >> end_operator
\ No newline at end of file
+# Step 5: Record the loaded logs and close dags
+[run_quality_checks, run_quality_empty] >> record_loaded_keys
+record_loaded_keys >> end_operator
\ No newline at end of file
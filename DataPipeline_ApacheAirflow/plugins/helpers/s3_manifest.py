@@ -0,0 +1,166 @@
+"""
+Helpers to stage only the new S3 objects (StageToRedshiftOperator with a manifest_bucket):
+ - the objects under the rendered s3_key are listed (keys and sizes only)
+ - the keys already loaded in the table are kept in a JSON object of the manifest bucket
+ - a COPY manifest with only the new objects is written next to it
+Every function takes a boto3 S3 client, so they run the same against AWS, MinIO or moto.
+The plugins are deployed on their own in the Airflow home, so they cannot import the Data Warehouse project:
+the functions from parse_s3_path to prepare_manifest are the same as in DataWarehouse_S3_Redshift/s3_manifest.py
+and must be changed in both files (tests/test_s3_manifest.py runs the same cases as its test_s3_manifest.py).
+"""
+import json
+
+
+def parse_s3_path(path):
+
+    """
+    Split a S3 path into its bucket and its key (or prefix)
+
+    Arguments:
+    - path = S3 path (ex: 's3://udacity-dend/log_data')
+    """
+    path = path.strip("'")
+    if not path.startswith('s3://'):
+        raise ValueError('Not a S3 path: {}'.format(path))
+
+    bucket, _, key = path[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def list_objects(client, bucket, prefix):
+
+    """
+    List the objects under a prefix and return a dictionary {key: size in bytes}
+
+    Arguments:
+    - client = S3 client
+    - bucket = name of the bucket
+    - prefix = prefix of the keys
+    """
+    objects = {}
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if not obj['Key'].endswith('/') and obj['Size'] > 0:
+                objects[obj['Key']] = obj['Size']
+
+    return objects
+
+
+def get_new_objects(objects, loaded_keys):
+
+    """
+    Return the objects that were not loaded yet as a sorted list of (key, size)
+
+    Arguments:
+    - objects = dictionary {key: size} (see list_objects)
+    - loaded_keys = keys already loaded
+    """
+    loaded_keys = set(loaded_keys)
+    return sorted((key, size) for key, size in objects.items() if key not in loaded_keys)
+
+
+def build_manifest(bucket, objects):
+
+    """
+    Build a COPY manifest for a list of objects. Every entry is mandatory: COPY fails if an object is missing.
+
+    Arguments:
+    - bucket = name of the bucket of the objects
+    - objects = list of (key, size)
+    """
+    return {'entries': [{'url': 's3://{}/{}'.format(bucket, key),
+                         'mandatory': True,
+                         'meta': {'content_length': size}} for key, size in objects]}
+
+
+def write_manifest(client, manifest_path, name, manifest):
+
+    """
+    Upload a manifest under manifest_path and return its S3 path (used in FROM '...' MANIFEST)
+
+    Arguments:
+    - client = S3 client
+    - manifest_path = S3 folder of the manifests (ex: 's3://my-bucket/manifests')
+    - name = file name of the manifest
+    - manifest = manifest (see build_manifest)
+    """
+    bucket, prefix = parse_s3_path(manifest_path)
+    key = '/'.join(part for part in [prefix.rstrip('/'), name] if part)
+    client.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest).encode('utf-8'))
+
+    return 's3://{}/{}'.format(bucket, key)
+
+
+def prepare_manifest(client, source, loaded_keys, manifest_path, name):
+
+    """
+    List a source, keep the new objects and write their manifest.
+    Returns the S3 path of the manifest and the new keys (None and [] if there is nothing new).
+
+    Arguments:
+    - client = S3 client
+    - source = S3 prefix of the source (ex: 's3://udacity-dend/log_data/2018/11/2018-11-12')
+    - loaded_keys = keys of the source already loaded
+    - manifest_path = S3 folder of the manifests
+    - name = file name of the manifest
+    """
+    bucket, prefix = parse_s3_path(source)
+    objects = get_new_objects(list_objects(client, bucket, prefix), loaded_keys)
+    if not objects:
+        return None, []
+
+    manifest = write_manifest(client, manifest_path, name, build_manifest(bucket, objects))
+    print('    {}: {} new objects ({:.1f} MB) listed in {}'.format(source, len(objects),
+                                                                   sum(size for key, size in objects) / 1024 / 1024, manifest))
+    return manifest, [key for key, size in objects]
+
+
+def read_loaded_keys(client, bucket, key):
+
+    """
+    Read the keys already loaded in a staging table (empty if the table was never staged with a manifest)
+
+    Arguments:
+    - client = S3 client
+    - bucket = manifest bucket
+    - key = key of the JSON list of the loaded keys
+    """
+    try:
+        return json.loads(client.get_object(Bucket=bucket, Key=key)['Body'].read())
+    except client.exceptions.NoSuchKey:
+        return []
+
+
+def read_manifest_keys(client, manifest):
+
+    """
+    Return the keys listed in a COPY manifest (empty if the manifest does not exist: nothing was new)
+
+    Arguments:
+    - client = S3 client
+    - manifest = S3 path of the manifest (see prepare_manifest)
+    """
+    bucket, key = parse_s3_path(manifest)
+    try:
+        entries = json.loads(client.get_object(Bucket=bucket, Key=key)['Body'].read())['entries']
+    except client.exceptions.NoSuchKey:
+        return []
+
+    return [parse_s3_path(entry['url'])[1] for entry in entries]
+
+
+def add_loaded_keys(client, bucket, key, new_keys):
+
+    """
+    Add keys to the keys already loaded in a staging table (adding the same keys again changes nothing)
+
+    Arguments:
+    - client = S3 client
+    - bucket = manifest bucket
+    - key = key of the JSON list of the loaded keys
+    - new_keys = keys loaded by the run
+    """
+    loaded_keys = read_loaded_keys(client, bucket, key)
+    client.put_object(Bucket=bucket, Key=key,
+                      Body=json.dumps(sorted(set(loaded_keys) | set(new_keys))).encode('utf-8'))
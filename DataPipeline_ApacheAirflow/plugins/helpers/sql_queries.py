@@ -19,10 +19,13 @@ class SqlQueries:
                 AND events.length = songs.duration
     """)
 
+    # One row per user: the level of the last event of the user
     user_table_insert = ("""
-        SELECT distinct userid, firstname, lastname, gender, level
-        FROM staging_events
-        WHERE page='NextSong'
+        SELECT userid, firstname, lastname, gender, level
+        FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY userid ORDER BY ts DESC) AS event_rank
+            FROM staging_events
+            WHERE page='NextSong' AND userid IS NOT NULL) events
+        WHERE event_rank = 1
     """)
 
     song_table_insert = ("""
@@ -3,11 +3,13 @@ from operators.load_fact import LoadFactOperator
 from operators.load_dimension import LoadDimensionOperator
 from operators.data_quality import DataQualityOperator
 from operators.empty_quality import EmptyQualityOperator
+from operators.record_loaded_keys import RecordLoadedKeysOperator
 
 __all__ = [
     'StageToRedshiftOperator',
     'LoadFactOperator',
     'LoadDimensionOperator',
     'DataQualityOperator', 
-    'EmptyQualityOperator'
+    'EmptyQualityOperator',
+    'RecordLoadedKeysOperator'
 ]
@@ -10,6 +10,11 @@ This operator:
 
 Requires the empty table in redshift to be created prior
 
+Load modes:
+- append: the rows are added to the dimension table
+- truncate-insert: the dimension table is emptied, then loaded (TRUNCATE commits on its own in redshift)
+- merge: in one transaction, the rows are staged in a temporary table, the rows of the dimension with the same
+  primary_key are deleted, then the staged rows are inserted. Running the same load again does not add any row.
 """
 
 class LoadDimensionOperator(BaseOperator):
@@ -19,6 +24,19 @@ class LoadDimensionOperator(BaseOperator):
         INSERT INTO {}
         {} """
 
+    truncate_dimension_table_sql = """
+        TRUNCATE TABLE {} """
+
+    merge_dimension_table_sql = """
+        CREATE TEMP TABLE {0}_stage (LIKE {0});
+        INSERT INTO {0}_stage
+        {2};
+        DELETE FROM {0} USING {0}_stage WHERE {0}.{1} = {0}_stage.{1};
+        INSERT INTO {0} SELECT DISTINCT * FROM {0}_stage;
+        DROP TABLE {0}_stage; """
+
+    load_modes = ["append", "truncate-insert", "merge"]
+
     ui_color = '#80BD9E'
 
     @apply_defaults
@@ -26,22 +44,45 @@ class LoadDimensionOperator(BaseOperator):
                  redshift_conn_id="redshift",
                  dimension_table="",
                  sql_querry="",
+                 mode="append", # append, truncate-insert or merge
+                 primary_key="", # column matching the rows to replace (merge mode)
                  *args, **kwargs):
 
         super(LoadDimensionOperator, self).__init__(*args, **kwargs)
+        if mode not in LoadDimensionOperator.load_modes:
+            raise ValueError(f"Unknown load mode {mode}, expected one of {LoadDimensionOperator.load_modes}")
+        if mode == "merge" and not primary_key:
+            raise ValueError("The merge mode requires a primary_key")
+
         self.redshift_conn_id = redshift_conn_id
         self.dimension_table = dimension_table
         self.sql_querry = sql_querry
+        self.mode = mode
+        self.primary_key = primary_key
 
     def execute(self, context):
         # Set credentials
         self.log.info("----> Setting Redshift credentials")
         redshift = PostgresHook(postgres_conn_id=self.redshift_conn_id)
-        
+
+        # Merge: replace the rows with the same key in one transaction
+        if self.mode == "merge":
+            self.log.info(f"----> Merging the new data into the dimension table {self.dimension_table} (key: {self.primary_key})")
+            redshift.run(LoadDimensionOperator.merge_dimension_table_sql.format(
+                self.dimension_table,
+                self.primary_key,
+                self.sql_querry))
+            return
+
+        # Truncate-insert: empty the dimension table before loading it
+        if self.mode == "truncate-insert":
+            self.log.info(f"----> Emptying the dimension table {self.dimension_table}")
+            redshift.run(LoadDimensionOperator.truncate_dimension_table_sql.format(self.dimension_table))
+
         # Selecting and transforming data, then loading into dimension table
         self.log.info(f"----> Collecting data and creating the dimension table {self.dimension_table}")
         formatted_table = LoadDimensionOperator.insert_dimension_table_sql.format(
             self.dimension_table,
             self.sql_querry)
-        
+
         redshift.run(formatted_table)
@@ -0,0 +1,48 @@
+"""
+Record Loaded Keys Operator:
+Add the objects staged by the run to the loaded keys of their tables, once every load reading them succeeded.
+Used for the staging tables emptied at each run (StageToRedshiftOperator with clear_table and a manifest_bucket):
+until this task runs, the next run (or a rerun of the same run) lists the same objects as new and copies them again.
+The manifest of the run is s3://<manifest_bucket>/<manifest_prefix>/<table>/<ts_nodash>.manifest
+(no manifest: nothing was new). Recording the same run twice changes nothing.
+"""
+from airflow.contrib.hooks.aws_hook import AwsHook
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+from helpers.s3_manifest import read_manifest_keys, add_loaded_keys
+
+
+class RecordLoadedKeysOperator(BaseOperator):
+
+    ui_color = '#358140'
+
+    # Parameters rendered with the context of the run
+    template_fields = ("manifest_bucket",)
+
+    @apply_defaults
+    def __init__(self,
+                 aws_credentials_id="aws_credentials",
+                 manifest_bucket="",
+                 manifest_prefix="manifests",
+                 tables=[], # Staging tables of the manifests (target_table of the stage tasks)
+                 *args, **kwargs):
+
+        super(RecordLoadedKeysOperator, self).__init__(*args, **kwargs)
+        self.aws_credentials_id = aws_credentials_id
+        self.manifest_bucket = manifest_bucket
+        self.manifest_prefix = manifest_prefix
+        self.tables = tables
+
+    def execute(self, context):
+        # Without a manifest bucket the whole s3_key is copied at each run: there is nothing to record
+        if not self.manifest_bucket:
+            self.log.info("----> No manifest bucket, nothing to record")
+            return
+
+        s3 = AwsHook(self.aws_credentials_id).get_client_type('s3')
+        for table in self.tables:
+            folder = f"{self.manifest_prefix.strip('/')}/{table}"
+            keys = read_manifest_keys(s3, f"s3://{self.manifest_bucket}/{folder}/{context['ts_nodash']}.manifest")
+            self.log.info(f"----> Recording {len(keys)} loaded objects of {table}")
+            if keys:
+                add_loaded_keys(s3, self.manifest_bucket, f"{folder}/loaded_keys.json", keys)
@@ -2,11 +2,24 @@ from airflow.contrib.hooks.aws_hook import AwsHook
 from airflow.hooks.postgres_hook import PostgresHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from helpers.s3_manifest import prepare_manifest, read_loaded_keys, add_loaded_keys
 
 """
 Load Dimension Operator:
 Take data from S3 and copy the data into new table in Redshift 
 Requires the empty table in redshift to be created prior
+
+s3_key is templated (ex: "log_data/{{ execution_date.strftime('%Y/%m/%Y-%m-%d') }}" for the files of the run's day)
+With a manifest_bucket, only the objects under s3_key that were not loaded yet are copied:
+ - the keys already loaded are kept in s3://<manifest_bucket>/<manifest_prefix>/<table>/loaded_keys.json
+ - a COPY manifest of the new objects is written in the same folder
+ - without clear_table, the staged rows are kept: the loaded keys are updated once the COPY is committed
+ - with clear_table, the next run deletes the staged rows: the keys of the run's manifest are added to the loaded keys
+   by a RecordLoadedKeysOperator after the downstream loads, so a failed or cleared run copies the same objects again
+With clear_table, the rows of the table are deleted in the same transaction as the COPY (or alone if nothing is new)
+file_format (json, csv or parquet) and compression (gzip or zstd, for json and csv) describe the source files:
+the compressed columnar files written by a pre-stage conversion (see prestage.py of the data warehouse project)
+are smaller and faster to copy than the raw JSON
 """
 
 class StageToRedshiftOperator(BaseOperator):
@@ -14,6 +27,9 @@ class StageToRedshiftOperator(BaseOperator):
     
     # UI colour in Apache Airflow
     ui_color = '#358140'
+
+    # Parameters rendered with the context of the run
+    template_fields = ("s3_key", "manifest_bucket")
     
     # SQL statement to copy data
     copy_sql = """
@@ -21,9 +37,21 @@ class StageToRedshiftOperator(BaseOperator):
         FROM '{}'
         ACCESS_KEY_ID '{}'
         SECRET_ACCESS_KEY '{}' 
-        JSON '{}'
+        {}
     """
 
+    # Format options of the COPY for each file_format (json_sql: 'auto' or path of a jsonpath file)
+    # Parquet files are read by position and compressed inside the files
+    copy_formats = {
+        "json": "JSON '{}'",
+        "csv": "CSV IGNOREHEADER 1 EMPTYASNULL",
+        "parquet": "FORMAT AS PARQUET"
+    }
+    copy_compressions = {"": "", "gzip": "GZIP", "zstd": "ZSTD"}
+
+    # SQL statement to copy the objects listed in a manifest
+    manifest_copy_sql = copy_sql + "MANIFEST"
+
     
     @apply_defaults
     def __init__(self,
@@ -33,15 +61,30 @@ class StageToRedshiftOperator(BaseOperator):
                  s3_bucket="",
                  s3_key="",
                  json_sql="",
+                 manifest_bucket="",
+                 manifest_prefix="manifests",
+                 clear_table=False,
+                 file_format="json", # json, csv or parquet
+                 compression="", # gzip or zstd for json and csv files
                  *args, **kwargs):
 
         super(StageToRedshiftOperator, self).__init__(*args, **kwargs)
+        if file_format not in StageToRedshiftOperator.copy_formats:
+            raise ValueError(f"Unknown file format {file_format}, expected one of {list(StageToRedshiftOperator.copy_formats)}")
+        if compression not in StageToRedshiftOperator.copy_compressions:
+            raise ValueError(f"Unknown compression {compression}, expected one of {list(StageToRedshiftOperator.copy_compressions)}")
+
         self.redshift_conn_id = redshift_conn_id
         self.aws_credentials_id = aws_credentials_id
         self.target_table = target_table
         self.s3_bucket = s3_bucket
         self.s3_key = s3_key
         self.json_sql = json_sql
+        self.manifest_bucket = manifest_bucket
+        self.manifest_prefix = manifest_prefix
+        self.clear_table = clear_table
+        self.file_format = file_format
+        self.compression = compression
         
 
     def execute(self, context):
@@ -52,24 +95,56 @@ class StageToRedshiftOperator(BaseOperator):
         redshift = PostgresHook(postgres_conn_id=self.redshift_conn_id)
 
         # Copy data from S3 to redshift
-        self.log.info(f"Copying data from S3 (file: {self.s3_key}) to Redshift (table destination: {self.target_table})")
         rendered_key = self.s3_key.format(**context)
-        s3_path = f"s3://{self.s3_bucket}/{rendered_key}"
-        
-        formatted_sql = StageToRedshiftOperator.copy_sql.format(
+        self.log.info(f"Copying data from S3 (file: {rendered_key}) to Redshift (table destination: {self.target_table})")
+
+        if self.manifest_bucket:
+            s3 = aws_hook.get_client_type('s3')
+            loaded_keys = read_loaded_keys(s3, self.manifest_bucket, f"{self.state_folder()}/loaded_keys.json")
+            s3_path, new_keys = prepare_manifest(s3, f"s3://{self.s3_bucket}/{rendered_key}", loaded_keys,
+                                                 f"s3://{self.manifest_bucket}/{self.state_folder()}",
+                                                 f"{context['ts_nodash']}.manifest")
+            if s3_path is None:
+                self.log.info("----> No new object to copy")
+                # The staging table must not keep the rows of a previous run (they would be loaded again downstream)
+                if self.clear_table:
+                    self.log.info(f"----> Emptying the staging table {self.target_table}")
+                    redshift.run(f"DELETE FROM {self.target_table}")
+                return
+            copy_sql = StageToRedshiftOperator.manifest_copy_sql
+        else:
+            s3_path = f"s3://{self.s3_bucket}/{rendered_key}"
+            copy_sql = StageToRedshiftOperator.copy_sql
+
+        formatted_sql = copy_sql.format(
             self.target_table,
             s3_path,
             aws_credentials.access_key,
             aws_credentials.secret_key,
-            self.json_sql
+            self.format_options()
         )
-        
+
 #         self.log.info(formatted_sql)
 
-        # Run query
-        redshift.run(formatted_sql)
+        # Run query (with the DELETE in the same transaction)
+        if self.clear_table:
+            redshift.run([f"DELETE FROM {self.target_table}", formatted_sql])
+        else:
+            redshift.run(formatted_sql)
 
+        # Mark the new objects as loaded (with clear_table, RecordLoadedKeysOperator does it after the downstream loads)
+        if self.manifest_bucket and not self.clear_table:
+            add_loaded_keys(s3, self.manifest_bucket, f"{self.state_folder()}/loaded_keys.json", new_keys)
 
 
+    def format_options(self):
+        # Format and compression options of the COPY
+        options = StageToRedshiftOperator.copy_formats[self.file_format].format(self.json_sql)
+        if self.file_format != "parquet" and self.compression:
+            options += " " + StageToRedshiftOperator.copy_compressions[self.compression]
+        return options
 
 
+    def state_folder(self):
+        # Folder of the manifests and loaded keys of the table
+        return f"{self.manifest_prefix.strip('/')}/{self.target_table}"
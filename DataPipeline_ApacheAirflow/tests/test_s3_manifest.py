@@ -0,0 +1,109 @@
+"""
+Tests of the incremental staging helpers (plugins/helpers/s3_manifest.py) against moto.
+The same cases run on the Data Warehouse helper (DataWarehouse_S3_Redshift/test_s3_manifest.py).
+"""
+import os
+import sys
+import ast
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'plugins'))
+
+from helpers import s3_manifest
+from helpers.s3_manifest import get_new_objects, prepare_manifest, read_loaded_keys, read_manifest_keys, add_loaded_keys
+
+
+MANIFEST_PATH = 's3://manifests/manifests/staging_events'
+SHARED_FUNCTIONS = ['parse_s3_path', 'list_objects', 'get_new_objects', 'build_manifest', 'write_manifest', 'prepare_manifest']
+WAREHOUSE_HELPER = os.path.join(os.path.dirname(__file__), '..', '..', 'DataWarehouse_S3_Redshift', 's3_manifest.py')
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket='source')
+        client.create_bucket(Bucket='manifests')
+        for key in ['log_data/2018/11/a.json', 'log_data/2018/11/b.json']:
+            client.put_object(Bucket='source', Key=key, Body=b'{}')
+        yield client
+
+
+def read_manifest(client, manifest):
+    bucket, key = manifest[len('s3://'):].split('/', 1)
+    return json.loads(client.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+
+def function_sources(path):
+    # Source of the shared functions of a helper file
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    return {node.name: ast.dump(node) for node in tree.body
+            if isinstance(node, ast.FunctionDef) and node.name in SHARED_FUNCTIONS}
+
+
+def test_get_new_objects():
+    objects = {'b': 2, 'a': 1, 'c': 3}
+    assert get_new_objects(objects, []) == [('a', 1), ('b', 2), ('c', 3)]
+    assert get_new_objects(objects, ['a', 'c', 'old']) == [('b', 2)]
+    assert get_new_objects(objects, objects) == []
+
+
+def test_first_run_lists_every_key(client):
+    manifest, keys = prepare_manifest(client, 's3://source/log_data', [], MANIFEST_PATH, 'run1.manifest')
+
+    assert manifest == 's3://manifests/manifests/staging_events/run1.manifest'
+    assert keys == ['log_data/2018/11/a.json', 'log_data/2018/11/b.json']
+    assert read_manifest(client, manifest) == {'entries': [
+        {'url': 's3://source/log_data/2018/11/a.json', 'mandatory': True, 'meta': {'content_length': 2}},
+        {'url': 's3://source/log_data/2018/11/b.json', 'mandatory': True, 'meta': {'content_length': 2}}]}
+
+
+def test_second_run_lists_only_new_keys(client):
+    manifest, loaded_keys = prepare_manifest(client, 's3://source/log_data', [], MANIFEST_PATH, 'run1.manifest')
+    client.put_object(Bucket='source', Key='log_data/2018/11/c.json', Body=b'{"a": 1}')
+
+    manifest, keys = prepare_manifest(client, 's3://source/log_data', loaded_keys, MANIFEST_PATH, 'run2.manifest')
+
+    assert keys == ['log_data/2018/11/c.json']
+    assert [entry['url'] for entry in read_manifest(client, manifest)['entries']] == ['s3://source/log_data/2018/11/c.json']
+
+
+def test_nothing_new_writes_no_manifest(client):
+    loaded_keys = ['log_data/2018/11/a.json', 'log_data/2018/11/b.json']
+    client.put_object(Bucket='source', Key='log_data/2018/11/empty.json', Body=b'')
+
+    assert prepare_manifest(client, 's3://source/log_data', loaded_keys, MANIFEST_PATH, 'run3.manifest') == (None, [])
+    assert 'Contents' not in client.list_objects_v2(Bucket='manifests')
+
+
+def test_recorded_keys_are_not_listed_again(client):
+    state = 'manifests/staging_events/loaded_keys.json'
+    assert read_loaded_keys(client, 'manifests', state) == []
+
+    # the run's manifest is only recorded after the downstream loads: until then, a rerun lists the same keys
+    manifest, keys = prepare_manifest(client, 's3://source/log_data', [], MANIFEST_PATH, 'run1.manifest')
+    assert prepare_manifest(client, 's3://source/log_data', read_loaded_keys(client, 'manifests', state),
+                            MANIFEST_PATH, 'run1.manifest')[1] == keys
+
+    # recording the run twice keeps each key once
+    add_loaded_keys(client, 'manifests', state, read_manifest_keys(client, manifest))
+    add_loaded_keys(client, 'manifests', state, read_manifest_keys(client, manifest))
+    assert read_loaded_keys(client, 'manifests', state) == keys
+    assert prepare_manifest(client, 's3://source/log_data', read_loaded_keys(client, 'manifests', state),
+                            MANIFEST_PATH, 'run2.manifest') == (None, [])
+
+    # a run without manifest (nothing was new) records nothing
+    assert read_manifest_keys(client, MANIFEST_PATH + '/run2.manifest') == []
+
+
+@pytest.mark.skipif(not os.path.exists(WAREHOUSE_HELPER), reason='Data Warehouse project not next to this one')
+def test_shared_functions_match_the_warehouse_helper():
+    assert function_sources(s3_manifest.__file__) == function_sources(WAREHOUSE_HELPER)
@@ -0,0 +1,310 @@
+"""
+Benchmark of the distribution and sort keys of the star schema (DISTRIBUTION in sql_queries.py)
+
+1. Create the final tables in a separate schema with two layouts:
+   - tuned: the DDL of sql_queries.py with its DISTSTYLE / DISTKEY / SORTKEY
+   - baseline: the same DDL with the hints stripped (DISTSTYLE AUTO on Redshift)
+2. Load the same synthetic data in both layouts (skewed: a few songs and users get most of the plays)
+3. Run representative analytic queries several times and report the first run (compilation on Redshift)
+   and the median of the other runs
+4. Save the results as JSON in benchmark_results/
+
+With --dsn, the benchmark runs against a local Postgres stand-in: the hints are stripped in both layouts and,
+in the tuned layout, each SORTKEY is emulated by an index the table is clustered on.
+"""
+import os
+import re
+import json
+import time
+import random
+import argparse
+import statistics
+import subprocess
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from db import connect
+from sql_queries import songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create
+
+FINAL_TABLES = [('songplays', songplay_table_create), ('users', user_table_create), ('songs', song_table_create),
+                ('artists', artist_table_create), ('time', time_table_create)]
+
+ANALYTIC_QUERIES = {
+    'top_songs': """
+        SELECT songs.title, artists.name, COUNT(*) AS plays
+        FROM songplays
+        JOIN songs ON songs.song_id = songplays.song_id
+        JOIN artists ON artists.artist_id = songplays.artist_id
+        GROUP BY songs.title, artists.name
+        ORDER BY plays DESC
+        LIMIT 10""",
+    'plays_by_hour_paid': """
+        SELECT time.hour, COUNT(*) AS plays
+        FROM songplays
+        JOIN time ON time.start_time = songplays.start_time
+        JOIN users ON users.user_id = CAST(songplays.user_id AS int)
+        WHERE users.level = 'paid'
+        GROUP BY time.hour
+        ORDER BY time.hour""",
+    'one_week_active_users': """
+        SELECT users.first_name, users.last_name, COUNT(*) AS plays
+        FROM songplays
+        JOIN users ON users.user_id = CAST(songplays.user_id AS int)
+        WHERE songplays.start_time >= '2018-11-05' AND songplays.start_time < '2018-11-12'
+        GROUP BY users.first_name, users.last_name
+        ORDER BY plays DESC
+        LIMIT 10""",
+    'monthly_plays_by_level': """
+        SELECT time.year, time.month, songplays.level, COUNT(*) AS plays
+        FROM songplays
+        JOIN time ON time.start_time = songplays.start_time
+        GROUP BY time.year, time.month, songplays.level
+        ORDER BY time.year, time.month, songplays.level""",
+    'artists_by_location': """
+        SELECT artists.location, COUNT(DISTINCT songplays.artist_id) AS artists, COUNT(*) AS plays
+        FROM songplays
+        JOIN artists ON artists.artist_id = songplays.artist_id
+        GROUP BY artists.location
+        ORDER BY plays DESC
+        LIMIT 10""",
+}
+
+FIRST_NAMES = ['Walter', 'Kaylee', 'Jayden', 'Stefany', 'Marina', 'Makinley', 'Kevin', 'Kynnedi', 'Chloe', 'Aleena']
+LAST_NAMES = ['Frye', 'Summers', 'Fox', 'White', 'Sutton', 'Jones', 'Arellano', 'Sanchez', 'Cuevas', 'Kirby']
+LOCATIONS = ['San Francisco-Oakland-Hayward, CA', 'Phoenix-Mesa-Scottsdale, AZ', 'Chicago-Naperville-Elgin, IL-IN-WI',
+             'Atlanta-Sandy Springs-Roswell, GA', 'New York-Newark-Jersey City, NY-NJ-PA']
+USER_AGENTS = ['Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.1916.153 Safari/537.36',
+               'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0']
+
+HINTS = re.compile(r'\s*(DISTSTYLE\s+\w+|DISTKEY\s*\([^)]*\)|((COMPOUND|INTERLEAVED)\s+)?SORTKEY\s*\([^)]*\))', re.IGNORECASE)
+
+
+def strip_hints(query):
+
+    """
+    This function remove the DISTSTYLE, DISTKEY and SORTKEY of a CREATE TABLE
+
+    Arguments:
+    - query = CREATE TABLE query
+    """
+    return HINTS.sub('', query)
+
+
+def get_sortkey(query):
+
+    """
+    This function return the columns of the SORTKEY of a CREATE TABLE (None if there is no SORTKEY)
+
+    Arguments:
+    - query = CREATE TABLE query
+    """
+    match = re.search(r'SORTKEY\s*\(([^)]*)\)', query, re.IGNORECASE)
+    return match.group(1).strip() if match else None
+
+
+def to_postgres(query):
+
+    """
+    This function translate a CREATE TABLE of Redshift for the Postgres stand-in (hints stripped, IDENTITY column)
+
+    Arguments:
+    - query = CREATE TABLE query
+    """
+    return strip_hints(query).replace('IDENTITY(0,1)', 'GENERATED BY DEFAULT AS IDENTITY (MINVALUE 0 START WITH 0)')
+
+
+def create_tables(cur, layout, postgres):
+
+    """
+    This function create the final tables with a layout (tuned or baseline) in the current schema
+
+    Arguments:
+    - cur = cursor to the database
+    - layout = tuned (hints of sql_queries.py) or baseline (hints stripped)
+    - postgres = True for the Postgres stand-in
+    """
+    for table, query in FINAL_TABLES:
+        cur.execute('DROP TABLE IF EXISTS {}'.format(table))
+
+        if postgres:
+            cur.execute(to_postgres(query))
+            sortkey = get_sortkey(query)
+            if layout == 'tuned' and sortkey:
+                cur.execute('CREATE INDEX {0}_sortkey ON {0} ({1})'.format(table, sortkey))
+        else:
+            cur.execute(query if layout == 'tuned' else strip_hints(query))
+
+
+def generate_data(rng, num_plays, num_songs, num_artists, num_users, num_days):
+
+    """
+    This function generate the rows of the final tables. A few songs and users get most of the plays.
+
+    Arguments:
+    - rng = random generator
+    - num_plays = number of songplays
+    - num_songs = number of songs
+    - num_artists = number of artists
+    - num_users = number of users
+    - num_days = number of days covered by the songplays (from 2018-11-01)
+    """
+    def random_id(prefix):
+        return prefix + ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789') for i in range(16))
+
+    artists = [(random_id('AR'), 'Artist {}'.format(i), rng.choice(LOCATIONS),
+                rng.uniform(-90, 90), rng.uniform(-180, 180)) for i in range(num_artists)]
+    songs = [(random_id('SO'), 'Song {}'.format(i), rng.choice(artists)[0],
+              rng.randint(1960, 2018), rng.uniform(60, 600)) for i in range(num_songs)]
+    users = [(i, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), rng.choice('MF'),
+              rng.choice(['free', 'paid'])) for i in range(1, num_users + 1)]
+
+    # skewed popularity (weight 1/rank)
+    song_weights = [1 / rank for rank in range(1, num_songs + 1)]
+    user_weights = [1 / rank for rank in range(1, num_users + 1)]
+    played_songs = rng.choices(songs, weights=song_weights, k=num_plays)
+    played_users = rng.choices(users, weights=user_weights, k=num_plays)
+
+    start = datetime(2018, 11, 1)
+    songplays = []
+    for song, user in zip(played_songs, played_users):
+        start_time = start + timedelta(milliseconds=rng.randrange(num_days * 86400 * 1000))
+        songplays.append((start_time, str(user[0]), user[4], song[0], song[2], rng.randint(1, num_users * 10),
+                          rng.choice(LOCATIONS), rng.choice(USER_AGENTS)))
+
+    times = [(t, t.hour, t.day, t.isocalendar()[1], t.month, t.year, (t.weekday() + 1) % 7)
+             for t in set(play[0] for play in songplays)]
+
+    return {'songplays': songplays, 'users': users, 'songs': songs, 'artists': artists, 'time': times}
+
+
+def load_data(cur, data, layout, postgres):
+
+    """
+    This function insert the generated rows in the final tables and update the statistics
+
+    Arguments:
+    - cur = cursor to the database
+    - data = rows of each table (see generate_data)
+    - layout = tuned or baseline
+    - postgres = True for the Postgres stand-in
+    """
+    columns = {'songplays': 'start_time, user_id, level, song_id, artist_id, session_id, location, user_agent',
+               'users': 'user_id, first_name, last_name, gender, level',
+               'songs': 'song_id, title, artist_id, year, duration',
+               'artists': 'artist_id, name, location, latitude, longitude',
+               'time': 'start_time, hour, day, week, month, year, weekday'}
+
+    for table, rows in data.items():
+        execute_values(cur, 'INSERT INTO {} ({}) VALUES %s'.format(table, columns[table]), rows, page_size=1000)
+
+        # Postgres stand-in: the rows are physically sorted on the emulated SORTKEY
+        if postgres and layout == 'tuned' and get_sortkey(dict(FINAL_TABLES)[table]):
+            cur.execute('CLUSTER {0} USING {0}_sortkey'.format(table))
+
+        cur.execute('ANALYZE {}'.format(table))
+
+
+def run_queries(cur, repeat):
+
+    """
+    This function run every analytic query `repeat` times and return the time of the first run
+    and the median of the other runs (in seconds)
+
+    Arguments:
+    - cur = cursor to the database
+    - repeat = number of runs of each query
+    """
+    results = {}
+    for name, query in ANALYTIC_QUERIES.items():
+        timings = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            cur.execute(query)
+            cur.fetchall()
+            timings.append(time.perf_counter() - start)
+
+        results[name] = {'first_seconds': timings[0],
+                         'median_seconds': statistics.median(timings[1:] or timings)}
+        print('    {:<25} first {:.3f}s, median {:.3f}s'.format(name, results[name]['first_seconds'],
+                                                               results[name]['median_seconds']))
+
+    return results
+
+
+def git_revision():
+
+    """
+    Return the current git commit, saved with the results to compare runs
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+
+    """
+    Build both layouts, run the queries, print and save the results
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the distribution and sort keys of the star schema')
+    parser.add_argument('--dsn', default=None, help='connection string of a Postgres stand-in (Redshift of dwh.cfg if not given)')
+    parser.add_argument('--schema', default='sparkify_benchmark', help='schema where the tables are created (dropped at the end)')
+    parser.add_argument('--plays', type=int, default=1000000, help='number of songplays')
+    parser.add_argument('--songs', type=int, default=50000, help='number of songs')
+    parser.add_argument('--artists', type=int, default=10000, help='number of artists')
+    parser.add_argument('--users', type=int, default=1000, help='number of users')
+    parser.add_argument('--days', type=int, default=90, help='number of days covered by the songplays')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs of each query')
+    parser.add_argument('--seed', type=int, default=42, help='seed of the random generator')
+    parser.add_argument('--output', default='benchmark_results', help='folder where the results are saved')
+    args = parser.parse_args()
+
+    postgres = args.dsn is not None
+    conn = psycopg2.connect(args.dsn) if postgres else connect()
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    cur.execute('CREATE SCHEMA IF NOT EXISTS {}'.format(args.schema))
+    cur.execute('SET search_path TO {}'.format(args.schema))
+    if not postgres:
+        cur.execute('SET enable_result_cache_for_session TO off')
+
+    print('Generating {} songplays'.format(args.plays))
+    data = generate_data(random.Random(args.seed), args.plays, args.songs, args.artists, args.users, args.days)
+
+    results = {}
+    try:
+        for layout in ['baseline', 'tuned']:
+            print('\n-----> Layout: {}'.format(layout))
+            create_tables(cur, layout, postgres)
+            load_data(cur, data, layout, postgres)
+            results[layout] = run_queries(cur, args.repeat)
+    finally:
+        cur.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(args.schema))
+        conn.close()
+
+    speedup = {name: results['baseline'][name]['median_seconds'] / results['tuned'][name]['median_seconds']
+               for name in ANALYTIC_QUERIES if results['tuned'][name]['median_seconds']}
+
+    results = {'date': datetime.now().isoformat(timespec='seconds'),
+               'revision': git_revision(),
+               'target': 'postgres' if postgres else 'redshift',
+               'options': {key: value for key, value in vars(args).items() if key not in ('output', 'dsn')},
+               'layouts': results,
+               'speedup': speedup}
+
+    # save results
+    os.makedirs(args.output, exist_ok=True)
+    output_file = os.path.join(args.output, 'benchmark_{}.json'.format(datetime.now().strftime('%Y%m%d_%H%M%S')))
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print('\n\n-----> Benchmark results (saved in {})'.format(output_file))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
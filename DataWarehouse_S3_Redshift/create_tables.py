@@ -1,5 +1,4 @@
-import configparser
-import psycopg2
+from db import connect
 from sql_queries import create_table_queries, drop_table_queries
 
 
@@ -33,10 +32,7 @@ def main():
     them with new empty tables based on our star-schema. 
     """
     
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
-
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    conn = connect()
     cur = conn.cursor()
 
     drop_tables(cur, conn)
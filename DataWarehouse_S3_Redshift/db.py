@@ -0,0 +1,89 @@
+"""
+This file manages the connections to the Redshift cluster for create_tables.py and etl.py
+ - The connection settings are read from dwh.cfg ([CLUSTER]) and each of them can be overridden
+   by an environment variable DWH_<KEY> (ex: DWH_DB_PASSWORD)
+ - The session settings ([SESSION]) are sent once when each connection is opened (libpq "options"),
+   so the connections given by connect() or pooled_connection() need no extra query
+"""
+import os
+import configparser
+import psycopg2
+from contextlib import contextmanager
+from psycopg2.extensions import make_dsn
+from psycopg2.pool import ThreadedConnectionPool
+
+
+def load_config(config_file='dwh.cfg'):
+
+    """
+    Read the configuration file of the cluster
+
+    Arguments:
+    - config_file = path to the configuration file
+    """
+    config = configparser.ConfigParser()
+    config.read(config_file)
+
+    return config
+
+
+def get_dsn(config_file='dwh.cfg'):
+
+    """
+    Build the connection string to the cluster, including the session settings (statement timeout in ms, 0 = no timeout)
+
+    Arguments:
+    - config_file = path to the configuration file
+    """
+    config = load_config(config_file)
+    settings = {key: os.environ.get('DWH_' + key.upper(), value) for key, value in config['CLUSTER'].items()}
+    dsn = "host={host} dbname={db_name} user={db_user} password={db_password} port={db_port}".format(**settings)
+
+    # session settings sent at connection time (libpq "options")
+    session = config['SESSION'] if config.has_section('SESSION') else {}
+    options = '-c statement_timeout={}'.format(int(session.get('STATEMENT_TIMEOUT', '0')))
+
+    return make_dsn(dsn, options=options)
+
+
+def connect(config_file='dwh.cfg'):
+
+    """
+    Open a single connection to the cluster with the session settings
+
+    Arguments:
+    - config_file = path to the configuration file
+    """
+    return psycopg2.connect(get_dsn(config_file))
+
+
+def create_pool(config_file='dwh.cfg', maxconn=None):
+
+    """
+    Create a pool of connections to the cluster that can be shared by several threads (see pooled_connection)
+
+    Arguments:
+    - config_file = path to the configuration file
+    - maxconn = maximum number of connections (POOL_MAX of dwh.cfg if not given)
+    """
+    config = load_config(config_file)
+    session = config['SESSION'] if config.has_section('SESSION') else {}
+    maxconn = maxconn or int(session.get('POOL_MAX', '4'))
+
+    return ThreadedConnectionPool(1, maxconn, get_dsn(config_file))
+
+
+@contextmanager
+def pooled_connection(pool):
+
+    """
+    Borrow a connection from the pool and give it back at the end of the block
+
+    Arguments:
+    - pool = pool created with create_pool
+    """
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
@@ -1,6 +1,13 @@
-import configparser
-import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
+import argparse
+from datetime import datetime
+from db import connect, create_pool, load_config
+from query_executor import run_queries
+from s3_manifest import get_s3_client, prepare_manifest, load_loaded_keys, save_loaded_keys
+from sql_queries import copy_table_queries, insert_table_queries, copy_table_steps, insert_table_steps, \
+    manifest_copy_queries, incremental_insert_table_steps, dimension_merge_queries
+
+# prefix of the log files of a day under LOG_DATA (ex: log_data/2018/11/2018-11-12-events.json)
+LOG_DATE_PREFIX = '{:%Y/%m/%Y-%m-%d}'
 
 
 def load_staging_tables(cur, conn):
@@ -20,21 +27,119 @@ def load_staging_tables(cur, conn):
     print('Loading data into staging tables completed')
 
 
-def insert_tables(cur, conn):
+def insert_tables(cur, conn, queries=insert_table_queries):
     """
     This function use data from the staging tables and transform them into a star schema
     """
     q=1
-    print('New tables: 0/{} created'.format(len(insert_table_queries)))
-    for query in insert_table_queries:
+    print('New tables: 0/{} created'.format(len(queries)))
+    for query in queries:
         cur.execute(query)
         conn.commit()
         
-        print('New tables: {}/{} created'.format(q, len(insert_table_queries)))
+        print('New tables: {}/{} created'.format(q, len(queries)))
         q=q+1
     print('Transforming data and inserting into tables completed')
 
 
+def get_insert_steps(steps, dimension_load):
+    """
+    This function return the INSERT steps with the queries of the dimension load:
+    append (INSERT of every row) or merge (the rows of the dimensions with the same key are replaced)
+    """
+    if dimension_load == 'merge':
+        return [(name, dimension_merge_queries.get(name, query), depends_on) for name, query, depends_on in steps]
+    return steps
+
+
+def run_parallel(max_concurrency, dimension_load='merge'):
+    """
+    This function run the COPY and the INSERT as a single graph on pooled connections:
+    the two COPY run at the same time and each INSERT starts as soon as the staging tables it reads are loaded
+    """
+    pool = create_pool(maxconn=max_concurrency)
+    try:
+        timings, errors = run_queries(pool, copy_table_steps + get_insert_steps(insert_table_steps, dimension_load),
+                                      max_concurrency)
+    finally:
+        pool.closeall()
+
+    if errors:
+        raise RuntimeError('{} queries failed: {}'.format(len(errors), ', '.join(sorted(errors))))
+
+
+def get_dependents(steps, name):
+    """
+    This function return the name of a step and of every step depending on it, directly or through other steps
+    """
+    dependents = {name}
+    added = True
+    while added:
+        added = False
+        for step, query, depends_on in steps:
+            if step not in dependents and dependents & set(depends_on):
+                dependents.add(step)
+                added = True
+
+    return dependents
+
+
+def run_incremental(max_concurrency, date=None, dimension_load='merge'):
+    """
+    This function load only the S3 objects that were not loaded yet: the sources are listed, a manifest of the new
+    objects is written for each staging table and the INSERT reading a reloaded staging table are run.
+    With a date, only the log files of that day are listed.
+    """
+    config = load_config()
+    client = get_s3_client(config)
+    loaded_keys_file = config.get('S3', 'LOADED_KEYS_FILE', fallback='loaded_keys.json')
+    loaded_keys = load_loaded_keys(loaded_keys_file)
+    run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    sources = {'staging_events': config['S3']['LOG_DATA'].strip("'"),
+               'staging_songs': config['S3']['SONG_DATA'].strip("'")}
+    if date is not None:
+        sources['staging_events'] = sources['staging_events'].rstrip('/') + '/' + LOG_DATE_PREFIX.format(date)
+
+    # manifest of the new objects of each source
+    steps = []
+    new_keys = {}
+    for table, query in manifest_copy_queries.items():
+        manifest, keys = prepare_manifest(client, sources[table], loaded_keys.get(table, []),
+                                          config['S3']['MANIFEST_PATH'], '{}_{}.manifest'.format(table, run_id))
+        if manifest is None:
+            print('    {}: nothing new to load'.format(sources[table]))
+            continue
+        steps.append((table, query.format(manifest), []))
+        new_keys[table] = keys
+
+    if not steps:
+        print('Nothing new to load')
+        return
+
+    # INSERT of the tables reading a reloaded staging table
+    steps += [(name, query, depends_on) for name, query, depends_on in get_insert_steps(incremental_insert_table_steps, dimension_load)
+              if set(depends_on) & set(new_keys)]
+
+    pool = create_pool(maxconn=max_concurrency)
+    try:
+        timings, errors = run_queries(pool, steps, max_concurrency)
+    finally:
+        pool.closeall()
+
+    # the keys of a source are marked as loaded only when its COPY and every step reading it are committed:
+    # otherwise the next run would empty the staging table and never load those objects again
+    for table, keys in new_keys.items():
+        if get_dependents(steps, table) <= set(timings):
+            loaded_keys[table] = loaded_keys.get(table, []) + keys
+        else:
+            print('    {}: not marked as loaded (a step reading it failed)'.format(sources[table]))
+    save_loaded_keys(loaded_keys_file, loaded_keys)
+
+    if errors:
+        raise RuntimeError('{} queries failed: {}'.format(len(errors), ', '.join(sorted(errors))))
+
+
 def main():
     """
     This ETL process takes data from 2 sources located in S3 (logs and songs).
@@ -42,18 +147,35 @@ def main():
     Finally, from the staging tables, we load the data in our new star-schema
         that will be used for OLAP queries. 
     """
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
+    config = load_config()
+    session = config['SESSION'] if config.has_section('SESSION') else {}
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
-    
-    load_staging_tables(cur, conn)
-    insert_tables(cur, conn)
+    parser = argparse.ArgumentParser(description='Load the staging tables from S3 and the star schema from the staging tables')
+    parser.add_argument('--serial', action='store_true', help='run the queries one after the other on a single connection')
+    parser.add_argument('--max-concurrency', type=int, default=int(session.get('MAX_CONCURRENCY', '4')),
+                        help='maximum number of queries running at the same time (MAX_CONCURRENCY in dwh.cfg)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='copy only the S3 objects that were not loaded yet (listed in a COPY manifest)')
+    parser.add_argument('--date', type=lambda value: datetime.strptime(value, '%Y-%m-%d'), default=None,
+                        help='with --incremental, only list the log files of this day (YYYY-MM-DD)')
+    parser.add_argument('--dimension-load', choices=['append', 'merge'], default=session.get('DIMENSION_LOAD', 'merge'),
+                        help='append the rows to the dimensions or replace the rows with the same key (DIMENSION_LOAD in dwh.cfg)')
+    args = parser.parse_args()
 
-    print('---> Running etl.py is completed\n')
+    if args.incremental:
+        run_incremental(args.max_concurrency, args.date, args.dimension_load)
+    elif args.serial:
+        conn = connect()
+        cur = conn.cursor()
 
-    conn.close()
+        load_staging_tables(cur, conn)
+        insert_tables(cur, conn, [query for name, query, depends_on in get_insert_steps(insert_table_steps, args.dimension_load)])
+
+        conn.close()
+    else:
+        run_parallel(args.max_concurrency, args.dimension_load)
+
+    print('---> Running etl.py is completed\n')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,271 @@
+"""
+Pre-stage converter: rewrite the raw JSON files of S3 (or of a local folder) into compressed files
+that COPY loads faster (LOG_FORMAT / LOG_COMPRESSION and SONG_FORMAT / SONG_COMPRESSION in dwh.cfg)
+ - parquet: columnar, compressed inside the file (zstd, snappy or gzip)
+ - csv: compressed with gzip or zstd
+ - json: the same records compressed with gzip or zstd
+Each source file gives one file with the same relative path under the target (extension changed), or with
+--files-per-output, the small files (ex: one song per file) are grouped into part-<n> files.
+COPY matches the columns of Parquet and CSV files by position: the columns are written in the order
+and with the types of the staging table of the target project (--target-schema warehouse or airflow).
+"""
+import io
+import os
+import json
+import decimal
+import time
+import argparse
+
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from db import load_config
+from s3_manifest import get_s3_client, parse_s3_path, list_objects
+
+
+# columns of the staging tables, in the order of sql_queries.py: (JSON key, arrow type)
+STAGING_COLUMNS = {
+    'staging_events': [('artist', pa.string()), ('auth', pa.string()), ('firstName', pa.string()),
+                       ('gender', pa.string()), ('itemInSession', pa.int32()), ('lastName', pa.string()),
+                       ('length', pa.float64()), ('level', pa.string()), ('location', pa.string()),
+                       ('method', pa.string()), ('page', pa.string()), ('registration', pa.float64()),
+                       ('sessionId', pa.int32()), ('song', pa.string()), ('status', pa.int32()),
+                       ('ts', pa.int64()), ('userAgent', pa.string()), ('userId', pa.int32())],
+    'staging_songs': [('num_songs', pa.int32()), ('artist_id', pa.string()), ('artist_latitude', pa.float64()),
+                      ('artist_longitude', pa.float64()), ('artist_location', pa.string()),
+                      ('artist_name', pa.string()), ('song_id', pa.string()), ('title', pa.string()),
+                      ('duration', pa.float64()), ('year', pa.int32())],
+}
+
+# staging tables of the Airflow project (create_tables.sql): artist_name comes before the coordinates in staging_songs
+# and the decimal columns are numeric(18,0)
+AIRFLOW_NUMERIC = pa.decimal128(18, 0)
+AIRFLOW_COLUMNS = {
+    'staging_events': [(key, AIRFLOW_NUMERIC if key in ('length', 'registration') else arrow_type)
+                       for key, arrow_type in STAGING_COLUMNS['staging_events']],
+    'staging_songs': [('num_songs', pa.int32()), ('artist_id', pa.string()), ('artist_name', pa.string()),
+                      ('artist_latitude', AIRFLOW_NUMERIC), ('artist_longitude', AIRFLOW_NUMERIC),
+                      ('artist_location', pa.string()), ('song_id', pa.string()), ('title', pa.string()),
+                      ('duration', AIRFLOW_NUMERIC), ('year', pa.int32())],
+}
+
+# column order and types of the staging tables of each project (--target-schema)
+TARGET_SCHEMAS = {'warehouse': STAGING_COLUMNS, 'airflow': AIRFLOW_COLUMNS}
+
+EXTENSIONS = {'parquet': '.parquet', 'csv': '.csv', 'json': '.json'}
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def parse_value(value, arrow_type):
+
+    """
+    This function convert a JSON value to the type of its column (empty strings of numeric columns become NULL)
+
+    Arguments:
+    - value = value of the JSON record
+    - arrow_type = type of the column
+    """
+    if value is None or pa.types.is_string(arrow_type):
+        return value
+    if value == '':
+        return None
+    if pa.types.is_integer(arrow_type):
+        return int(value)
+    if pa.types.is_decimal(arrow_type):
+        return decimal.Decimal(str(value)).quantize(decimal.Decimal(1).scaleb(-arrow_type.scale),
+                                                    rounding=decimal.ROUND_HALF_UP)
+    return float(value)
+
+
+def read_records(data, table, target_schema='warehouse'):
+
+    """
+    This function read the records of a JSON file (one record per line, or a single record) into an arrow table
+
+    Arguments:
+    - data = content of the file (bytes)
+    - table = staging table of the records (staging_events or staging_songs)
+    - target_schema = project of the staging table (see TARGET_SCHEMAS): order and types of the columns
+    """
+    columns = TARGET_SCHEMAS[target_schema][table]
+    records = [json.loads(line) for line in data.decode('utf-8').splitlines() if line.strip()]
+
+    arrays = [pa.array([parse_value(record.get(key), arrow_type) for record in records], type=arrow_type)
+              for key, arrow_type in columns]
+    return pa.Table.from_arrays(arrays, names=[key for key, arrow_type in columns])
+
+
+def write_records(table, file_format, compression):
+
+    """
+    This function write an arrow table in the target format and return the content of the file (bytes)
+
+    Arguments:
+    - table = arrow table (see read_records)
+    - file_format = parquet, csv or json
+    - compression = zstd, gzip or none (parquet also accepts snappy)
+    """
+    sink = io.BytesIO()
+
+    if file_format == 'parquet':
+        pq.write_table(table, sink, compression=compression)
+        return sink.getvalue()
+
+    if file_format == 'csv':
+        pacsv.write_csv(table, sink, pacsv.WriteOptions(include_header=True))
+    else:
+        # the decimal columns (airflow target schema) are written as JSON numbers
+        sink.write(''.join(json.dumps(record, default=float) + '\n' for record in table.to_pylist()).encode('utf-8'))
+
+    if compression == 'none':
+        return sink.getvalue()
+
+    compressed = pa.BufferOutputStream()
+    with pa.CompressedOutputStream(compressed, compression) as stream:
+        stream.write(sink.getvalue())
+    return compressed.getvalue().to_pybytes()
+
+
+def get_target_path(source_path, file_format, compression):
+
+    """
+    This function return the relative path of the converted file
+
+    Arguments:
+    - source_path = relative path of the source file
+    - file_format = parquet, csv or json
+    - compression = compression of the target file
+    """
+    path = os.path.splitext(source_path)[0] + EXTENSIONS[file_format]
+    if file_format != 'parquet':
+        path += COMPRESSION_EXTENSIONS.get(compression, '')
+    return path
+
+
+def list_sources(client, source):
+
+    """
+    This function list the JSON files of a source and return a dictionary {relative path: size}
+
+    Arguments:
+    - client = S3 client (None for a local folder)
+    - source = S3 prefix or local folder
+    """
+    if source.startswith('s3://'):
+        bucket, prefix = parse_s3_path(source)
+        return {key[len(prefix):].lstrip('/'): size for key, size in list_objects(client, bucket, prefix).items()
+                if key.endswith('.json')}
+
+    return {os.path.relpath(os.path.join(root, name), source): os.path.getsize(os.path.join(root, name))
+            for root, dirs, files in os.walk(source) for name in files if name.endswith('.json')}
+
+
+def read_file(client, location, path):
+
+    """
+    This function read a file of a S3 prefix or a local folder
+
+    Arguments:
+    - client = S3 client (None for a local folder)
+    - location = S3 prefix or local folder
+    - path = relative path of the file
+    """
+    if location.startswith('s3://'):
+        bucket, prefix = parse_s3_path(location)
+        return client.get_object(Bucket=bucket, Key='/'.join(part for part in [prefix.rstrip('/'), path] if part))['Body'].read()
+
+    with open(os.path.join(location, path), 'rb') as f:
+        return f.read()
+
+
+def write_file(client, location, path, data):
+
+    """
+    This function write a file in a S3 prefix or a local folder
+
+    Arguments:
+    - client = S3 client (None for a local folder)
+    - location = S3 prefix or local folder
+    - path = relative path of the file
+    - data = content of the file (bytes)
+    """
+    if location.startswith('s3://'):
+        bucket, prefix = parse_s3_path(location)
+        client.put_object(Bucket=bucket, Key='/'.join(part for part in [prefix.rstrip('/'), path] if part), Body=data)
+        return
+
+    os.makedirs(os.path.dirname(os.path.join(location, path)), exist_ok=True)
+    with open(os.path.join(location, path), 'wb') as f:
+        f.write(data)
+
+
+def convert(client, source, target, table, file_format, compression, files_per_output=1, target_schema='warehouse'):
+
+    """
+    This function convert every JSON file of the source into the target format.
+    Returns the number of files, the bytes read and the bytes written.
+
+    Arguments:
+    - client = S3 client (None if the source and the target are local folders)
+    - source = S3 prefix or local folder of the JSON files
+    - target = S3 prefix or local folder of the converted files
+    - table = staging table of the records (staging_events or staging_songs)
+    - file_format = parquet, csv or json
+    - compression = zstd, gzip or none (parquet also accepts snappy)
+    - files_per_output = number of source files grouped in each converted file (1 keeps the paths of the sources)
+    - target_schema = project of the staging table (see TARGET_SCHEMAS): order and types of the columns
+    """
+    bytes_read = 0
+    bytes_written = 0
+    sources = list_sources(client, source)
+    paths = sorted(sources)
+
+    for start in range(0, len(paths), files_per_output):
+        group = paths[start:start + files_per_output]
+        records = pa.concat_tables([read_records(read_file(client, source, path), table, target_schema) for path in group])
+        data = write_records(records, file_format, compression)
+
+        target_path = group[0] if files_per_output == 1 else 'part-{:05d}.json'.format(start // files_per_output)
+        write_file(client, target, get_target_path(target_path, file_format, compression), data)
+
+        bytes_read += sum(sources[path] for path in group)
+        bytes_written += len(data)
+
+    return len(sources), bytes_read, bytes_written
+
+
+def main():
+
+    """
+    Convert the raw JSON files of a staging table and print the reduction of the bytes to copy
+    """
+    parser = argparse.ArgumentParser(description='Convert the raw JSON files into compressed files for COPY')
+    parser.add_argument('source', help='S3 prefix or local folder of the JSON files (ex: s3://udacity-dend/log_data)')
+    parser.add_argument('target', help='S3 prefix or local folder of the converted files (then LOG_DATA / SONG_DATA in dwh.cfg)')
+    parser.add_argument('--table', choices=sorted(STAGING_COLUMNS), default='staging_events', help='staging table of the files')
+    parser.add_argument('--format', choices=sorted(EXTENSIONS), default='parquet', help='format of the converted files')
+    parser.add_argument('--compression', choices=['zstd', 'gzip', 'snappy', 'none'], default='zstd',
+                        help='compression of the converted files (snappy only for parquet)')
+    parser.add_argument('--files-per-output', type=int, default=1,
+                        help='number of source files grouped in each converted file (ex: 1000 for song_data)')
+    parser.add_argument('--target-schema', choices=sorted(TARGET_SCHEMAS), default='warehouse',
+                        help='staging tables the files are loaded in: warehouse (sql_queries.py) or airflow (create_tables.sql)')
+    args = parser.parse_args()
+
+    if args.compression == 'snappy' and args.format != 'parquet':
+        parser.error('snappy is only available for parquet')
+
+    client = get_s3_client(load_config()) if 's3://' in (args.source + args.target) else None
+
+    start = time.perf_counter()
+    files, bytes_read, bytes_written = convert(client, args.source, args.target, args.table, args.format, args.compression,
+                                               args.files_per_output, args.target_schema)
+
+    print('{} files converted in {:.1f}s: {:.1f} MB of JSON -> {:.1f} MB of {} ({}), {:.1f}x fewer bytes to copy'.format(
+          files, time.perf_counter() - start, bytes_read / 1024 / 1024, bytes_written / 1024 / 1024,
+          args.format, args.compression, bytes_read / max(bytes_written, 1)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+This file runs a graph of queries on a pool of connections (see db.create_pool)
+ - each step is a tuple (name, query, names of the steps it depends on)
+ - a step starts as soon as all the steps it depends on are committed, on its own pooled connection
+ - at most max_concurrency steps run at the same time
+ - a step that fails is rolled back and the steps depending on it are not run
+The wall time of the whole graph is bounded by its critical path instead of the sum of the queries.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from db import pooled_connection
+
+
+def run_step(pool, name, query):
+
+    """
+    Run a query in its own transaction on a pooled connection and return its wall time in seconds
+
+    Arguments:
+    - pool = pool of connections (see db.create_pool)
+    - name = name of the step
+    - query = query to run
+    """
+    start = time.perf_counter()
+    with pooled_connection(pool) as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute(query)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return time.perf_counter() - start
+
+
+def run_queries(pool, steps, max_concurrency=4):
+
+    """
+    Run a graph of queries, each step starting when the steps it depends on are done.
+    Dependencies on steps that are not in the list are considered done.
+    Returns the wall time of each step (in seconds) and the errors by step name.
+
+    Arguments:
+    - pool = pool of connections (see db.create_pool)
+    - steps = list of (name, query, names of the steps it depends on)
+    - max_concurrency = maximum number of queries running at the same time
+    """
+    names = set(name for name, query, depends_on in steps)
+    pending = {name: (query, set(depends_on) & names) for name, query, depends_on in steps}
+
+    timings = {}
+    errors = {}
+    skipped = set()
+    running = {}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        while pending or running:
+
+            # skip the steps depending on a step that failed
+            for name, (query, depends_on) in list(pending.items()):
+                if depends_on & (set(errors) | skipped):
+                    skipped.add(name)
+                    del pending[name]
+                    print('    {:<20} skipped (depends on a failed step)'.format(name))
+
+            # start the steps whose dependencies are done
+            for name, (query, depends_on) in list(pending.items()):
+                if len(running) >= max_concurrency:
+                    break
+                if depends_on <= set(timings):
+                    running[executor.submit(run_step, pool, name, query)] = name
+                    del pending[name]
+
+            if not running:
+                # the remaining steps depend on each other
+                for name in pending:
+                    skipped.add(name)
+                    print('    {:<20} skipped (circular dependency)'.format(name))
+                break
+
+            done, not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    timings[name] = future.result()
+                    print('    {:<20} done in {:.2f}s'.format(name, timings[name]))
+                except Exception as e:
+                    errors[name] = e
+                    print('    {:<20} failed: {}'.format(name, e))
+
+    print('{} queries done in {:.2f}s (sum of the queries: {:.2f}s), {} failed, {} skipped'.format(
+          len(timings), time.perf_counter() - start, sum(timings.values()), len(errors), len(skipped)))
+
+    return timings, errors
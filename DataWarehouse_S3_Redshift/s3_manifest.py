@@ -0,0 +1,160 @@
+"""
+This file prepares the incremental loads of the staging tables (etl.py --incremental)
+ - the objects under a S3 prefix are listed (only their keys and sizes, nothing is read)
+ - the listing is compared with the keys already loaded, kept in a JSON file (LOADED_KEYS_FILE in dwh.cfg)
+ - a COPY manifest listing only the new objects is written under MANIFEST_PATH, so COPY reads only those objects
+ - the keys are marked as loaded once the COPY is committed
+The S3 endpoint can be changed (ENDPOINT_URL in dwh.cfg) to run against MinIO or moto.
+The functions from parse_s3_path to prepare_manifest are also used by the Airflow plugins
+(DataPipeline_ApacheAirflow/plugins/helpers/s3_manifest.py, deployed on their own): change both files together.
+"""
+import os
+import json
+import boto3
+
+
+def get_s3_client(config):
+
+    """
+    Create the S3 client (ENDPOINT_URL of the [S3] section for MinIO, default AWS endpoint otherwise)
+
+    Arguments:
+    - config = configuration of the project (see db.load_config)
+    """
+    endpoint_url = config.get('S3', 'ENDPOINT_URL', fallback='').strip("'") or None
+    return boto3.client('s3', endpoint_url=endpoint_url)
+
+
+def parse_s3_path(path):
+
+    """
+    Split a S3 path into its bucket and its key (or prefix)
+
+    Arguments:
+    - path = S3 path (ex: 's3://udacity-dend/log_data')
+    """
+    path = path.strip("'")
+    if not path.startswith('s3://'):
+        raise ValueError('Not a S3 path: {}'.format(path))
+
+    bucket, _, key = path[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def list_objects(client, bucket, prefix):
+
+    """
+    List the objects under a prefix and return a dictionary {key: size in bytes}
+
+    Arguments:
+    - client = S3 client
+    - bucket = name of the bucket
+    - prefix = prefix of the keys
+    """
+    objects = {}
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if not obj['Key'].endswith('/') and obj['Size'] > 0:
+                objects[obj['Key']] = obj['Size']
+
+    return objects
+
+
+def get_new_objects(objects, loaded_keys):
+
+    """
+    Return the objects that were not loaded yet as a sorted list of (key, size)
+
+    Arguments:
+    - objects = dictionary {key: size} (see list_objects)
+    - loaded_keys = keys already loaded
+    """
+    loaded_keys = set(loaded_keys)
+    return sorted((key, size) for key, size in objects.items() if key not in loaded_keys)
+
+
+def load_loaded_keys(path):
+
+    """
+    Read the keys already loaded in each staging table ({table: [keys]})
+
+    Arguments:
+    - path = path to the JSON file
+    """
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_loaded_keys(path, loaded_keys):
+
+    """
+    Save the keys already loaded in each staging table.
+    The file is replaced atomically so an interrupted run never leaves a partial list.
+
+    Arguments:
+    - path = path to the JSON file
+    - loaded_keys = dictionary {table: [keys]}
+    """
+    with open(path + '.tmp', 'w') as f:
+        json.dump({table: sorted(keys) for table, keys in loaded_keys.items()}, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def build_manifest(bucket, objects):
+
+    """
+    Build a COPY manifest for a list of objects. Every entry is mandatory: COPY fails if an object is missing.
+
+    Arguments:
+    - bucket = name of the bucket of the objects
+    - objects = list of (key, size)
+    """
+    return {'entries': [{'url': 's3://{}/{}'.format(bucket, key),
+                         'mandatory': True,
+                         'meta': {'content_length': size}} for key, size in objects]}
+
+
+def write_manifest(client, manifest_path, name, manifest):
+
+    """
+    Upload a manifest under manifest_path and return its S3 path (used in FROM '...' MANIFEST)
+
+    Arguments:
+    - client = S3 client
+    - manifest_path = S3 folder of the manifests (ex: 's3://my-bucket/manifests')
+    - name = file name of the manifest
+    - manifest = manifest (see build_manifest)
+    """
+    bucket, prefix = parse_s3_path(manifest_path)
+    key = '/'.join(part for part in [prefix.rstrip('/'), name] if part)
+    client.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest).encode('utf-8'))
+
+    return 's3://{}/{}'.format(bucket, key)
+
+
+def prepare_manifest(client, source, loaded_keys, manifest_path, name):
+
+    """
+    List a source, keep the new objects and write their manifest.
+    Returns the S3 path of the manifest and the new keys (None and [] if there is nothing new).
+
+    Arguments:
+    - client = S3 client
+    - source = S3 prefix of the source (ex: 's3://udacity-dend/log_data/2018/11/2018-11-12')
+    - loaded_keys = keys of the source already loaded
+    - manifest_path = S3 folder of the manifests
+    - name = file name of the manifest
+    """
+    bucket, prefix = parse_s3_path(source)
+    objects = get_new_objects(list_objects(client, bucket, prefix), loaded_keys)
+    if not objects:
+        return None, []
+
+    manifest = write_manifest(client, manifest_path, name, build_manifest(bucket, objects))
+    print('    {}: {} new objects ({:.1f} MB) listed in {}'.format(source, len(objects),
+                                                                   sum(size for key, size in objects) / 1024 / 1024, manifest))
+    return manifest, [key for key, size in objects]
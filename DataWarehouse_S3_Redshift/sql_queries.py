@@ -19,6 +19,49 @@ LOG_DATA = config['S3']['LOG_DATA']
 LOG_JSONPATH = config['S3']['LOG_JSONPATH']
 SONG_DATA = config['S3']['SONG_DATA']
 
+# FORMAT OF THE SOURCES: json (raw files), csv or parquet (see prestage.py), compressed with gzip or zstd (json and csv)
+LOG_FORMAT = config.get('S3', 'LOG_FORMAT', fallback='json')
+LOG_COMPRESSION = config.get('S3', 'LOG_COMPRESSION', fallback='none')
+SONG_FORMAT = config.get('S3', 'SONG_FORMAT', fallback='json')
+SONG_COMPRESSION = config.get('S3', 'SONG_COMPRESSION', fallback='none')
+
+# the Parquet files are read by position and must be in the region of the cluster (no REGION option)
+# the nulls of the CSV files are empty fields: EMPTYASNULL loads them as NULL in the text columns too (like JSON)
+COPY_FORMATS = {'json': "REGION 'us-west-2' FORMAT as json {}",
+                'csv': "REGION 'us-west-2' FORMAT as csv IGNOREHEADER 1 EMPTYASNULL",
+                'parquet': "FORMAT as parquet"}
+COPY_COMPRESSIONS = {'none': '', 'gzip': 'GZIP', 'zstd': 'ZSTD'}
+
+
+def copy_format(file_format, compression, json_option):
+    """
+    Return the format options of a COPY (the compression of the Parquet files is read from the files)
+    """
+    if file_format not in COPY_FORMATS or compression not in COPY_COMPRESSIONS:
+        raise ValueError('Unknown source format: {} ({})'.format(file_format, compression))
+
+    options = COPY_FORMATS[file_format].format(json_option)
+    if file_format != 'parquet' and COPY_COMPRESSIONS[compression]:
+        options += ' ' + COPY_COMPRESSIONS[compression]
+    return options
+
+
+# DISTRIBUTION AND SORT KEYS
+# - songplays and songs are distributed on song_id: their join does not move any row between the nodes
+# - the small dimensions (users, artists, time) are copied on every node (DISTSTYLE ALL)
+# - songplays is sorted on start_time: the queries on a period only read the blocks of that period
+# - the staging tables are distributed on the columns joined by songplay_table_insert (song title)
+# Each table can be changed in the [DISTRIBUTION] section of dwh.cfg (ex: time=DISTKEY(start_time) SORTKEY(start_time))
+DEFAULT_DISTRIBUTION = {'staging_events': 'DISTKEY(song)',
+                        'staging_songs': 'DISTKEY(title)',
+                        'songplays': 'DISTKEY(song_id) SORTKEY(start_time)',
+                        'users': 'DISTSTYLE ALL SORTKEY(user_id)',
+                        'songs': 'DISTKEY(song_id) SORTKEY(song_id)',
+                        'artists': 'DISTSTYLE ALL SORTKEY(artist_id)',
+                        'time': 'DISTSTYLE ALL SORTKEY(start_time)'}
+
+DISTRIBUTION = {table: config.get('DISTRIBUTION', table, fallback=default) for table, default in DEFAULT_DISTRIBUTION.items()}
+
 # DROP TABLES
 
 staging_events_table_drop = "DROP TABLE IF EXISTS staging_events"
@@ -49,7 +92,7 @@ staging_events_table_create= ("""CREATE TABLE IF NOT EXISTS staging_events (
                                 status              int, 
                                 ts                  bigint,
                                 userAgent           text,
-                                userId              int        )""")
+                                userId              int        ) {}""").format(DISTRIBUTION['staging_events'])
 
 staging_songs_table_create = ("""CREATE TABLE IF NOT EXISTS staging_songs (
                                 num_songs           int,
@@ -61,7 +104,7 @@ staging_songs_table_create = ("""CREATE TABLE IF NOT EXISTS staging_songs (
                                 song_id             text,
                                 title               text,
                                 duration            float,  
-                                year                int         )""")
+                                year                int         ) {}""").format(DISTRIBUTION['staging_songs'])
 
 songplay_table_create = ("""CREATE TABLE IF NOT EXISTS songplays (
                                 songplay_id int          IDENTITY(0,1), 
@@ -72,28 +115,28 @@ songplay_table_create = ("""CREATE TABLE IF NOT EXISTS songplays (
                                 artist_id   text, 
                                 session_id  int,
                                 location    text,
-                                user_agent  text) """)
+                                user_agent  text) {}""").format(DISTRIBUTION['songplays'])
 
 user_table_create = ("""CREATE TABLE IF NOT EXISTS users (
                                 user_id     int   PRIMARY KEY,
                                 first_name  text,
                                 last_name   text,
                                 gender      text, 
-                                level       text) """)
+                                level       text) {}""").format(DISTRIBUTION['users'])
 
 song_table_create = ("""CREATE TABLE IF NOT EXISTS songs (
                                 song_id     text   PRIMARY KEY,
                                 title       text,
                                 artist_id   text,
                                 year        int,
-                                duration    float) """)
+                                duration    float) {}""").format(DISTRIBUTION['songs'])
 
 artist_table_create = ("""CREATE TABLE IF NOT EXISTS artists (
                                 artist_id   text   PRIMARY KEY, 
                                 name        text, 
                                 location    text, 
                                 latitude    float, 
-                                longitude   float) """)
+                                longitude   float) {}""").format(DISTRIBUTION['artists'])
 
 time_table_create = ("""CREATE TABLE IF NOT EXISTS time (
                                 start_time  timestamp  PRIMARY KEY,
@@ -102,20 +145,35 @@ time_table_create = ("""CREATE TABLE IF NOT EXISTS time (
                                 week        int,
                                 month       int,
                                 year        int,
-                                weekday     int) """)
+                                weekday     int) {}""").format(DISTRIBUTION['time'])
 
 # STAGING TABLES
 
 staging_events_copy = ("""  COPY staging_events 
                             FROM {}
                             CREDENTIALS 'aws_iam_role={}'
-                            REGION 'us-west-2'
-                            FORMAT as json {};   """).format(LOG_DATA,IAM_ROLE,LOG_JSONPATH)
+                            {};   """).format(LOG_DATA, IAM_ROLE, copy_format(LOG_FORMAT, LOG_COMPRESSION, LOG_JSONPATH))
 
 staging_songs_copy = ("""   COPY staging_songs 
                             FROM {}
-                            CREDENTIALS 'aws_iam_role={}'                            REGION 'us-west-2'
-                            JSON 'auto';         """).format(SONG_DATA, IAM_ROLE)
+                            CREDENTIALS 'aws_iam_role={}'
+                            {};         """).format(SONG_DATA, IAM_ROLE, copy_format(SONG_FORMAT, SONG_COMPRESSION, "'auto'"))
+
+# INCREMENTAL STAGING: the staging table is emptied and only the objects listed in a manifest are copied (FROM takes the manifest path)
+
+staging_events_manifest_copy = ("""  DELETE FROM staging_events;
+                                     COPY staging_events
+                                     FROM '{{}}'
+                                     CREDENTIALS 'aws_iam_role={}'
+                                     {}
+                                     MANIFEST;   """).format(IAM_ROLE, copy_format(LOG_FORMAT, LOG_COMPRESSION, LOG_JSONPATH))
+
+staging_songs_manifest_copy = ("""   DELETE FROM staging_songs;
+                                     COPY staging_songs
+                                     FROM '{{}}'
+                                     CREDENTIALS 'aws_iam_role={}'
+                                     {}
+                                     MANIFEST;   """).format(IAM_ROLE, copy_format(SONG_FORMAT, SONG_COMPRESSION, "'auto'"))
 
 # FINAL TABLES
 
@@ -135,6 +193,24 @@ songplay_table_insert = ("""INSERT INTO songplays (start_time, user_id, level, s
                             WHERE logs.page = 'NextSong'
 """)
 
+# incremental loads: staging_songs only holds the new songs, the events are matched with the songs and artists already loaded
+songplay_table_incremental_insert = ("""INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+                            SELECT DISTINCT
+                                TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second' as start_time,
+                                logs.userId,
+                                logs.level,
+                                songs.song_id,
+                                songs.artist_id,
+                                logs.sessionId,
+                                logs.location,
+                                logs.useragent
+
+                            FROM songs
+                            JOIN artists ON artists.artist_id = songs.artist_id
+                            JOIN staging_events AS logs ON logs.song = songs.title AND logs.artist = artists.name
+                            WHERE logs.page = 'NextSong'
+""")
+
 user_table_insert = ("""INSERT INTO users (user_id, first_name, last_name, gender, level)
                         SELECT DISTINCT 
                                 userId,
@@ -178,6 +254,49 @@ time_table_insert = ("""INSERT INTO time (start_time, hour, day, week, month, ye
                         
                         FROM staging_events     """)
 
+# MERGE OF THE DIMENSIONS (etl.py with DIMENSION_LOAD=merge)
+# In one transaction: the new rows are staged in a temporary table, the rows of the dimension with the same key
+# are deleted, then the staged rows are inserted (one row per key). Loading the same data again does not add any row.
+
+dimension_merge = ("""CREATE TEMP TABLE {table}_stage (LIKE {table});
+
+                      {insert};
+
+                      DELETE FROM {table}
+                      USING {table}_stage
+                      WHERE {table}.{key} = {table}_stage.{key};
+
+                      INSERT INTO {table}
+                      SELECT {columns}
+                      FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY {key}) AS stage_rank
+                            FROM {table}_stage) AS stage
+                      WHERE stage_rank = 1;
+
+                      DROP TABLE {table}_stage;   """)
+
+# a user has several levels in the logs (free then paid): the level of the last event is kept
+user_table_merge_insert = ("""INSERT INTO users_stage (user_id, first_name, last_name, gender, level)
+                              SELECT userId, firstName, lastName, gender, level
+                              FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) AS event_rank
+                                    FROM staging_events
+                                    WHERE page = 'NextSong' AND userId IS NOT NULL) AS events
+                              WHERE event_rank = 1   """)
+
+user_table_merge = dimension_merge.format(table='users', key='user_id', insert=user_table_merge_insert,
+                                          columns='user_id, first_name, last_name, gender, level')
+
+song_table_merge = dimension_merge.format(table='songs', key='song_id',
+                                          insert=song_table_insert.replace('INTO songs', 'INTO songs_stage', 1),
+                                          columns='song_id, title, artist_id, year, duration')
+
+artist_table_merge = dimension_merge.format(table='artists', key='artist_id',
+                                            insert=artist_table_insert.replace('INTO artists', 'INTO artists_stage', 1),
+                                            columns='artist_id, name, location, latitude, longitude')
+
+time_table_merge = dimension_merge.format(table='time', key='start_time',
+                                          insert=time_table_insert.replace('INTO time', 'INTO time_stage', 1),
+                                          columns='start_time, hour, day, week, month, year, weekday')
+
 # QUERY LISTS
 
 create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
@@ -186,4 +305,29 @@ drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songp
 
 copy_table_queries = [staging_events_copy, staging_songs_copy]
 
-insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
\ No newline at end of file
+insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
+
+dimension_merge_queries = {'users': user_table_merge, 'songs': song_table_merge, 'artists': artist_table_merge, 'time': time_table_merge}
+
+# QUERY GRAPH (name, query, steps it depends on): steps without dependency between them can run at the same time
+
+copy_table_steps = [('staging_events', staging_events_copy, []),
+                    ('staging_songs', staging_songs_copy, [])]
+
+insert_table_steps = [('songplays', songplay_table_insert, ['staging_events', 'staging_songs']),
+                      ('users', user_table_insert, ['staging_events']),
+                      ('songs', song_table_insert, ['staging_songs']),
+                      ('artists', artist_table_insert, ['staging_songs']),
+                      ('time', time_table_insert, ['staging_events'])]
+
+# incremental loads (etl.py --incremental): the manifest COPY are formatted with the path of their manifest,
+# an INSERT runs only if one of the staging tables it reads was reloaded
+
+manifest_copy_queries = {'staging_events': staging_events_manifest_copy,
+                         'staging_songs': staging_songs_manifest_copy}
+
+incremental_insert_table_steps = [('songplays', songplay_table_incremental_insert, ['staging_events', 'songs', 'artists']),
+                                  ('users', user_table_insert, ['staging_events']),
+                                  ('songs', song_table_insert, ['staging_songs']),
+                                  ('artists', artist_table_insert, ['staging_songs']),
+                                  ('time', time_table_insert, ['staging_events'])]
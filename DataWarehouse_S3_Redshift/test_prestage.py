@@ -0,0 +1,79 @@
+"""
+Tests of prestage.py: every --format is converted for every --target-schema and read back
+"""
+import io
+import json
+import decimal
+
+import pytest
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from prestage import TARGET_SCHEMAS, EXTENSIONS, convert
+
+
+EVENTS = [
+    {'artist': 'Des\'ree', 'auth': 'Logged In', 'firstName': 'Kaylee', 'gender': 'F', 'itemInSession': 1,
+     'lastName': 'Summers', 'length': 246.30812, 'level': 'free', 'location': 'Phoenix-Mesa-Scottsdale, AZ',
+     'method': 'PUT', 'page': 'NextSong', 'registration': 1540344794796.0, 'sessionId': 139, 'song': 'You Gotta Be',
+     'status': 200, 'ts': 1541106106796, 'userAgent': 'Mozilla/5.0', 'userId': '8'},
+    {'artist': None, 'auth': 'Logged In', 'firstName': 'Kaylee', 'gender': 'F', 'itemInSession': 2,
+     'lastName': 'Summers', 'length': None, 'level': 'free', 'location': 'Phoenix-Mesa-Scottsdale, AZ',
+     'method': 'GET', 'page': 'Upgrade', 'registration': 1540344794796.0, 'sessionId': 139, 'song': None,
+     'status': 200, 'ts': 1541106132796, 'userAgent': 'Mozilla/5.0', 'userId': ''},
+]
+
+SONG = {'num_songs': 1, 'artist_id': 'ARD7TVE1187B99BFB1', 'artist_latitude': 35.14968, 'artist_longitude': -90.04892,
+        'artist_location': 'California - LA', 'artist_name': 'Casual', 'song_id': 'SOMZWCG12A8C13C480',
+        'title': "I Didn't Mean To", 'duration': 218.93179, 'year': 0}
+
+
+def read_back(path, file_format, compression):
+
+    """
+    Read a converted file into an arrow table (columns as written)
+
+    Arguments:
+    - path = path of the converted file
+    - file_format = parquet, csv or json
+    - compression = compression of the converted file
+    """
+    if file_format == 'parquet':
+        return pq.read_table(str(path))
+
+    with pa.CompressedInputStream(pa.OSFile(str(path)), compression) as stream:
+        data = stream.read()
+
+    if file_format == 'csv':
+        return pacsv.read_csv(io.BytesIO(data))
+    return pa.Table.from_pylist([json.loads(line) for line in data.decode('utf-8').splitlines()])
+
+
+@pytest.mark.parametrize('target_schema', sorted(TARGET_SCHEMAS))
+@pytest.mark.parametrize('file_format', sorted(EXTENSIONS))
+@pytest.mark.parametrize('table', ['staging_events', 'staging_songs'])
+def test_convert_every_format_and_schema(tmp_path, table, file_format, target_schema):
+    source = tmp_path / 'source'
+    (source / 'a').mkdir(parents=True)
+    records = EVENTS if table == 'staging_events' else [SONG]
+    (source / 'a' / 'part.json').write_text(''.join(json.dumps(record) + '\n' for record in records))
+
+    compression = 'zstd' if file_format == 'parquet' else 'gzip'
+    files, bytes_read, bytes_written = convert(None, str(source), str(tmp_path / 'target'), table,
+                                               file_format, compression, target_schema=target_schema)
+
+    assert files == 1 and bytes_read > 0 and bytes_written > 0
+    extension = EXTENSIONS[file_format] + ('' if file_format == 'parquet' else '.gz')
+    converted = read_back(tmp_path / 'target' / 'a' / ('part' + extension), file_format, compression)
+
+    # same rows, columns in the order of the staging table of the target project
+    columns = [key for key, arrow_type in TARGET_SCHEMAS[target_schema][table]]
+    assert converted.num_rows == len(records)
+    assert converted.column_names == columns
+
+    # the decimal columns of the airflow schema are rounded to numeric(18,0)
+    if table == 'staging_songs':
+        duration = converted.column('duration')[0].as_py()
+        expected = decimal.Decimal(219) if target_schema == 'airflow' else SONG['duration']
+        assert duration == expected
@@ -0,0 +1,68 @@
+"""
+Tests of the incremental staging (s3_manifest.py) against moto.
+The same cases run on the Airflow helper (DataPipeline_ApacheAirflow/tests/test_s3_manifest.py).
+"""
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from s3_manifest import get_new_objects, prepare_manifest
+
+
+MANIFEST_PATH = 's3://manifests/dwh'
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket='source')
+        client.create_bucket(Bucket='manifests')
+        for key in ['log_data/2018/11/a.json', 'log_data/2018/11/b.json']:
+            client.put_object(Bucket='source', Key=key, Body=b'{}')
+        yield client
+
+
+def read_manifest(client, manifest):
+    bucket, key = manifest[len('s3://'):].split('/', 1)
+    return json.loads(client.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+
+def test_get_new_objects():
+    objects = {'b': 2, 'a': 1, 'c': 3}
+    assert get_new_objects(objects, []) == [('a', 1), ('b', 2), ('c', 3)]
+    assert get_new_objects(objects, ['a', 'c', 'old']) == [('b', 2)]
+    assert get_new_objects(objects, objects) == []
+
+
+def test_first_run_lists_every_key(client):
+    manifest, keys = prepare_manifest(client, 's3://source/log_data', [], MANIFEST_PATH, 'run1.manifest')
+
+    assert manifest == 's3://manifests/dwh/run1.manifest'
+    assert keys == ['log_data/2018/11/a.json', 'log_data/2018/11/b.json']
+    assert read_manifest(client, manifest) == {'entries': [
+        {'url': 's3://source/log_data/2018/11/a.json', 'mandatory': True, 'meta': {'content_length': 2}},
+        {'url': 's3://source/log_data/2018/11/b.json', 'mandatory': True, 'meta': {'content_length': 2}}]}
+
+
+def test_second_run_lists_only_new_keys(client):
+    manifest, loaded_keys = prepare_manifest(client, 's3://source/log_data', [], MANIFEST_PATH, 'run1.manifest')
+    client.put_object(Bucket='source', Key='log_data/2018/11/c.json', Body=b'{"a": 1}')
+
+    manifest, keys = prepare_manifest(client, 's3://source/log_data', loaded_keys, MANIFEST_PATH, 'run2.manifest')
+
+    assert keys == ['log_data/2018/11/c.json']
+    assert [entry['url'] for entry in read_manifest(client, manifest)['entries']] == ['s3://source/log_data/2018/11/c.json']
+
+
+def test_nothing_new_writes_no_manifest(client):
+    loaded_keys = ['log_data/2018/11/a.json', 'log_data/2018/11/b.json']
+    client.put_object(Bucket='source', Key='log_data/2018/11/empty.json', Body=b'')
+
+    assert prepare_manifest(client, 's3://source/log_data', loaded_keys, MANIFEST_PATH, 'run3.manifest') == (None, [])
+    assert 'Contents' not in client.list_objects_v2(Bucket='manifests')